@@ -6,16 +6,90 @@ check empty values in existing tables.
 """
 
 import os
-import sys
-from datetime import datetime
-from sqlalchemy import ForeignKey, Column, String, Integer, Date, DECIMAL, create_engine, update, and_
+import json
+import time
+import shutil
+import tempfile
+from datetime import datetime, date, timedelta
+from sqlalchemy import ForeignKey, Column, String, Integer, Date, DECIMAL, update, and_, or_
+from sqlalchemy import select, text, func, Index, bindparam, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import table as sql_table, column as sql_column
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 import pandas as pd
 
-# Base class for SQL objects to extent
-Base = declarative_base()
+import database_engine
+from marking_matcher import MarkingMatcher, normalize_marking
+from report_reader import read_report
+
+class TableFrame:
+
+    """
+    This class is a mixin of the table classes that fills table objects
+    from the dataframe columns listed in frame_columns of every table.
+
+    - frame_renames maps the columns to the dataframe names differing from them;
+
+    - frame_dates lists the columns parsed from 'YYYY-MM-DD' strings;
+
+    - frame_values holds the constant values of the columns;
+
+    """
+
+    frame_columns = []
+    frame_renames = {}
+    frame_dates = []
+    frame_values = {}
+
+    def __init__(self, dataframe_table, row_index):
+
+        for column_name in self.frame_columns:
+
+            value = dataframe_table.at[row_index,
+                                       self.frame_renames.get(column_name, column_name)]
+
+            if column_name in self.frame_dates:
+
+                value = datetime.strptime(value, '%Y-%m-%d').date()
+
+            setattr(self, column_name, value)
+
+        for column_name, value in self.frame_values.items():
+
+            setattr(self, column_name, value)
+
+    @classmethod
+    def from_frame(cls, dataframe_table):
+
+        """
+        This function turns the dataframe into a list of column dictionaries
+        for the executemany-style insert, working on whole columns:
+        the dates are parsed column-wise and the values are converted
+        to python types at once instead of a lookup per attribute.
+
+        """
+
+        frame_records = pd.DataFrame({column_name:dataframe_table[cls.frame_renames.get(column_name,
+                                                                                        column_name)]
+                                      for column_name in cls.frame_columns},
+                                     index=dataframe_table.index)
+
+        for column_name in cls.frame_dates:
+
+            frame_records[column_name] = pd.to_datetime(frame_records[column_name],
+                                                        format='%Y-%m-%d').dt.date
+
+        for column_name, value in cls.frame_values.items():
+
+            frame_records[column_name] = value
+
+        return frame_records.to_dict('records')
+
+# Base class for SQL objects to extent,
+# the tables are filled by TableFrame instead of the keyword constructor
+Base = declarative_base(cls=TableFrame, constructor=None)
 
 border_line = '🂱 ♠ 🂱 ♥️ 🂱 ♣️ 🂱 ♦️ 🂱 ♠ 🂱 ♥️ 🂱 ♣️ 🂱 ♦️ 🂱 ♠ 🂱 ♥️ 🂱 '
 border_line += '🂱 ♠ 🂱 ♥️ 🂱 ♣️ 🂱 ♦️ 🂱 ♠ 🂱 ♥️ 🂱 ♣️ 🂱 ♦️ 🂱 ♠ 🂱 ♥️ 🂱 '
@@ -36,10 +110,8 @@ class Companies(Base):
 
     __table_args__ = (UniqueConstraint('company_id', 'company_name'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.company_name = dataframe_table['company_name'][row_index]
-        self.company_address = dataframe_table['company_address'][row_index]
-        self.company_branch = dataframe_table['company_branch'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['company_name', 'company_address', 'company_branch']
 
     def __repr__(self):
         return (f"COMPANIES\n"
@@ -63,10 +135,10 @@ class CurrencyUsd(Base):
 
     __table_args__ = (UniqueConstraint('currency_usd_id', 'currency_date'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.currency_date = dataframe_table['currency_date'][row_index]
-        self.currency_rate = dataframe_table['currency_rate'][row_index]
-        self.currency_type = 'usd'
+    # Columns filled from the dataframe
+    frame_columns = ['currency_date', 'currency_rate']
+
+    frame_values = {'currency_type':'usd'}
 
     def __repr__(self):
         return (f"CURRENCY USD\n"
@@ -90,10 +162,10 @@ class CurrencyEur(Base):
 
     __table_args__ = (UniqueConstraint('currency_eur_id', 'currency_date'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.currency_date = dataframe_table['currency_date'][row_index]
-        self.currency_rate = dataframe_table['currency_rate'][row_index]
-        self.currency_type = 'eur'
+    # Columns filled from the dataframe
+    frame_columns = ['currency_date', 'currency_rate']
+
+    frame_values = {'currency_type':'eur'}
 
     def __repr__(self):
         return (f"CURRENCY EUR\n"
@@ -139,35 +211,39 @@ class Customers(Base):
     customer_trans_markup = Column('customer_trans_markup', DECIMAL)
 
     __table_args__ = (UniqueConstraint('customer_id', 'customer_name',
-                                       'customer_phone', 'customer_email'),)
-
-    def __init__(self, dataframe_table, row_index):
-        self.customer_name = dataframe_table['customer_name'][row_index]
-        self.customer_address = dataframe_table['customer_address'][row_index]
-        self.customer_phone = dataframe_table['customer_phone'][row_index]
-        self.customer_email = dataframe_table['customer_email'][row_index]
-        self.customer_cons_kg = dataframe_table['customer_cons_kg_price'][row_index]
-        self.customer_eq_kg = dataframe_table['customer_eq_kg_price'][row_index]
-        self.customer_ken_kg = dataframe_table['customer_ken_kg_price'][row_index]
-        self.customer_col_kg = dataframe_table['customer_col_kg_price'][row_index]
-        self.customer_isr_kg = dataframe_table['customer_isr_kg_price'][row_index]
-        self.customer_isr_pallet = dataframe_table['customer_isr_pallet_price'][row_index]
-        self.customer_holl_pallet = dataframe_table['customer_holl_pallet_price'][row_index]
-        self.customer_preecool_kg = dataframe_table['customer_preecool_kg_price'][row_index]
-        self.customer_preecool_awb = dataframe_table['customer_preecool_awb_price'][row_index]
-        self.customer_flight_kg = dataframe_table['customer_flight_kg_price'][row_index]
-        self.customer_troll = dataframe_table['customer_troll_price'][row_index]
-        self.customer_bulb_pallet = dataframe_table['customer_bulb_pallet_price'][row_index]
-        self.customer_rus_eq_full = dataframe_table['customer_rus_eq_full_price'][row_index]
-        self.customer_rus_else_full = dataframe_table['customer_rus_else_full_price'][row_index]
-        self.customer_rus_big_box = dataframe_table['customer_rus_big_box_price'][row_index]
-        self.customer_rus_small_box = dataframe_table['customer_rus_small_box_price'][row_index]
-        self.customer_dollar_trans_rate = dataframe_table['customer_dollar_trans_rate'][row_index]
-        self.customer_euro_trans_rate = dataframe_table['customer_euro_trans_rate'][row_index]
-        self.customer_dollar_flow_rate = dataframe_table['customer_dollar_flow_rate'][row_index]
-        self.customer_euro_flow_rate = dataframe_table['customer_euro_flow_rate'][row_index]
-        self.customer_flow_markup = dataframe_table['customer_flow_markup'][row_index]
-        self.customer_trans_markup = dataframe_table['customer_trans_markup'][row_index]
+                                       'customer_phone', 'customer_email'),
+                      Index('ix_customers_name', 'customer_name'))
+
+    # Columns filled from the dataframe
+    frame_columns = ['customer_name', 'customer_address', 'customer_phone',
+                     'customer_email', 'customer_cons_kg', 'customer_eq_kg',
+                     'customer_ken_kg', 'customer_col_kg', 'customer_isr_kg',
+                     'customer_isr_pallet', 'customer_holl_pallet', 'customer_preecool_kg',
+                     'customer_preecool_awb', 'customer_flight_kg', 'customer_troll',
+                     'customer_bulb_pallet', 'customer_rus_eq_full',
+                     'customer_rus_else_full', 'customer_rus_big_box',
+                     'customer_rus_small_box', 'customer_dollar_trans_rate',
+                     'customer_euro_trans_rate', 'customer_dollar_flow_rate',
+                     'customer_euro_flow_rate', 'customer_flow_markup',
+                     'customer_trans_markup']
+
+    # Dataframe names of the columns named differently
+    frame_renames = {'customer_cons_kg':'customer_cons_kg_price',
+                     'customer_eq_kg':'customer_eq_kg_price',
+                     'customer_ken_kg':'customer_ken_kg_price',
+                     'customer_col_kg':'customer_col_kg_price',
+                     'customer_isr_kg':'customer_isr_kg_price',
+                     'customer_isr_pallet':'customer_isr_pallet_price',
+                     'customer_holl_pallet':'customer_holl_pallet_price',
+                     'customer_preecool_kg':'customer_preecool_kg_price',
+                     'customer_preecool_awb':'customer_preecool_awb_price',
+                     'customer_flight_kg':'customer_flight_kg_price',
+                     'customer_troll':'customer_troll_price',
+                     'customer_bulb_pallet':'customer_bulb_pallet_price',
+                     'customer_rus_eq_full':'customer_rus_eq_full_price',
+                     'customer_rus_else_full':'customer_rus_else_full_price',
+                     'customer_rus_big_box':'customer_rus_big_box_price',
+                     'customer_rus_small_box':'customer_rus_small_box_price'}
 
     def __repr__(self):
         return (f"CUSTOMERS\n"
@@ -213,12 +289,12 @@ class Markings(Base):
     marking_name = Column('marking_name', String, nullable=False)
     customer_id = Column(Integer, ForeignKey('customers.customer_id'))
 
-    __table_args__ = (UniqueConstraint('marking_id', 'marking_name'),)
+    __table_args__ = (UniqueConstraint('marking_id', 'marking_name'),
+                      Index('ix_markings_name', 'marking_name'),
+                      Index('ix_markings_customer', 'customer_id'))
 
-    def __init__(self, dataframe_table, row_index):
-        self.marking_customer = dataframe_table['marking_customer'][row_index]
-        self.marking_customer_address = dataframe_table['marking_customer_address'][row_index]
-        self.marking_name = dataframe_table['marking_name'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['marking_customer', 'marking_customer_address', 'marking_name']
 
     def __repr__(self):
         return (f"MARKINGS\n"
@@ -242,9 +318,8 @@ class Suppliers(Base):
 
     __table_args__ = (UniqueConstraint('supplier_id', 'supplier_name'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.supplier_name = dataframe_table['supplier_name'][row_index]
-        self.supplier_country = dataframe_table['supplier_country'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['supplier_name', 'supplier_country']
 
     def __repr__(self):
         return (f"SUPPLIERS\n"
@@ -267,10 +342,8 @@ class BoxType(Base):
 
     __table_args__ = (UniqueConstraint('box_type_id', 'box_name'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.box_name = dataframe_table['box_name'][row_index]
-        self.box_per_pallet = dataframe_table['box_per_pallet'][row_index]
-        self.box_type_accountable = dataframe_table['box_type_accountable'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['box_name', 'box_per_pallet', 'box_type_accountable']
 
     def __repr__(self):
         return (f"BOX TYPE\n"
@@ -294,10 +367,8 @@ class FlowerType(Base):
 
     __table_args__ = (UniqueConstraint('flower_id', 'flower_name'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.flower_name = dataframe_table['flower_name'][row_index]
-        self.flower_type = dataframe_table['flower_type'][row_index]
-        self.flower_plantation = dataframe_table['flower_plantation'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['flower_name', 'flower_type', 'flower_plantation']
 
     def __repr__(self):
         return (f"FLOWER TYPE\n"
@@ -323,12 +394,9 @@ class Managers(Base):
 
     __table_args__ = (UniqueConstraint('manager_id', 'manager_name'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.manager_name = dataframe_table['manager_name'][row_index]
-        self.manager_birth = dataframe_table['manager_birth'][row_index]
-        self.manager_salary = dataframe_table['manager_salary'][row_index]
-        self.manager_sales_perc = dataframe_table['manager_sales_perc'][row_index]
-        self.company_id = dataframe_table['company_id'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['manager_name', 'manager_birth', 'manager_salary',
+                     'manager_sales_perc', 'company_id']
 
     def __repr__(self):
         return (f"MANAGERS\n"
@@ -357,13 +425,9 @@ class Cars(Base):
 
     __table_args__ = (UniqueConstraint('car_id', 'car_plate'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.car_brand = dataframe_table['car_brand'][row_index]
-        self.car_plate = dataframe_table['car_plate'][row_index]
-        self.car_year = dataframe_table['car_year'][row_index]
-        self.car_mileage = dataframe_table['car_mileage'][row_index]
-        self.car_capacity = dataframe_table['car_capacity'][row_index]
-        self.company_id = dataframe_table['company_id'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['car_brand', 'car_plate', 'car_year', 'car_mileage', 'car_capacity',
+                     'company_id']
 
     def __repr__(self):
         return (f"CARS\n"
@@ -397,16 +461,10 @@ class Drivers(Base):
     __table_args__ = (UniqueConstraint('driver_id', 'driver_name', 'driver_phone',
                                        'driver_email', 'driver_passport', 'driver_license'),)
 
-    def __init__(self, dataframe_table, row_index):
-        self.driver_name = dataframe_table['driver_name'][row_index]
-        self.driver_phone = dataframe_table['driver_phone'][row_index]
-        self.driver_email = dataframe_table['driver_email'][row_index]
-        self.driver_passport = dataframe_table['driver_passport'][row_index]
-        self.driver_address = dataframe_table['driver_address'][row_index]
-        self.driver_license = dataframe_table['driver_license'][row_index]
-        self.driver_birth = dataframe_table['driver_birth'][row_index]
-        self.driver_salary = dataframe_table['driver_salary'][row_index]
-        self.company_id = dataframe_table['company_id'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['driver_name', 'driver_phone', 'driver_email', 'driver_passport',
+                     'driver_address', 'driver_license', 'driver_birth', 'driver_salary',
+                     'company_id']
 
     def __repr__(self):
         return (f"DRIVERS\n"
@@ -439,12 +497,9 @@ class Trips(Base):
     driver_id = Column(Integer, ForeignKey('drivers.driver_id'))
     company_id = Column(Integer, ForeignKey('companies.company_id'))
 
-    def __init__(self, dataframe_table, row_index):
-        self.trip_destination = dataframe_table['trip_destination'][row_index]
-        self.trip_date = dataframe_table['trip_date'][row_index]
-        self.trip_mileage_m = dataframe_table['trip_mileage_m'][row_index]
-        self.trip_total_expense = dataframe_table['trip_total_expense'][row_index]
-        self.trip_allowance = dataframe_table['trip_allowance'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['trip_destination', 'trip_date', 'trip_mileage_m',
+                     'trip_total_expense', 'trip_allowance']
 
     def __repr__(self):
         return (f"TRIPS\n"
@@ -478,12 +533,9 @@ class ShipmentsContent(Base):
     supplier_id = Column(Integer, ForeignKey('suppliers.supplier_id'))
     shipment_id = Column(Integer, ForeignKey('shipments.shipment_id'))
 
-    def __init__(self, dataframe_table, row_index):
-        self.content_invoice_date = dataframe_table['content_invoice_date'][row_index]
-        self.content_amount = dataframe_table['content_amount'][row_index]
-        self.content_price = dataframe_table['content_price'][row_index]
-        self.content_total = dataframe_table['content_total'][row_index]
-        self.content_currency = dataframe_table['content_currency'][row_index]
+    # Columns filled from the dataframe
+    frame_columns = ['content_invoice_date', 'content_amount', 'content_price',
+                     'content_total', 'content_currency']
 
     def __repr__(self):
         return (f"TRIPS\n"
@@ -538,22 +590,25 @@ class Shipments(Base):
     content_invoice_id = Column(Integer, ForeignKey('shipments_content.content_invoice_id'))
     company_id = Column(Integer, ForeignKey('companies.company_id'))
 
-    def __init__(self, dataframe_table, row_index):
-        self.shipment_box_amount = dataframe_table['shipment_box_amount'][row_index]
-        self.shipment_date = datetime.strptime(dataframe_table['shipment_date'][row_index], '%Y-%m-%d').date()
-        self.shipment_box_full = dataframe_table['shipment_box_full'][row_index]
-        self.shipment_weight_fact = dataframe_table['shipment_weight_fact'][row_index]
-        self.shipment_weight_vol = dataframe_table['shipment_weight_vol'][row_index]
-        self.shipment_volume = dataframe_table['shipment_volume'][row_index]
-        self.shipment_marking = dataframe_table['shipment_marking'][row_index]
-        self.shipment_awb = dataframe_table['shipment_awb'][row_index]
-        self.shipment_country = dataframe_table['shipment_country'][row_index]
-        self.shipment_supplier = dataframe_table['shipment_supplier'][row_index]
-        self.shipment_truck_name = dataframe_table['shipment_truck_name'][row_index]
-        self.shipment_forever_balance = dataframe_table['shipment_forever_balance'][row_index]
-        self.shipment_comment = dataframe_table['shipment_comment'][row_index]
-        self.shipment_status = dataframe_table['shipment_status'][row_index]
-        self.shipment_truck_balance = dataframe_table['shipment_truck_balance'][row_index]
+    __table_args__ = (Index('ux_shipments_natural_key', 'shipment_awb', 'shipment_marking',
+                            'shipment_box_full', 'shipment_truck_name', 'shipment_weight_vol',
+                            unique=True),
+                      Index('ix_shipments_marking', 'shipment_marking', 'shipment_box_full'))
+
+    # Columns refreshed by a repeated import of a known shipment
+    manual_columns = ['shipment_ams_arrival', 'shipment_msc_arrival', 'shipment_rstv_arrival',
+                      'shipment_krd_arrival', 'shipment_arm_arrival', 'shipment_status',
+                      'shipment_truck_balance']
+
+    # Columns filled from the dataframe
+    frame_columns = ['shipment_box_amount', 'shipment_date', 'shipment_box_full',
+                     'shipment_weight_fact', 'shipment_weight_vol', 'shipment_volume',
+                     'shipment_marking', 'shipment_awb', 'shipment_country',
+                     'shipment_supplier', 'shipment_truck_name',
+                     'shipment_forever_balance', 'shipment_comment', 'shipment_status',
+                     'shipment_truck_balance']
+
+    frame_dates = ['shipment_date']
 
     def __repr__(self):
         return (f"SHIPMENTS\n"
@@ -594,13 +649,11 @@ class Shipments(Base):
         This function fills manually updated values in the table 'shipments'
         """
 
-        self.shipment_ams_arrival = dataframe_table['shipment_ams_arrival'][row_index]
-        self.shipment_msc_arrival = dataframe_table['shipment_msc_arrival'][row_index]
-        self.shipment_rstv_arrival = dataframe_table['shipment_rstv_arrival'][row_index]
-        self.shipment_krd_arrival = dataframe_table['shipment_krd_arrival'][row_index]
-        self.shipment_arm_arrival = dataframe_table['shipment_arm_arrival'][row_index]
-        self.shipment_status = dataframe_table['shipment_status'][row_index]
-        self.shipment_truck_balance = dataframe_table['shipment_truck_balance'][row_index]
+        for column_name in self.manual_columns:
+
+            if column_name in dataframe_table.columns:
+
+                setattr(self, column_name, dataframe_table[column_name][row_index])
 
 class OperationsSales(Base):
 
@@ -644,19 +697,16 @@ class OperationsSales(Base):
     company_id = Column(Integer, ForeignKey('companies.company_id'))
     supplier_id  = Column(Integer, ForeignKey('suppliers.supplier_id'))
 
-    def __init__(self, dataframe_table, row_index):
-        self.sale_date = datetime.strptime(dataframe_table['sale_date'][row_index], '%Y-%m-%d').date()
-        self.sale_type = dataframe_table['sale_type'][row_index]
-        self.sale_marking = dataframe_table['sale_marking'][row_index]
-        self.sale_content_supplier = dataframe_table['sale_content_supplier'][row_index]
-        self.sale_total_usd = dataframe_table['sale_total_usd'][row_index]
-        self.sale_total_eur = dataframe_table['sale_total_eur'][row_index]
-        self.sale_currency = dataframe_table['sale_currency'][row_index]
-        self.sale_volume = dataframe_table['sale_volume'][row_index]
-        self.sale_weight = dataframe_table['sale_weight'][row_index]
-        self.sale_awb = dataframe_table['sale_awb'][row_index]
-        self.supplier_id = dataframe_table['supplier_id'][row_index]
-        self.sale_full_box = dataframe_table['sale_full_box'][row_index]
+    __table_args__ = (Index('ix_operations_sales_natural_key', 'sale_awb', 'sale_marking',
+                            'sale_full_box', 'sale_date'),
+                      Index('ix_operations_sales_marking', 'sale_marking'))
+
+    # Columns filled from the dataframe
+    frame_columns = ['sale_date', 'sale_type', 'sale_marking', 'sale_content_supplier',
+                     'sale_total_usd', 'sale_total_eur', 'sale_currency', 'sale_volume',
+                     'sale_weight', 'sale_awb', 'supplier_id', 'sale_full_box']
+
+    frame_dates = ['sale_date']
 
     def __repr__(self):
         return (f"SALES\n"
@@ -731,23 +781,20 @@ class OperationsForever(Base):
     manager_id = Column(Integer, ForeignKey('managers.manager_id'))
     sale_id = Column(Integer, ForeignKey('operations_sales.sale_id'))
 
-    def __init__(self, dataframe_table, row_index):
-        self.expense_date = datetime.strptime(dataframe_table['expense_date'][row_index], '%Y-%m-%d').date()
-        self.expense_type = dataframe_table['expense_type'][row_index]
-        self.expense_total_usd = dataframe_table['expense_total_usd'][row_index]
-        self.expense_total_eur = dataframe_table['expense_total_eur'][row_index]
-        self.expense_total_rub = dataframe_table['expense_total_rub'][row_index]
-        self.expense_currency = dataframe_table['expense_currency'][row_index]
-        self.expense_currency_rate = dataframe_table['expense_currency_rate'][row_index]
-        self.expense_awb = dataframe_table['expense_awb'][row_index]
-        self.expense_content_supplier = dataframe_table['expense_content_supplier'][row_index]
-        self.expense_marking = dataframe_table['expense_marking'][row_index]
-        self.expense_full_box = dataframe_table['expense_full_box'][row_index]
-        self.expense_weight = dataframe_table['expense_weight'][row_index]
-        self.expense_volume = dataframe_table['expense_volume'][row_index]
-        self.expense_balance_code = dataframe_table['expense_balance_code'][row_index]
-        self.expense_balance_currency = dataframe_table['expense_balance_currency'][row_index]
-        self.supplier_id  = dataframe_table['supplier_id'][row_index]
+    __table_args__ = (Index('ix_operations_forever_natural_key', 'expense_awb', 'expense_marking',
+                            'expense_full_box', 'expense_date'),
+                      Index('ix_operations_forever_marking', 'expense_marking'),
+                      Index('ix_operations_forever_shipment', 'shipment_id'))
+
+    # Columns filled from the dataframe
+    frame_columns = ['expense_date', 'expense_type', 'expense_total_usd',
+                     'expense_total_eur', 'expense_total_rub', 'expense_currency',
+                     'expense_currency_rate', 'expense_awb', 'expense_content_supplier',
+                     'expense_marking', 'expense_full_box', 'expense_weight',
+                     'expense_volume', 'expense_balance_code', 'expense_balance_currency',
+                     'supplier_id']
+
+    frame_dates = ['expense_date']
 
     def __repr__(self):
         return (f"EXPENSES FOREVER\n"
@@ -809,17 +856,18 @@ class OperationsIphandlers(Base):
     company_id = Column(Integer, ForeignKey('companies.company_id'))
     sale_id = Column(Integer, ForeignKey('operations_sales.sale_id'))
 
-    def __init__(self, dataframe_table, row_index):
-        self.expense_eta_date = datetime.strptime(dataframe_table['expense_eta_date'][row_index], '%Y-%m-%d').date()
-        self.expense_load_date = dataframe_table['expense_load_date'][row_index]
-        self.expense_account = dataframe_table['expense_account'][row_index]
-        self.expense_total = dataframe_table['expense_total'][row_index]
-        self.expense_currency = 'eur'
-        self.expense_awb = dataframe_table['expense_awb'][row_index]
-        self.expense_marking = dataframe_table['expense_marking'][row_index]
-        self.expense_box = dataframe_table['expense_box'][row_index]
-        self.expense_full_box = dataframe_table['expense_full_box'][row_index]
-        self.expense_weight = dataframe_table['expense_weight'][row_index]
+    __table_args__ = (Index('ix_operations_iphandlers_natural_key', 'expense_awb',
+                            'expense_marking', 'expense_full_box', 'expense_eta_date'),
+                      Index('ix_operations_iphandlers_marking', 'expense_marking'))
+
+    # Columns filled from the dataframe
+    frame_columns = ['expense_eta_date', 'expense_load_date', 'expense_account',
+                     'expense_total', 'expense_awb', 'expense_marking', 'expense_box',
+                     'expense_full_box', 'expense_weight']
+
+    frame_dates = ['expense_eta_date']
+
+    frame_values = {'expense_currency':'eur'}
 
     def __repr__(self):
         return (f"EXPENSES IPHANDLERS\n"
@@ -843,363 +891,391 @@ class OperationsIphandlers(Base):
                 f"Company's ID: {self.company_id},\n"
                 f"Sale ID: {self.sale_id}\n")
 
-def create_table(dataframe_intro, table_class, session_current):
+class ReviewQueue(Base):
+
+    """
+    This class allows to create and manipulate table named 'review_queue'
+    in the SQL database, the records left unlinked by the automatic linking
+    with their candidates waiting for an operator's decision
+    """
+
+    __tablename__ = 'review_queue'
+
+    review_id = Column('review_id', Integer, primary_key=True, nullable=False)
+    review_date = Column('review_date', Date, nullable=False)
+    review_table = Column('review_table', String, nullable=False)
+    review_record_id = Column('review_record_id', Integer, nullable=False)
+    review_link = Column('review_link', String, nullable=False)
+    review_marking = Column('review_marking', String)
+    review_candidates = Column('review_candidates', String)
+    review_decision = Column('review_decision', String)
+    review_status = Column('review_status', String, nullable=False)
+
+    __table_args__ = (Index('ux_review_queue_record', 'review_table', 'review_record_id',
+                            'review_link', unique=True),
+                      Index('ix_review_queue_status', 'review_status'))
+
+    def __repr__(self):
+        return (f"REVIEW QUEUE\n"
+                f"ID: {self.review_id},\n"
+                f"Date: {self.review_date},\n"
+                f"Table: {self.review_table},\n"
+                f"Record's ID: {self.review_record_id},\n"
+                f"Link: {self.review_link},\n"
+                f"Marking: {self.review_marking},\n"
+                f"Candidates: {self.review_candidates},\n"
+                f"Decision: {self.review_decision},\n"
+                f"Status: {self.review_status}\n")
+
+class LinkSkips(Base):
 
     """
-    This function creates a table based on the Class and dataframe provided
+    This class allows to create and manipulate table named 'link_skips'
+    in the SQL database, the records skipped or deferred by an operator
+    in the linking loops
+    """
+
+    __tablename__ = 'link_skips'
 
+    skip_id = Column('skip_id', Integer, primary_key=True, nullable=False)
+    skip_date = Column('skip_date', Date, nullable=False)
+    skip_table = Column('skip_table', String, nullable=False)
+    skip_record_id = Column('skip_record_id', Integer, nullable=False)
+    skip_link = Column('skip_link', String, nullable=False)
+    skip_status = Column('skip_status', String, nullable=False)
+
+    __table_args__ = (Index('ux_link_skips_record', 'skip_table', 'skip_record_id',
+                            'skip_link', unique=True),)
+
+    def __repr__(self):
+        return (f"LINK SKIPS\n"
+                f"ID: {self.skip_id},\n"
+                f"Date: {self.skip_date},\n"
+                f"Table: {self.skip_table},\n"
+                f"Record's ID: {self.skip_record_id},\n"
+                f"Link: {self.skip_link},\n"
+                f"Status: {self.skip_status}\n")
+
+class LinkLeases(Base):
+
+    """
+    This class allows to create and manipulate table named 'link_leases'
+    in the SQL database, the records claimed by the operators linking
+    them at the same time, a lease is valid until lease_expires (unix time)
+    and its version grows every time the record is claimed again
     """
 
-    queries = []
+    __tablename__ = 'link_leases'
 
-    # Check if it is a duplicate of a record
-    for ind in dataframe_intro.index:
-
-        result_duplicate = ''
-
-        if table_class == OperationsForever:
-
-            query_duplicate = session_current.query(OperationsForever).filter(and_(
-                              OperationsForever.expense_awb == dataframe_intro
-                                                               .at[ind, 'expense_awb'],
-                              OperationsForever.expense_marking == dataframe_intro
-                                                                   .at[ind, 'expense_marking'],
-                              OperationsForever.expense_full_box == dataframe_intro
-                                                                    .at[ind, 'expense_full_box'],
-                              OperationsForever.expense_date == dataframe_intro
-                                                                .at[ind, 'expense_date']
-                                                                ))
-
-            result_duplicate = query_duplicate.first()
-
-        elif table_class == OperationsIphandlers:
-
-            query_duplicate = session_current.query(OperationsIphandlers).filter(and_(
-                              OperationsIphandlers.expense_awb == dataframe_intro
-                                                                  .at[ind, 'expense_awb'],
-                              OperationsIphandlers.expense_marking == dataframe_intro
-                                                                      .at[ind, 'expense_marking'],
-                              OperationsIphandlers.expense_full_box == dataframe_intro
-                                                                       .at[ind, 'expense_full_box'],
-                              OperationsIphandlers.expense_eta_date == dataframe_intro
-                                                                       .at[ind, 'expense_eta_date']
-                                                                       ))
-
-            result_duplicate = query_duplicate.first()
-
-        elif table_class == OperationsSales:
-
-            query_duplicate = session_current.query(OperationsSales).filter(and_(
-                              OperationsSales.sale_awb == dataframe_intro
-                                                          .at[ind, 'sale_awb'],
-                              OperationsSales.sale_marking == dataframe_intro
-                                                              .at[ind, 'sale_marking'],
-                              OperationsSales.sale_full_box == dataframe_intro
-                                                               .at[ind, 'sale_full_box'],
-                              OperationsSales.sale_date == dataframe_intro
-                                                           .at[ind, 'sale_date']
-                                                           ))
-
-            result_duplicate = query_duplicate.first()
-
-        elif table_class == Shipments:
-
-            query_duplicate = session_current.query(Shipments).filter(and_(
-                              Shipments.shipment_awb == dataframe_intro
-                                                        .at[ind, 'shipment_awb'],
-                              Shipments.shipment_marking == dataframe_intro
-                                                            .at[ind, 'shipment_marking'],
-                              Shipments.shipment_box_full == dataframe_intro
-                                                             .at[ind, 'shipment_box_full'],
-                              Shipments.shipment_truck_name == dataframe_intro
-                                                               .at[ind, 'shipment_truck_name'],
-                              Shipments.shipment_weight_vol == dataframe_intro
-                                                               .at[ind, 'shipment_weight_vol']
-                                                               ))
-
-            result_duplicate = query_duplicate.first()
-
-        elif table_class == Markings:
-
-            query_duplicate = session_current.query(Markings).filter(
-                              Markings.marking_name == dataframe_intro
-                                                        .at[ind, 'marking_name']
-                                                        )
-
-            result_duplicate = query_duplicate.first()
-
-        if (result_duplicate is None or
-            result_duplicate == '' or
-            result_duplicate == 'None'):
+    lease_id = Column('lease_id', Integer, primary_key=True, nullable=False)
+    lease_table = Column('lease_table', String, nullable=False)
+    lease_record_id = Column('lease_record_id', Integer, nullable=False)
+    lease_link = Column('lease_link', String, nullable=False)
+    lease_operator = Column('lease_operator', String, nullable=False)
+    lease_expires = Column('lease_expires', Integer, nullable=False)
+    lease_version = Column('lease_version', Integer, nullable=False)
 
-            table = table_class(dataframe_intro, ind)
+    __table_args__ = (Index('ux_link_leases_record', 'lease_table', 'lease_record_id',
+                            'lease_link', unique=True),)
 
-            session_current.add(table)
+    def __repr__(self):
+        return (f"LINK LEASES\n"
+                f"ID: {self.lease_id},\n"
+                f"Table: {self.lease_table},\n"
+                f"Record's ID: {self.lease_record_id},\n"
+                f"Link: {self.lease_link},\n"
+                f"Operator: {self.lease_operator},\n"
+                f"Expires: {self.lease_expires},\n"
+                f"Version: {self.lease_version}\n")
+
+# Columns identifying a duplicate record of the table
+duplicate_keys = {OperationsForever:['expense_awb', 'expense_marking',
+                                     'expense_full_box', 'expense_date'],
+                  OperationsIphandlers:['expense_awb', 'expense_marking',
+                                        'expense_full_box', 'expense_eta_date'],
+                  OperationsSales:['sale_awb', 'sale_marking',
+                                   'sale_full_box', 'sale_date'],
+                  Shipments:['shipment_awb', 'shipment_marking', 'shipment_box_full',
+                             'shipment_truck_name', 'shipment_weight_vol'],
+                  Markings:['marking_name']}
+
+def filter_duplicates(dataframe_intro, table_class, session_current):
 
-            session_current.commit()
+    """
+    This function drops the dataframe rows that duplicate an existing record
+    or an earlier row of the same dataframe. Duplicate keys of the whole dataframe
+    are loaded into a temporary staging table and resolved with one join
+    against the table instead of one query per row.
+
+    Returns the filtered dataframe, the count of dropped rows and
+    the primary keys of the existing records that were matched.
+
+    """
+
+    if (table_class not in duplicate_keys or
+        dataframe_intro.empty):
+
+        return dataframe_intro, 0, []
+
+    keys = duplicate_keys[table_class]
+
+    target = table_class.__table__
+
+    dialect = session_current.get_bind().dialect
+
+    # Staging columns get the types of the table to compare values the same way
+    key_columns = ', '.join(f'{key} {target.c[key].type.compile(dialect=dialect)}'
+                            for key in keys)
+
+    session_current.execute(text('DROP TABLE IF EXISTS temp.staging_keys'))
+    session_current.execute(text('CREATE TEMPORARY TABLE staging_keys '
+                                 f'(row_num INTEGER PRIMARY KEY, {key_columns})'))
+    session_current.execute(text('CREATE INDEX temp.staging_keys_index '
+                                 f'ON staging_keys ({", ".join(keys)})'))
+
+    staging = sql_table('staging_keys', sql_column('row_num'),
+                        *[sql_column(key) for key in keys])
+
+    earlier = staging.alias('earlier')
+
+    key_rows = dataframe_intro[keys].to_dict('records')
+
+    for row_num, key_row in enumerate(key_rows):
+
+        key_row['row_num'] = row_num
+
+    session_current.execute(staging.insert(), key_rows)
+
+    # Rows matching a record of the table and the primary key of the record
+    existing_matches = session_current.execute(select(staging.c.row_num,
+                                                      table_class.__mapper__.primary_key[0])
+                                               .join(target, and_(
+                                               *[target.c[key].is_not_distinct_from(staging.c[key])
+                                                 for key in keys]))).all()
+
+    # Rows matching an earlier row of the dataframe, empty keys are equal (SQLite IS)
+    earlier_rows = select(staging.c.row_num).join(earlier, and_(
+                   earlier.c.row_num < staging.c.row_num,
+                   *[earlier.c[key].is_not_distinct_from(staging.c[key]) for key in keys]))
+
+    duplicate_rows = {row_num for row_num, _ in existing_matches}
+
+    duplicate_rows.update(session_current.execute(earlier_rows).scalars())
+
+    existing_ids = sorted({record_id for _, record_id in existing_matches})
+
+    session_current.execute(text('DROP TABLE temp.staging_keys'))
+
+    dataframe_unique = dataframe_intro.drop(dataframe_intro.index[sorted(duplicate_rows)])
+
+    return dataframe_unique, len(duplicate_rows), existing_ids
+
+def linkage_queries(table_class, first_id, last_id):
+
+    """
+    This function returns the update statements linking the records
+    of the table with primary keys from first_id to last_id to the other tables.
+    Values are resolved with joins (UPDATE ... FROM) instead of correlated
+    subqueries, so only the given records are read and updated.
+
+    New markings and shipments also link the earlier records of the other
+    tables still left without a customer or a shipment.
+
+    """
+
+    queries = []
 
-    # Fill the queries based on which table is being created
     if table_class == OperationsForever:
 
-        # Dictionary of queries
-        queries = [update(OperationsForever).values(customer_id=session_current
-                    .query(Markings.customer_id)
-                    .filter(Markings.marking_name == OperationsForever.expense_marking)
-                    .as_scalar())
-                    .where(OperationsForever.customer_id.is_(None)),
-
-                    update(OperationsForever).values(expense_customer=session_current
-                    .query(Customers.customer_name)
-                    .filter(Customers.customer_id == OperationsForever.customer_id)
-                    .as_scalar())
-                    .where(OperationsForever.expense_customer.is_(None)),
-
-                    update(OperationsForever).values(shipment_id=session_current
-                    .query(Shipments.shipment_id)
-                    .filter(and_(
+        batch = OperationsForever.expense_forever_id.between(first_id, last_id)
+
+        # List of OPERATIONS_FOREVER queries
+        queries = [update(OperationsForever).values(customer_id=Markings.customer_id)
+                    .where(and_(
+                        batch,
+                        OperationsForever.customer_id.is_(None),
+                        Markings.marking_name == OperationsForever.expense_marking)),
+
+                    update(OperationsForever).values(expense_customer=Customers.customer_name)
+                    .where(and_(
+                        batch,
+                        OperationsForever.expense_customer.is_(None),
+                        Customers.customer_id == OperationsForever.customer_id)),
+
+                    update(OperationsForever).values(shipment_id=Shipments.shipment_id)
+                    .where(and_(
+                        batch,
+                        OperationsForever.shipment_id.is_(None),
                         Shipments.expense_forever_id.is_(None),
                         Shipments.shipment_awb == OperationsForever.expense_awb,
                         Shipments.shipment_box_full == OperationsForever.expense_full_box,
-                        Shipments.shipment_marking == OperationsForever.expense_marking
-                    ))
-                    .as_scalar())
-                    .where(OperationsForever.shipment_id.is_(None)),
-
-                    update(OperationsForever).values(shipment_id=session_current
-                    .query(Shipments.shipment_id)
-                    .filter(and_(
+                        Shipments.shipment_marking == OperationsForever.expense_marking)),
+
+                    update(OperationsForever).values(shipment_id=Shipments.shipment_id)
+                    .where(and_(
+                        batch,
+                        OperationsForever.shipment_id.is_(None),
                         Shipments.expense_forever_id.is_(None),
                         Shipments.shipment_marking == OperationsForever.expense_marking,
-                        Shipments.shipment_awb == OperationsForever.expense_awb))
-                    .as_scalar())
-                    .where(OperationsForever.shipment_id.is_(None)),
-
-                    update(Shipments).values(expense_forever_id=session_current
-                    .query(OperationsForever.expense_forever_id)
-                    .filter(OperationsForever.shipment_id == Shipments.shipment_id)
-                    .as_scalar())
-                    .where(Shipments.expense_forever_id.is_(None)),
-
-                    update(OperationsForever).values(expense_country=session_current
-                    .query(Shipments.shipment_country)
-                    .filter(
-                        Shipments.shipment_id == OperationsForever.shipment_id)
-                    .as_scalar())
-                    .where(OperationsForever.expense_country.is_(None))
+                        Shipments.shipment_awb == OperationsForever.expense_awb)),
+
+                    update(Shipments).values(expense_forever_id=OperationsForever.expense_forever_id)
+                    .where(and_(
+                        batch,
+                        Shipments.expense_forever_id.is_(None),
+                        OperationsForever.shipment_id == Shipments.shipment_id)),
+
+                    update(OperationsForever).values(expense_country=Shipments.shipment_country)
+                    .where(and_(
+                        batch,
+                        OperationsForever.expense_country.is_(None),
+                        Shipments.shipment_id == OperationsForever.shipment_id))
                     ]
 
     elif table_class == OperationsIphandlers:
 
-        # Dictionary of queries
-        queries = [update(OperationsIphandlers).values(customer_id=session_current
-                    .query(Markings.customer_id)
-                    .filter(Markings.marking_name == OperationsIphandlers.customer_id)
-                    .as_scalar())
-                    .where(OperationsIphandlers.customer_id.is_(None)),
-
-                    update(OperationsIphandlers).values(expense_customer=session_current
-                    .query(Customers.customer_name)
-                    .filter(Customers.customer_id == OperationsIphandlers.customer_id)
-                    .as_scalar())
-                    .where(OperationsIphandlers.expense_customer.is_(None)),
-
-                    update(OperationsIphandlers).values(shipment_id=session_current
-                    .query(Shipments.shipment_id)
-                    .filter(and_(
+        batch = OperationsIphandlers.expense_ip_id.between(first_id, last_id)
+
+        # List of OPERATIONS_IPHANDLERS queries
+        queries = [update(OperationsIphandlers).values(customer_id=Markings.customer_id)
+                    .where(and_(
+                        batch,
+                        OperationsIphandlers.customer_id.is_(None),
+                        Markings.marking_name == OperationsIphandlers.expense_marking)),
+
+                    update(OperationsIphandlers).values(expense_customer=Customers.customer_name)
+                    .where(and_(
+                        batch,
+                        OperationsIphandlers.expense_customer.is_(None),
+                        Customers.customer_id == OperationsIphandlers.customer_id)),
+
+                    update(OperationsIphandlers).values(shipment_id=Shipments.shipment_id)
+                    .where(and_(
+                        batch,
+                        OperationsIphandlers.shipment_id.is_(None),
                         Shipments.expense_ip_id.is_(None),
                         Shipments.shipment_awb == OperationsIphandlers.expense_awb,
-                        Shipments.shipment_marking == OperationsIphandlers.expense_marking
-                    ))
-                    .as_scalar())
-                    .where(OperationsIphandlers.shipment_id.is_(None)),
-
-                    update(Shipments).values(expense_ip_id=session_current
-                    .query(OperationsIphandlers.expense_ip_id)
-                    .filter(OperationsIphandlers.shipment_id == Shipments.shipment_id)
-                    .as_scalar())
-                    .where(Shipments.expense_ip_id.is_(None))
+                        Shipments.shipment_marking == OperationsIphandlers.expense_marking)),
+
+                    update(Shipments).values(expense_ip_id=OperationsIphandlers.expense_ip_id)
+                    .where(and_(
+                        batch,
+                        Shipments.expense_ip_id.is_(None),
+                        OperationsIphandlers.shipment_id == Shipments.shipment_id))
                     ]
 
     elif table_class == OperationsSales:
 
-        # Dictionary of OPERATIONS_SALES queries
-        queries = [update(OperationsSales).values(customer_id=session_current
-                    .query(Markings.customer_id)
-                    .filter(Markings.marking_name == OperationsSales.sale_marking)
-                    .as_scalar())
-                    .where(OperationsSales.customer_id.is_(None)),
-
-                    update(OperationsSales).values(sale_customer=session_current
-                    .query(Customers.customer_name)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(OperationsSales.sale_customer.is_(None)),
-
-                    update(OperationsSales).values(shipment_id=session_current
-                    .query(OperationsForever.shipment_id)
-                    .filter(and_(
+        batch = OperationsSales.sale_id.between(first_id, last_id)
+
+        # Prices taken from the customer's card: price column + customer's price + type + country
+        customer_prices = [[OperationsSales.sale_price_kg, Customers.customer_cons_kg,
+                            '%консолидат%', 'ec'],
+                           [OperationsSales.sale_price_pallet, Customers.customer_holl_pallet,
+                            '%срезка%', 'den'],
+                           [OperationsSales.sale_price_troll, Customers.customer_troll,
+                            '%телег%', 'den'],
+                           [OperationsSales.sale_price_kg, Customers.customer_eq_kg,
+                            '%срезка%', 'ec'],
+                           [OperationsSales.sale_price_kg, Customers.customer_col_kg,
+                            '%срезка%', 'co'],
+                           [OperationsSales.sale_price_kg, Customers.customer_ken_kg,
+                            '%срезка%', 'ke'],
+                           [OperationsSales.sale_price_pallet, Customers.customer_holl_pallet,
+                            '%срезка%', 'nl'],
+                           [OperationsSales.sale_price_troll, Customers.customer_troll,
+                            '%телег%', 'nl'],
+                           [OperationsSales.sale_price_kg, Customers.customer_isr_kg,
+                            '%весу%', 'il'],
+                           [OperationsSales.sale_price_pallet, Customers.customer_isr_pallet,
+                            '%объему%', 'il']]
+
+        # List of OPERATIONS_SALES queries
+        queries = [update(OperationsSales).values(customer_id=Markings.customer_id)
+                    .where(and_(
+                        batch,
+                        OperationsSales.customer_id.is_(None),
+                        Markings.marking_name == OperationsSales.sale_marking)),
+
+                    update(OperationsSales).values(sale_customer=Customers.customer_name)
+                    .where(and_(
+                        batch,
+                        OperationsSales.sale_customer.is_(None),
+                        Customers.customer_id == OperationsSales.customer_id)),
+
+                    update(OperationsSales).values(shipment_id=OperationsForever.shipment_id)
+                    .where(and_(
+                        batch,
+                        OperationsSales.shipment_id.is_(None),
                         OperationsForever.expense_awb == OperationsSales.sale_awb,
                         OperationsForever.expense_full_box == OperationsSales.sale_full_box,
-                        OperationsForever.expense_marking == OperationsSales.sale_marking
-                    ))
-                    .as_scalar())
-                    .where(OperationsSales.shipment_id.is_(None)),
-
-                    update(OperationsSales).values(expense_forever_id=session_current
-                    .query(OperationsForever.expense_forever_id)
-                    .filter(and_(
+                        OperationsForever.expense_marking == OperationsSales.sale_marking)),
+
+                    update(OperationsSales)
+                    .values(expense_forever_id=OperationsForever.expense_forever_id)
+                    .where(and_(
+                        batch,
+                        OperationsSales.expense_forever_id.is_(None),
+                        OperationsSales.supplier_id == 2,
                         OperationsForever.expense_awb == OperationsSales.sale_awb,
                         OperationsForever.expense_full_box == OperationsSales.sale_full_box,
-                        OperationsForever.expense_marking == OperationsSales.sale_marking,
-                        OperationsSales.supplier_id == 2
-                    ))
-                    .as_scalar())
-                    .where(OperationsSales.expense_forever_id.is_(None)),
-
-                    update(OperationsSales).values(expense_ip_id=session_current
-                    .query(OperationsIphandlers.expense_ip_id)
-                    .filter(and_(
+                        OperationsForever.expense_marking == OperationsSales.sale_marking)),
+
+                    update(OperationsSales).values(expense_ip_id=OperationsIphandlers.expense_ip_id)
+                    .where(and_(
+                        batch,
+                        OperationsSales.expense_ip_id.is_(None),
+                        OperationsSales.supplier_id == 5,
                         OperationsIphandlers.expense_awb == OperationsSales.sale_awb,
                         OperationsIphandlers.expense_full_box == OperationsSales.sale_full_box,
-                        OperationsIphandlers.expense_marking == OperationsSales.sale_marking,
-                        OperationsSales.supplier_id == 5
-                    ))
-                    .as_scalar())
-                    .where(OperationsSales.expense_ip_id.is_(None)),
-
-                    update(OperationsSales).values(sale_country=session_current
-                    .query(Shipments.shipment_country)
-                    .filter(
-                        Shipments.shipment_id == OperationsSales.shipment_id)
-                    .as_scalar())
-                    .where(OperationsSales.sale_country.is_(None)),
-
-                    update(OperationsSales).values(sale_currency_markup=session_current
-                    .query(Customers.customer_dollar_trans_rate)
-                    .filter(
-                        Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_currency_markup.is_(None),
-                        OperationsSales.sale_currency == 'usd')),
+                        OperationsIphandlers.expense_marking == OperationsSales.sale_marking)),
 
-                    update(OperationsSales).values(sale_currency_markup=session_current
-                    .query(Customers.customer_euro_trans_rate)
-                    .filter(
-                        Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
+                    update(OperationsSales).values(sale_country=Shipments.shipment_country)
                     .where(and_(
-                        OperationsSales.sale_currency_markup.is_(None),
-                        OperationsSales.sale_currency == 'eur')),
+                        batch,
+                        OperationsSales.sale_country.is_(None),
+                        Shipments.shipment_id == OperationsSales.shipment_id)),
 
-                    update(OperationsSales).values(sale_price_kg=session_current
-                    .query(Customers.customer_cons_kg)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_price_kg.is_(None),
-                        OperationsSales.sale_type.like("%консолидат%"),
-                        OperationsSales.sale_country == 'ec')),
-
-                    update(OperationsSales).values(sale_price_pallet=session_current
-                    .query(Customers.customer_holl_pallet)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_price_pallet.is_(None),
-                        OperationsSales.sale_type.like("%срезка%"),
-                        OperationsSales.sale_country == 'den')),
-
-                    update(OperationsSales).values(sale_price_troll=session_current
-                    .query(Customers.customer_troll)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_price_troll.is_(None),
-                        OperationsSales.sale_type.like("%телег%"),
-                        OperationsSales.sale_country == 'den')),
-
-                    update(OperationsSales).values(sale_price_kg=session_current
-                    .query(Customers.customer_eq_kg)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_price_kg.is_(None),
-                        OperationsSales.sale_type.like("%срезка%"),
-                        OperationsSales.sale_country == 'ec')),
-
-                    update(OperationsSales).values(sale_price_kg=session_current
-                    .query(Customers.customer_col_kg)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_price_kg.is_(None),
-                        OperationsSales.sale_type.like("%срезка%"),
-                        OperationsSales.sale_country == 'co')),
-
-                    update(OperationsSales).values(sale_price_kg=session_current
-                    .query(Customers.customer_ken_kg)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_price_kg.is_(None),
-                        OperationsSales.sale_type.like("%срезка%"),
-                        OperationsSales.sale_country == 'ke')),
-
-                    update(OperationsSales).values(sale_price_pallet=session_current
-                    .query(Customers.customer_holl_pallet)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_price_pallet.is_(None),
-                        OperationsSales.sale_type.like("%срезка%"),
-                        OperationsSales.sale_country == 'nl')),
-
-                    update(OperationsSales).values(sale_price_troll=session_current
-                    .query(Customers.customer_troll)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
-                    .where(and_(
-                        OperationsSales.sale_price_troll.is_(None),
-                        OperationsSales.sale_type.like("%телег%"),
-                        OperationsSales.sale_country == 'nl')),
-
-                    update(OperationsSales).values(sale_price_kg=session_current
-                    .query(Customers.customer_isr_kg)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
+                    update(OperationsSales)
+                    .values(sale_currency_markup=Customers.customer_dollar_trans_rate)
                     .where(and_(
-                        OperationsSales.sale_price_kg.is_(None),
-                        OperationsSales.sale_type.like("%весу%"),
-                        OperationsSales.sale_country == 'il')),
+                        batch,
+                        OperationsSales.sale_currency_markup.is_(None),
+                        OperationsSales.sale_currency == 'usd',
+                        Customers.customer_id == OperationsSales.customer_id)),
 
                     update(OperationsSales)
-                    .values(sale_price_pallet=session_current
-                    .query(Customers.customer_isr_pallet)
-                    .filter(Customers.customer_id == OperationsSales.customer_id)
-                    .as_scalar())
+                    .values(sale_currency_markup=Customers.customer_euro_trans_rate)
                     .where(and_(
-                        OperationsSales.sale_price_pallet.is_(None),
-                        OperationsSales.sale_type.like("%объему%"),
-                        OperationsSales.sale_country == 'il')),
+                        batch,
+                        OperationsSales.sale_currency_markup.is_(None),
+                        OperationsSales.sale_currency == 'eur',
+                        Customers.customer_id == OperationsSales.customer_id))
+                    ]
 
-                    update(OperationsSales)
-                    .values(sale_currency_rate=session_current
-                    .query(CurrencyUsd.currency_rate)
-                    .filter(CurrencyUsd.currency_date == OperationsSales.sale_date)
-                    .as_scalar())
+        for sale_column, customer_column, sale_type, sale_country in customer_prices:
+
+            queries.append(update(OperationsSales).values({sale_column:customer_column})
+                           .where(and_(
+                               batch,
+                               sale_column.is_(None),
+                               OperationsSales.sale_type.like(sale_type),
+                               OperationsSales.sale_country == sale_country,
+                               Customers.customer_id == OperationsSales.customer_id)))
+
+        queries += [update(OperationsSales).values(sale_currency_rate=CurrencyUsd.currency_rate)
                     .where(and_(
+                        batch,
                         OperationsSales.sale_currency_rate.is_(None),
-                        OperationsSales.sale_currency == 'usd')),
+                        OperationsSales.sale_currency == 'usd',
+                        CurrencyUsd.currency_date == OperationsSales.sale_date)),
 
-                    update(OperationsSales)
-                    .values(sale_currency_rate=session_current
-                    .query(CurrencyEur.currency_rate)
-                    .filter(CurrencyEur.currency_date == OperationsSales.sale_date)
-                    .as_scalar())
+                    update(OperationsSales).values(sale_currency_rate=CurrencyEur.currency_rate)
                     .where(and_(
+                        batch,
                         OperationsSales.sale_currency_rate.is_(None),
-                        OperationsSales.sale_currency == 'eur')),
+                        OperationsSales.sale_currency == 'eur',
+                        CurrencyEur.currency_date == OperationsSales.sale_date)),
 
                     update(OperationsSales)
                     .values(sale_total_rub=OperationsSales.sale_weight * \
@@ -1207,6 +1283,7 @@ def create_table(dataframe_intro, table_class, session_current):
                             (OperationsSales.sale_currency_rate + \
                              OperationsSales.sale_currency_markup))
                     .where(and_(
+                        batch,
                         OperationsSales.sale_total_rub.is_(None),
                         OperationsSales.sale_price_kg.is_not(None),
                         OperationsSales.sale_currency == 'usd')),
@@ -1217,6 +1294,7 @@ def create_table(dataframe_intro, table_class, session_current):
                             (OperationsSales.sale_currency_rate + \
                              OperationsSales.sale_currency_markup))
                     .where(and_(
+                        batch,
                         OperationsSales.sale_total_rub.is_(None),
                         OperationsSales.sale_price_pallet.is_not(None),
                         OperationsSales.sale_currency == 'usd')),
@@ -1227,6 +1305,7 @@ def create_table(dataframe_intro, table_class, session_current):
                             (OperationsSales.sale_currency_rate + \
                              OperationsSales.sale_currency_markup))
                     .where(and_(
+                        batch,
                         OperationsSales.sale_total_rub.is_(None),
                         OperationsSales.sale_price_troll.is_not(None),
                         OperationsSales.sale_currency == 'usd'))
@@ -1234,518 +1313,2774 @@ def create_table(dataframe_intro, table_class, session_current):
 
     elif table_class == Shipments:
 
-        # Dictionary of SHIPMENTS queries
-        queries = [update(Shipments).values(customer_id=session_current
-                    .query(Markings.customer_id)
-                    .filter(Markings.marking_name == Shipments.shipment_marking)
-                    .as_scalar())
+        batch = Shipments.shipment_id.between(first_id, last_id)
+
+        # Earlier records of the expenses linked to a shipment of the batch
+        linked_iphandlers = OperationsIphandlers.__table__.alias('linked_iphandlers')
+
+        # List of SHIPMENTS queries
+        queries = [update(Shipments).values(customer_id=Markings.customer_id)
+                    .where(and_(
+                        batch,
+                        Markings.marking_name == Shipments.shipment_marking)),
+
+                    # Earlier records left without a shipment are linked to the new shipments
+                    update(OperationsForever).values(shipment_id=Shipments.shipment_id)
+                    .where(and_(
+                        batch,
+                        OperationsForever.shipment_id.is_(None),
+                        Shipments.expense_forever_id.is_(None),
+                        Shipments.shipment_awb == OperationsForever.expense_awb,
+                        Shipments.shipment_box_full == OperationsForever.expense_full_box,
+                        Shipments.shipment_marking == OperationsForever.expense_marking)),
+
+                    update(OperationsForever).values(shipment_id=Shipments.shipment_id)
+                    .where(and_(
+                        batch,
+                        OperationsForever.shipment_id.is_(None),
+                        Shipments.expense_forever_id.is_(None),
+                        Shipments.shipment_marking == OperationsForever.expense_marking,
+                        Shipments.shipment_awb == OperationsForever.expense_awb)),
+
+                    update(Shipments).values(expense_forever_id=OperationsForever.expense_forever_id)
+                    .where(and_(
+                        batch,
+                        Shipments.expense_forever_id.is_(None),
+                        OperationsForever.shipment_id == Shipments.shipment_id)),
+
+                    update(OperationsForever).values(expense_country=Shipments.shipment_country)
+                    .where(and_(
+                        batch,
+                        OperationsForever.expense_country.is_(None),
+                        Shipments.shipment_id == OperationsForever.shipment_id)),
+
+                    # shipment_id of the iphandlers is unique: one record per shipment,
+                    # the shipments linked to a record already are passed by
+                    update(OperationsIphandlers).values(shipment_id=Shipments.shipment_id)
+                    .where(and_(
+                        batch,
+                        OperationsIphandlers.shipment_id.is_(None),
+                        Shipments.expense_ip_id.is_(None),
+                        Shipments.shipment_awb == OperationsIphandlers.expense_awb,
+                        Shipments.shipment_marking == OperationsIphandlers.expense_marking,
+                        ~select(linked_iphandlers.c.expense_ip_id).where(
+                            linked_iphandlers.c.shipment_id == Shipments.shipment_id).exists(),
+                        OperationsIphandlers.expense_ip_id == select(
+                            func.min(linked_iphandlers.c.expense_ip_id)).where(and_(
+                            linked_iphandlers.c.shipment_id.is_(None),
+                            linked_iphandlers.c.expense_awb == Shipments.shipment_awb,
+                            linked_iphandlers.c.expense_marking == Shipments.shipment_marking))
+                            .scalar_subquery())),
+
+                    update(Shipments).values(expense_ip_id=OperationsIphandlers.expense_ip_id)
+                    .where(and_(
+                        batch,
+                        Shipments.expense_ip_id.is_(None),
+                        OperationsIphandlers.shipment_id == Shipments.shipment_id)),
+
+                    # Sales take the shipment of their balance record
+                    update(OperationsSales).values(shipment_id=OperationsForever.shipment_id)
+                    .where(and_(
+                        OperationsForever.shipment_id.between(first_id, last_id),
+                        OperationsSales.shipment_id.is_(None),
+                        OperationsForever.expense_awb == OperationsSales.sale_awb,
+                        OperationsForever.expense_full_box == OperationsSales.sale_full_box,
+                        OperationsForever.expense_marking == OperationsSales.sale_marking)),
+
+                    update(OperationsSales).values(sale_country=Shipments.shipment_country)
+                    .where(and_(
+                        batch,
+                        OperationsSales.sale_country.is_(None),
+                        Shipments.shipment_id == OperationsSales.shipment_id))
                     ]
 
     elif table_class == Markings:
 
-        queries = [update(Markings).values(customer_id=session_current
-                                   .query(Customers.customer_id)
-                                   .filter(Customers.customer_name==(
-                                           Markings.marking_customer))
-                                   .as_scalar())
-                                   .where(Markings.customer_id.is_(None))
+        batch = Markings.marking_id.between(first_id, last_id)
+
+        queries = [update(Markings).values(customer_id=Customers.customer_id)
+                    .where(and_(
+                        batch,
+                        Markings.customer_id.is_(None),
+                        Customers.customer_name == Markings.marking_customer))
                     ]
 
-    if queries:
+        # Earlier records left without a customer are linked by the new markings
+        for marked_table, marking_column, customer_column in [
+            [Shipments, Shipments.shipment_marking, None],
+            [OperationsForever, OperationsForever.expense_marking, OperationsForever.expense_customer],
+            [OperationsIphandlers, OperationsIphandlers.expense_marking,
+             OperationsIphandlers.expense_customer],
+            [OperationsSales, OperationsSales.sale_marking, OperationsSales.sale_customer]]:
 
-        for query in queries:
+            queries.append(update(marked_table).values(customer_id=Markings.customer_id)
+                           .where(and_(
+                               batch,
+                               marked_table.customer_id.is_(None),
+                               Markings.customer_id.is_not(None),
+                               Markings.marking_name == marking_column)))
 
-            # Execute the update statement
-            session_current.execute(query)
+            if customer_column is not None:
 
-            # Commit the changes
-            session_current.commit()
+                queries.append(update(marked_table).values({customer_column:Customers.customer_name})
+                               .where(and_(
+                                   batch,
+                                   customer_column.is_(None),
+                                   Markings.marking_name == marking_column,
+                                   Customers.customer_id == marked_table.customer_id)))
 
-    results = session_current.query(table_class).all()
+    return queries
 
-    # Save the original sys.stdout as log_history.txt
-    original_stdout = sys.stdout
+def log_changes(session_current, table_class, condition, action):
 
-    file_path = 'C:/autocargo_reports/export/log_history.txt'
+    """
+    This function appends the records of the table matching the condition
+    to the log history file, one compact JSON line per record. Records are
+    streamed from the database in chunks instead of being loaded at once.
 
-    # Check if log file path is valid
-    if os.path.exists(file_path):
+    Returns the count of logged records.
 
-        with open(file_path, 'a', encoding='utf_8') as file:
-            sys.stdout = file
+    """
 
-            for r in results:
-                print(r)
+    file_path = 'C:/autocargo_reports/export/log_history.txt'
 
     # Check if log file path is valid
-    else:
+    if not os.path.exists(file_path):
 
         print('Log history file was not found!')
         print('Records were not updated.')
 
-    # Restore the original sys.stdout
-    sys.stdout = original_stdout
+        return 0
 
-def database_create(database_path):
+    log_time = datetime.now().isoformat(timespec='seconds')
 
-    """
-    This function creates a table in a database.
+    logged_count = 0
 
-    """
+    records = session_current.execute(select(table_class.__table__)
+                                      .where(condition)
+                                      .execution_options(yield_per=1000)).mappings()
 
-    # Create the database and tables
-    engine = create_engine(f"sqlite:///{database_path}", echo = False)
+    with open(file_path, 'a', encoding='utf_8') as file:
 
-    Base.metadata.create_all(bind=engine)
+        for record in records:
 
-    session = sessionmaker(bind=engine)
+            log_line = {'time':log_time,
+                        'table':table_class.__tablename__,
+                        'action':action}
 
-    session_current = session()
+            # Empty columns are left out to keep the line short
+            log_line.update({key:value for key, value in record.items() if value is not None})
 
-    # Dictionary of standard tables path + table name
-    standard_tables = {Companies:"C:/autocargo_reports/starter/companies.xlsx",
-                        Customers:"C:/autocargo_reports/starter/customers_info.xlsx",
-                        Suppliers:"C:/autocargo_reports/starter/suppliers.xlsx",
-                        BoxType:"C:/autocargo_reports/starter/box_types.xlsx",
-                        FlowerType:"C:/autocargo_reports/starter/flower_type.xlsx",
-                        Managers:"C:/autocargo_reports/starter/managers.xlsx",
-                        Cars:"C:/autocargo_reports/starter/cars.xlsx",
-                        Drivers:"C:/autocargo_reports/starter/drivers.xlsx",
-                        Markings:"C:/autocargo_reports/starter/markings.xlsx"}
+            file.write(json.dumps(log_line, ensure_ascii=False, default=str) + '\n')
 
-    # Fill standard tables
-    for table, path in standard_tables.items():
+            logged_count += 1
 
-        if os.path.exists(path):
+    return logged_count
 
-            dataframe_file = pd.read_excel(path)
+def shipments_key_index_ready(session_current):
 
-            create_table(dataframe_file, table, session_current)
+    """
+    This function creates the unique natural-key index of the table 'shipments'
+    in a database created before the index was declared, and returns True
+    when the index exists. An index can't be created over duplicate shipments,
+    they are removed by remove_duplicate_shipments (operation code 12).
 
-        else:
+    """
 
-            print('Standard tables path for table creation is not valid!')
+    index_names = {index_name for _, index_name, *_ in
+                   session_current.execute(text("PRAGMA index_list('shipments')"))}
 
-def empty_customer_id(session_current):
+    if 'ux_shipments_natural_key' in index_names:
 
-    """
-    This function fills an empty customer_id of tables
+        return True
 
-    """
+    key_index = [index for index in Shipments.__table__.indexes
+                 if index.name == 'ux_shipments_natural_key'][0]
 
-    skip_id = []
+    # The index is created in its own transaction
+    session_current.commit()
 
-    quit_for_loop = False
+    try:
 
-    cus_id_queries = {Shipments:[Shipments.customer_id,
-                                 Shipments.shipment_marking,
-                                 Shipments.shipment_id],
-                      OperationsForever:[OperationsForever.customer_id,
-                                         OperationsForever.expense_marking,
-                                         OperationsForever.expense_forever_id],
-                      OperationsIphandlers:[OperationsIphandlers.customer_id,
-                                            OperationsIphandlers.expense_marking,
-                                            OperationsIphandlers.expense_ip_id],
-                      OperationsSales:[OperationsSales.customer_id,
-                                       OperationsSales.sale_marking,
-                                       OperationsSales.sale_id]}
+        key_index.create(bind=session_current.connection())
 
-    for table, condition_list in cus_id_queries.items():
+        session_current.commit()
 
-        # Condition to identify records where customer_id is None
-        condition = condition_list[0].is_(None)
+    except IntegrityError:
 
-        # Fetch the records that match the empty condition
-        records_to_update = session_current.query(table).filter(condition).first()
+        session_current.rollback()
 
-        while records_to_update:
+        print('Index ux_shipments_natural_key was not created, table shipments has duplicate records!')
+        print('Run operation code 12 to remove the duplicate shipments')
 
-            if table == Shipments:
+        return False
 
-                record_names = {table:[records_to_update.shipment_marking,
-                                       records_to_update.shipment_id]}
+    return True
 
-            elif table == OperationsIphandlers:
+def create_table(dataframe_intro, table_class, session_current, bulk=False, batch_size=500,
+                 upsert=False, link=True):
 
-                record_names = {table:[records_to_update.expense_marking,
-                                       records_to_update.expense_ip_id]}
+    """
+    This function creates a table based on the Class and dataframe provided.
 
-            elif table == OperationsForever:
+    With bulk set to True the dataframe is inserted in batches of batch_size rows
+    using executemany-style inserts and committed once together with the linkage
+    of the inserted records.
 
-                if (records_to_update.expense_full_box == 0E-10 and
-                    records_to_update.expense_volume == 0E-10):
+    With upsert set to True (Shipments only) the rows are written in bulk with
+    INSERT ... ON CONFLICT DO UPDATE over the natural-key unique index, so rows
+    of known shipments refresh their manual_columns instead of being skipped.
+    Without the index (duplicate shipments in an older database) the new rows
+    are inserted and the known shipments are refreshed by an UPDATE, the same
+    way as rows with an empty key value, which never conflict in the index.
 
-                    records_to_update.customer_id = '0'
+    With link set to False the linkage of the inserted records is left
+    to the caller, e.g. database_create links the seeded tables once at the end.
 
-                    session_current.commit()
+    Returns a tuple of inserted and skipped (duplicate) rows count,
+    in upsert mode the second count is the count of refreshed known shipments.
 
-                    records_to_update = session_current.query(table).filter(condition).first()
+    """
 
-                    continue
+    inserted_count = 0
 
-                record_names = {table:[records_to_update.expense_marking,
-                                       records_to_update.expense_forever_id]}
+    # Records refreshed by the upsert
+    updated_ids = []
 
-            elif table == OperationsSales:
+    pk_column = table_class.__mapper__.primary_key[0]
 
-                record_names = {table:[records_to_update.sale_marking,
-                                       records_to_update.sale_id]}
+    # Records inserted by this call get primary keys greater than first_id
+    first_id = session_current.query(func.max(pk_column)).scalar() or 0
+
+    if upsert and table_class == Shipments:
+
+        refresh_columns = [column_name for column_name in Shipments.manual_columns
+                           if column_name in dataframe_intro.columns]
+
+        # Rows of known shipments become updates
+        dataframe_new, _, updated_ids = filter_duplicates(dataframe_intro, Shipments,
+                                                          session_current)
+
+        inserted_count = len(dataframe_new.index)
+
+        if not refresh_columns:
+
+            updated_ids = []
+
+        if shipments_key_index_ready(session_current):
+
+            # Keys with an empty value never conflict in the unique index,
+            # such rows are inserted and refreshed by the statements below
+            null_keyed = dataframe_intro[duplicate_keys[Shipments]].isna().any(axis=1)
+
+            upsert_frame = dataframe_intro[~null_keyed]
+
+            dataframe_intro = dataframe_intro[null_keyed]
+
+            dataframe_new = dataframe_new[dataframe_new.index.isin(dataframe_intro.index)]
+
+            upsert_statement = sqlite_insert(Shipments.__table__)
+
+            if refresh_columns:
+
+                upsert_statement = upsert_statement.on_conflict_do_update(
+                                   index_elements=duplicate_keys[Shipments],
+                                   set_={column_name:upsert_statement.excluded[column_name]
+                                         for column_name in refresh_columns})
+
+            else:
+
+                upsert_statement = upsert_statement.on_conflict_do_nothing(
+                                   index_elements=duplicate_keys[Shipments])
+
+            records = Shipments.from_frame(upsert_frame)
+
+            # Manual values refresh the known shipments
+            for record, refresh in zip(records,
+                                       upsert_frame[refresh_columns].to_dict('records')):
+
+                record.update(refresh)
+
+            for batch_start in range(0, len(records), batch_size):
+
+                session_current.execute(upsert_statement,
+                                        records[batch_start:batch_start + batch_size])
+
+        # Without the index (or with an empty key value) known shipments are
+        # refreshed by their natural keys, new ones are inserted
+        records = Shipments.from_frame(dataframe_new)
+
+        for batch_start in range(0, len(records), batch_size):
+
+            session_current.execute(Shipments.__table__.insert(),
+                                    records[batch_start:batch_start + batch_size])
+
+        # Rows repeating a shipment refresh it after the new shipments are inserted
+        if refresh_columns:
+
+            shipments_object = Shipments.__table__
+
+            # Empty key values are equal (SQLite IS)
+            refresh_statement = shipments_object.update().where(and_(
+                                *[shipments_object.c[key].is_(bindparam(f'b_{key}'))
+                                  for key in duplicate_keys[Shipments]])).values(
+                                {column_name:bindparam(f'b_{column_name}')
+                                 for column_name in refresh_columns})
+
+            refresh_rows = dataframe_intro[duplicate_keys[Shipments] + refresh_columns]
+
+            refresh_rows = refresh_rows.drop(dataframe_new.index).rename(
+                           columns=lambda column_name: f'b_{column_name}')
+
+            if not refresh_rows.empty:
+
+                session_current.execute(refresh_statement, refresh_rows.to_dict('records'))
+
+        skipped_count = len(updated_ids)
+
+    elif bulk:
+
+        # Drop the rows that are already in the table
+        dataframe_intro, skipped_count, _ = filter_duplicates(dataframe_intro, table_class,
+                                                              session_current)
+
+        records = table_class.from_frame(dataframe_intro)
+
+        for batch_start in range(0, len(records), batch_size):
+
+            session_current.execute(table_class.__table__.insert(),
+                                    records[batch_start:batch_start + batch_size])
+
+        inserted_count = len(records)
+
+    else:
+
+        # Drop the rows that are already in the table
+        dataframe_intro, skipped_count, _ = filter_duplicates(dataframe_intro, table_class,
+                                                              session_current)
+
+        for ind in dataframe_intro.index:
+
+            table = table_class(dataframe_intro, ind)
+
+            session_current.add(table)
+
+            session_current.commit()
+
+            inserted_count += 1
+
+    last_id = session_current.query(func.max(pk_column)).scalar() or 0
+
+    # Link the inserted records to the other tables in one transaction
+    if inserted_count and link:
+
+        for query in linkage_queries(table_class, first_id + 1, last_id):
+
+            # Execute the update statement
+            session_current.execute(query)
+
+    # Commit the changes
+    session_current.commit()
+
+    # New markings invalidate the marking index of the session
+    if inserted_count and table_class == Markings:
+
+        session_current.info.pop('marking_index', None)
+
+    if inserted_count:
+
+        log_changes(session_current, table_class,
+                    pk_column.between(first_id + 1, last_id), 'insert')
+
+    if upsert:
+
+        # Log the refreshed records in chunks to keep the query parameters short
+        for chunk_start in range(0, len(updated_ids), 500):
+
+            log_changes(session_current, table_class,
+                        pk_column.in_(updated_ids[chunk_start:chunk_start + 500]), 'update')
+
+    return inserted_count, skipped_count
+
+# Dictionary of standard tables path + table name, in the order of seeding
+standard_tables = {Companies:"C:/autocargo_reports/starter/companies.xlsx",
+                   Customers:"C:/autocargo_reports/starter/customers_info.xlsx",
+                   Suppliers:"C:/autocargo_reports/starter/suppliers.xlsx",
+                   BoxType:"C:/autocargo_reports/starter/box_types.xlsx",
+                   FlowerType:"C:/autocargo_reports/starter/flower_type.xlsx",
+                   Managers:"C:/autocargo_reports/starter/managers.xlsx",
+                   Cars:"C:/autocargo_reports/starter/cars.xlsx",
+                   Drivers:"C:/autocargo_reports/starter/drivers.xlsx",
+                   Markings:"C:/autocargo_reports/starter/markings.xlsx"}
+
+def read_standard_table(path):
+
+    """
+    This function reads a starter workbook, returns None if it doesn't exist
+
+    """
+
+    if not os.path.exists(path):
+
+        return None
+
+    # Starter workbooks are read once, they aren't kept in the reports cache
+    return read_report(path, use_cache=False)
+
+def database_create(database_path):
+
+    """
+    This function creates a table in a database.
+
+    The starter workbooks are read by read_report (calamine engine when
+    it is installed), every standard table is bulk-loaded in one transaction,
+    and the reference tables are linked once after all of them are filled.
+
+    """
+
+    # Create the database and tables, the engine is shared with main_loop
+    engine = database_engine.get_engine(database_path, 'bulk-ingest')
+
+    Base.metadata.create_all(bind=engine)
+
+    session = database_engine.get_session_factory(database_path, 'bulk-ingest')
+
+    session_current = session()
+
+    standard_frames = {table:read_standard_table(path) for table, path in standard_tables.items()}
+
+    # Fill standard tables
+    for table, dataframe_file in standard_frames.items():
+
+        if dataframe_file is not None:
+
+            inserted_count, _ = create_table(dataframe_file, table, session_current,
+                                             bulk=True, link=False)
+
+            print(f'Table {table.__tablename__} was filled with {inserted_count} records')
+
+        else:
+
+            print('Standard tables path for table creation is not valid!')
+
+    # Link the seeded tables once all of them are filled
+    for table in standard_tables:
+
+        last_id = session_current.query(func.max(table.__mapper__.primary_key[0])).scalar() or 0
+
+        for query in linkage_queries(table, 1, last_id):
+
+            session_current.execute(query)
+
+    session_current.commit()
+
+    session_current.close()
+
+# Lookups served by the indexes of the tables: probe name + table + filtered columns
+index_probe_list = {'Operations Forever duplicate check':[OperationsForever,
+                                                          duplicate_keys[OperationsForever]],
+                    'Operations Iphandlers duplicate check':[OperationsIphandlers,
+                                                             duplicate_keys[OperationsIphandlers]],
+                    'Operations Sales duplicate check':[OperationsSales,
+                                                        duplicate_keys[OperationsSales]],
+                    'Shipments duplicate check':[Shipments, duplicate_keys[Shipments]],
+                    'Shipments by awb':[Shipments, ['shipment_awb']],
+                    'Shipments by marking':[Shipments, ['shipment_marking']],
+                    'Shipments by marking and full box':[Shipments, ['shipment_marking',
+                                                                     'shipment_box_full']],
+                    'Operations Forever by marking':[OperationsForever, ['expense_marking']],
+                    'Markings by name':[Markings, ['marking_name']]}
+
+def index_probes(session_current, probe_count):
+
+    """
+    This function times the lookups listed in index_probe_list using
+    key values sampled from the existing records
+
+    """
+
+    probe_times = {}
+
+    for probe_name, (table_class, keys) in index_probe_list.items():
+
+        key_columns = [getattr(table_class, key) for key in keys]
+
+        samples = session_current.query(*key_columns).order_by(func.random()).limit(probe_count).all()
+
+        start_time = time.perf_counter()
+
+        for sample in samples:
+
+            session_current.query(table_class.__mapper__.primary_key[0]).filter(and_(
+                *[key_column == value for key_column, value in zip(key_columns, sample)]
+            )).first()
+
+        probe_times[probe_name] = [len(samples), time.perf_counter() - start_time]
+
+    return probe_times
+
+def database_indexes(database_path, probe_count=200):
+
+    """
+    This function creates the indexes declared on the tables in an existing
+    database and prints the lookup timings before and after the creation
+
+    """
+
+    engine = database_engine.get_engine(database_path, 'bulk-ingest')
+
+    # Create the tables missing in an older database
+    Base.metadata.create_all(bind=engine)
+
+    session = database_engine.get_session_factory(database_path, 'bulk-ingest')
+
+    session_current = session()
+
+    print('Timing lookups without indexes')
+
+    probes_before = index_probes(session_current, probe_count)
+
+    session_current.close()
+
+    for table_object in Base.metadata.sorted_tables:
+
+        for index in table_object.indexes:
+
+            print(f'Creating index {index.name}')
+
+            try:
+
+                index.create(bind=engine, checkfirst=True)
+
+            except IntegrityError:
+
+                print(f'Index {index.name} was not created, '
+                      f'table {table_object.name} has duplicate records!')
+
+                if table_object.name == 'shipments':
+
+                    print('Run operation code 12 to remove the duplicate shipments')
+
+    session_current = session()
+
+    session_current.execute(text('ANALYZE'))
+
+    session_current.commit()
+
+    print('Timing lookups with indexes')
+
+    probes_after = index_probes(session_current, probe_count)
+
+    session_current.close()
+
+    print(border_line)
+
+    for probe_name, (count, time_before) in probes_before.items():
+
+        time_after = probes_after[probe_name][1]
+
+        print(f'{probe_name} ({count} lookups): '
+              f'{time_before:.3f}s -> {time_after:.3f}s')
+
+    print(border_line)
+
+    return probes_before, probes_after
+
+def remove_duplicate_shipments(session_current):
+
+    """
+    This function removes the duplicate shipments (the same natural key)
+    of an older database, so that the unique natural-key index of the table
+    'shipments' can be created by database_indexes.
+
+    The first shipment of every natural key is kept. Records linked to the removed
+    shipments are linked to the kept one, the links of the removed shipments fill
+    the empty links of the kept one. A record of a unique shipment_id column is
+    unlinked when the kept shipment is linked already, it is linked again later.
+
+    Returns the count of removed shipments.
+
+    """
+
+    shipments_object = Shipments.__table__
+
+    keys = [shipments_object.c[key] for key in duplicate_keys[Shipments]]
+
+    # The first shipment of every natural key repeated in the table
+    kept_shipments = select(func.min(shipments_object.c.shipment_id).label('kept_id'),
+                            *keys).group_by(*keys).having(func.count() > 1).subquery()
+
+    duplicate_pairs = [{'b_duplicate_id':duplicate_id, 'b_kept_id':kept_id}
+                       for duplicate_id, kept_id in session_current.execute(
+                       select(shipments_object.c.shipment_id, kept_shipments.c.kept_id)
+                       .join(kept_shipments, and_(*[key == kept_shipments.c[key.key] for key in keys]))
+                       .where(shipments_object.c.shipment_id != kept_shipments.c.kept_id))]
+
+    if not duplicate_pairs:
+
+        print('Table shipments has no duplicate records')
+
+        return 0
+
+    duplicates = shipments_object.alias('duplicates')
+
+    # Links of the removed shipments fill the empty links of the kept ones
+    for link_column in [column for column in shipments_object.c if column.foreign_keys]:
+
+        session_current.execute(shipments_object.update()
+                                .where(and_(shipments_object.c.shipment_id == bindparam('b_kept_id'),
+                                            link_column.is_(None)))
+                                .values({link_column.key:select(duplicates.c[link_column.key])
+                                         .where(duplicates.c.shipment_id == bindparam('b_duplicate_id'))
+                                         .scalar_subquery()}),
+                                duplicate_pairs)
+
+    duplicate_ids = [pair['b_duplicate_id'] for pair in duplicate_pairs]
+
+    unlinked_count = 0
+
+    # Records linked to the removed shipments are linked to the kept ones
+    for table_object in Base.metadata.tables.values():
+
+        for link_column in table_object.c:
+
+            if not any(foreign_key.target_fullname == 'shipments.shipment_id'
+                       for foreign_key in link_column.foreign_keys):
+
+                continue
+
+            relink_condition = link_column == bindparam('b_duplicate_id')
+
+            if link_column.unique:
+
+                linked = table_object.alias('linked')
+
+                relink_condition = and_(relink_condition, ~select(linked.c[link_column.key])
+                                        .where(linked.c[link_column.key] == bindparam('b_kept_id'))
+                                        .exists())
+
+            session_current.execute(table_object.update().where(relink_condition)
+                                    .values({link_column.key:bindparam('b_kept_id')}),
+                                    duplicate_pairs)
+
+            if link_column.unique:
+
+                for chunk_start in range(0, len(duplicate_ids), 500):
+
+                    unlinked_count += session_current.execute(table_object.update().where(
+                                      link_column.in_(duplicate_ids[chunk_start:chunk_start + 500]))
+                                      .values({link_column.key:None})).rowcount
+
+    # Delete in chunks to keep the query parameters short
+    for chunk_start in range(0, len(duplicate_ids), 500):
+
+        session_current.execute(shipments_object.delete().where(
+                                shipments_object.c.shipment_id.in_(duplicate_ids[chunk_start:chunk_start + 500])))
+
+    session_current.commit()
+
+    print(f'Duplicate shipments removed: {len(duplicate_ids)}')
+
+    if unlinked_count:
+
+        print(f'Records unlinked from the removed shipments: {unlinked_count}')
+
+    return len(duplicate_ids)
+
+def index_benchmark(row_count=200000, probe_count=200):
+
+    """
+    This function fills a temporary database with row_count generated records
+    per operations and shipments table and runs database_indexes on it,
+    the engine of the database is disposed and the database is deleted at the end
+
+    """
+
+    benchmark_directory = tempfile.mkdtemp()
+
+    benchmark_path = os.path.join(benchmark_directory, 'index_benchmark.db')
+
+    print(f'Benchmark database: {benchmark_path}')
+
+    try:
+
+        engine = database_engine.get_engine(benchmark_path, 'bulk-ingest')
+
+        Base.metadata.create_all(bind=engine)
+
+        # Tables are filled without indexes, they are created by database_indexes
+        for table_object in Base.metadata.sorted_tables:
+
+            for index in table_object.indexes:
+
+                index.drop(bind=engine)
+
+        benchmark_tables = {OperationsForever:row_count,
+                            OperationsIphandlers:row_count,
+                            OperationsSales:row_count,
+                            Shipments:row_count,
+                            Markings:row_count // 100}
+
+        with engine.begin() as connection:
+
+            for table_class, table_rows in benchmark_tables.items():
+
+                print(f'Filling {table_class.__tablename__} with {table_rows} records')
+
+                value_columns = [table_column for table_column in table_class.__table__.columns
+                                 if not table_column.primary_key and not table_column.foreign_keys]
+
+                records = []
+
+                for row_num in range(table_rows):
+
+                    record = {}
+
+                    for table_column in value_columns:
+
+                        # Different moduli give realistic repeats of awb, marking and box values
+                        if isinstance(table_column.type, Date):
+
+                            record[table_column.key] = date(2023, 1, 1) + timedelta(days=row_num % 731)
+
+                        elif isinstance(table_column.type, (Integer, DECIMAL)):
+
+                            record[table_column.key] = row_num % 97
+
+                        elif 'marking' in table_column.key:
+
+                            record[table_column.key] = f'marking {row_num % 1499}'
+
+                        else:
+
+                            record[table_column.key] = f'{table_column.key} {row_num // 5}'
+
+                    records.append(record)
+
+                    if len(records) == 10000:
+
+                        connection.execute(table_class.__table__.insert(), records)
+
+                        records = []
+
+                if records:
+
+                    connection.execute(table_class.__table__.insert(), records)
+
+        return database_indexes(benchmark_path, probe_count)
+
+    finally:
+
+        database_engine.dispose_engines(benchmark_path)
+
+        shutil.rmtree(benchmark_directory, ignore_errors=True)
+
+# Marking column of the tables linked to customers by marking
+marking_columns = {Shipments:Shipments.shipment_marking,
+                   OperationsForever:OperationsForever.expense_marking,
+                   OperationsIphandlers:OperationsIphandlers.expense_marking,
+                   OperationsSales:OperationsSales.sale_marking}
+
+def marking_index(session_current):
+
+    """
+    This function returns the marking index of the session, loaded once
+    from the table 'markings' and kept in session_current.info until
+    create_table inserts new markings:
+
+    - 'markings': normalized marking name -> list of (customer_id, customer's name, address);
+
+    - 'customers': customer_id -> (customer's name, address);
+
+    - 'matcher': MarkingMatcher of the marking names for fuzzy lookups;
+
+    """
+
+    if 'marking_index' not in session_current.info:
+
+        index = {'markings':{}, 'customers':{}}
+
+        rows = session_current.query(Markings.marking_name,
+                                     Markings.customer_id,
+                                     Markings.marking_customer,
+                                     Markings.marking_customer_address).filter(
+                                     Markings.customer_id.is_not(None))
+
+        for row in rows:
+
+            customer = (row.customer_id, row.marking_customer, row.marking_customer_address)
+
+            matches = index['markings'].setdefault(normalize_marking(row.marking_name), [])
+
+            # Same marking of the same customer is listed once
+            if customer not in matches:
+
+                matches.append(customer)
+
+            index['customers'].setdefault(row.customer_id, customer[1:])
+
+        index['matcher'] = MarkingMatcher(index['markings'])
+
+        session_current.info['marking_index'] = index
+
+    return session_current.info['marking_index']
+
+# Lowest similarity of a marking linked to a customer by the fuzzy matcher
+fuzzy_link_score = 0.85
+
+def resolve_marking(index, marking_name):
+
+    """
+    This function returns the customer_id of the marking found in the marking
+    index, or None if the marking belongs to no customer or to several ones.
+    Markings missing in the index are looked up by the fuzzy matcher,
+    all the similar markings scored from fuzzy_link_score have to belong
+    to the same customer.
+
+    """
+
+    matches = index['markings'].get(normalize_marking(marking_name))
+
+    if not matches:
+
+        matches = []
+
+        # Every similar marking is checked, a marking of another customer blocks the link
+        for similar_name, _ in index['matcher'].top(marking_name, count=None,
+                                                    min_score=fuzzy_link_score):
+
+            matches += index['markings'][similar_name]
+
+    # Addresses of one customer may differ, the customer has to be the same
+    customer_ids = {match[0] for match in matches}
+
+    if len(customer_ids) == 1:
+
+        return customer_ids.pop()
+
+    return None
+
+def auto_link_customers(session_current, first_ids=None):
+
+    """
+    This function links the records with an empty customer_id to the customers
+    using the marking index, without asking an operator. Only the markings
+    resolved by resolve_marking to one customer are linked, the rest is left
+    to empty_customer_id. With first_ids (table -> primary key) only the records
+    with greater primary keys are checked.
+
+    Returns a dictionary of linked records count by table.
+
+    """
+
+    index = marking_index(session_current)
+
+    linked_counts = {}
+
+    # Forever records without boxes and volume belong to no customer
+    session_current.execute(update(OperationsForever).values(customer_id='0').where(and_(
+                            OperationsForever.customer_id.is_(None),
+                            OperationsForever.expense_full_box == 0,
+                            OperationsForever.expense_volume == 0)))
+
+    for table_class, marking_column in marking_columns.items():
+
+        table_object = table_class.__table__
+
+        pk_column = table_class.__mapper__.primary_key[0]
+
+        records = session_current.query(pk_column, marking_column).filter(
+                                        table_class.customer_id.is_(None))
+
+        if first_ids is not None:
+
+            records = records.filter(pk_column > first_ids[table_class])
+
+        links = []
+
+        for record_id, marking_name in records:
+
+            customer_id = resolve_marking(index, marking_name)
+
+            if customer_id is not None:
+
+                links.append({'b_id':record_id, 'b_customer_id':customer_id})
+
+        if links:
+
+            # Records linked by an operator meanwhile are left as they are
+            session_current.execute(table_object.update()
+                                    .where(and_(table_object.c[pk_column.key] == bindparam('b_id'),
+                                                table_object.c.customer_id.is_(None)))
+                                    .values(customer_id=bindparam('b_customer_id')),
+                                    links)
+
+        linked_counts[table_class.__tablename__] = len(links)
+
+    session_current.commit()
+
+    return linked_counts
+
+def skip_record(session_current, table_class, record_id, link, skip_status='skipped'):
+
+    """
+    This function saves a record skipped by an operator to the table 'link_skips',
+    link is 'customer' or 'shipment', skip_status is 'skipped' or 'deferred'
+
+    """
+
+    skip_statement = sqlite_insert(LinkSkips.__table__).values(skip_date=date.today(),
+                                                              skip_table=table_class.__tablename__,
+                                                              skip_record_id=record_id,
+                                                              skip_link=link,
+                                                              skip_status=skip_status)
+
+    skip_statement = skip_statement.on_conflict_do_update(
+                     index_elements=['skip_table', 'skip_record_id', 'skip_link'],
+                     set_={'skip_date':skip_statement.excluded.skip_date,
+                           'skip_status':skip_statement.excluded.skip_status})
+
+    session_current.execute(skip_statement)
+
+    session_current.commit()
+
+def skip_condition(table_class, link):
+
+    """
+    This function returns the join condition of the records of the table
+    with their skips in the table 'link_skips' excluding them from the loops:
+    skipped records and records deferred today
+
+    """
+
+    return and_(LinkSkips.skip_table == table_class.__tablename__,
+                LinkSkips.skip_record_id == table_class.__mapper__.primary_key[0],
+                LinkSkips.skip_link == link,
+                or_(LinkSkips.skip_status == 'skipped',
+                    LinkSkips.skip_date == date.today()))
+
+def unlinked_records(session_current, table_class, link, page_size=100):
+
+    """
+    This function yields the records of the table with an empty customer_id
+    or shipment_id (link is 'customer' or 'shipment') in the order of primary
+    keys. Records skipped in the table 'link_skips' and records deferred today
+    are excluded by an anti-join, pages of page_size records are fetched
+    by the last primary key instead of offsets.
+
+    """
+
+    pk_column = table_class.__mapper__.primary_key[0]
+
+    link_column = getattr(table_class, f'{link}_id')
+
+    last_id = 0
+
+    while True:
+
+        page = session_current.query(table_class).outerjoin(
+                                     LinkSkips, skip_condition(table_class, link)).filter(
+                                     link_column.is_(None),
+                                     LinkSkips.skip_id.is_(None),
+                                     pk_column > last_id).order_by(pk_column).limit(page_size).all()
+
+        if not page:
+
+            break
+
+        page_ids = [getattr(record, pk_column.key) for record in page]
+
+        last_id = page_ids[-1]
+
+        for record in page:
+
+            # Records linked on the page since it was fetched are passed by
+            if getattr(record, link_column.key) is None:
+
+                yield record
+
+def claim_records(session_current, table_class, link, operator, count, lease_minutes, last_id=0):
+
+    """
+    This function claims up to count unlinked records of the table with primary keys
+    greater than last_id for the operator in one short transaction. Records are
+    claimed with INSERT ... ON CONFLICT DO UPDATE over the unique lease index,
+    a lease of another operator is taken over only when it has expired.
+
+    Returns the list of claimed records ids, the lease versions are kept
+    in session_current.info['lease_versions'] for link_record.
+
+    """
+
+    pk_column = table_class.__mapper__.primary_key[0]
+
+    link_column = getattr(table_class, f'{link}_id')
+
+    lease_time = int(time.time())
+
+    # Unlinked records without skips and valid leases of other operators
+    candidate_ids = [record_id for record_id, in session_current.query(pk_column).outerjoin(
+                     LinkSkips, skip_condition(table_class, link)).outerjoin(LinkLeases, and_(
+                     LinkLeases.lease_table == table_class.__tablename__,
+                     LinkLeases.lease_record_id == pk_column,
+                     LinkLeases.lease_link == link,
+                     LinkLeases.lease_operator != operator,
+                     LinkLeases.lease_expires > lease_time)).filter(
+                     link_column.is_(None),
+                     LinkSkips.skip_id.is_(None),
+                     LinkLeases.lease_id.is_(None),
+                     pk_column > last_id).order_by(pk_column).limit(count)]
+
+    claimed_ids = []
+
+    if candidate_ids:
+
+        lease_table = LinkLeases.__table__
+
+        lease_statement = sqlite_insert(lease_table)
+
+        lease_statement = lease_statement.on_conflict_do_update(
+                          index_elements=['lease_table', 'lease_record_id', 'lease_link'],
+                          set_={'lease_operator':lease_statement.excluded.lease_operator,
+                                'lease_expires':lease_statement.excluded.lease_expires,
+                                'lease_version':lease_table.c.lease_version + 1},
+                          where=or_(lease_table.c.lease_expires <= lease_time,
+                                    lease_table.c.lease_operator == operator))
+
+        session_current.execute(lease_statement,
+                                [{'lease_table':table_class.__tablename__,
+                                  'lease_record_id':record_id,
+                                  'lease_link':link,
+                                  'lease_operator':operator,
+                                  'lease_expires':lease_time + lease_minutes * 60,
+                                  'lease_version':1} for record_id in candidate_ids])
+
+        lease_versions = session_current.info.setdefault('lease_versions', {})
+
+        # Records claimed by another operator at the same time are left to them
+        for record_id, lease_version in session_current.query(LinkLeases.lease_record_id,
+                                                              LinkLeases.lease_version).filter(
+                                        LinkLeases.lease_table == table_class.__tablename__,
+                                        LinkLeases.lease_link == link,
+                                        LinkLeases.lease_operator == operator,
+                                        LinkLeases.lease_record_id.in_(candidate_ids)):
+
+            lease_versions[(table_class.__tablename__, record_id, link)] = lease_version
+
+            claimed_ids.append(record_id)
+
+    session_current.commit()
+
+    return sorted(claimed_ids)
+
+def release_records(session_current, table_class, link, operator, record_ids):
+
+    """
+    This function deletes the leases of the operator on the records
+    """
+
+    session_current.query(LinkLeases).filter(
+                          LinkLeases.lease_table == table_class.__tablename__,
+                          LinkLeases.lease_link == link,
+                          LinkLeases.lease_operator == operator,
+                          LinkLeases.lease_record_id.in_(record_ids)).delete(
+                          synchronize_session=False)
+
+    session_current.commit()
+
+    lease_versions = session_current.info.get('lease_versions', {})
+
+    for record_id in record_ids:
+
+        lease_versions.pop((table_class.__tablename__, record_id, link), None)
+
+def claimed_records(session_current, table_class, link, operator, page_size=20, lease_minutes=30):
+
+    """
+    This function yields the unlinked records of the table claimed by the operator,
+    page_size records at a time, so that several operators link disjoint records
+    at the same time. The leases of a page are released when the page is done
+    or the loop is left.
+
+    """
+
+    link_column = getattr(table_class, f'{link}_id')
+
+    last_id = 0
+
+    while True:
+
+        claimed_ids = claim_records(session_current, table_class, link, operator,
+                                    page_size, lease_minutes, last_id)
+
+        if not claimed_ids:
+
+            break
+
+        last_id = claimed_ids[-1]
+
+        try:
+
+            for record_id in claimed_ids:
+
+                record = session_current.get(table_class, record_id)
+
+                if record is not None and getattr(record, link_column.key) is None:
+
+                    yield record
+
+        finally:
+
+            release_records(session_current, table_class, link, operator, claimed_ids)
+
+def link_record(session_current, table_class, record_id, link, link_id, operator=None):
+
+    """
+    This function writes the customer_id or shipment_id (link is 'customer'
+    or 'shipment') of a record with a conditional update committed at once:
+    the record has to be still unlinked and, for an operator, the lease
+    claimed by claim_records has to be still held with the same version.
+
+    Returns True if the record was linked.
+
+    """
+
+    table_object = table_class.__table__
+
+    pk_column = table_class.__mapper__.primary_key[0]
+
+    link_conditions = [table_object.c[pk_column.key] == record_id,
+                       table_object.c[f'{link}_id'].is_(None)]
+
+    if operator is not None:
+
+        lease_version = session_current.info.get('lease_versions', {}).get(
+                                        (table_class.__tablename__, record_id, link))
+
+        link_conditions.append(select(LinkLeases.lease_id).where(and_(
+                               LinkLeases.lease_table == table_class.__tablename__,
+                               LinkLeases.lease_record_id == record_id,
+                               LinkLeases.lease_link == link,
+                               LinkLeases.lease_operator == operator,
+                               LinkLeases.lease_version == lease_version,
+                               LinkLeases.lease_expires > int(time.time()))).exists())
+
+    result = session_current.execute(table_object.update().where(and_(*link_conditions))
+                                     .values({f'{link}_id':link_id}))
+
+    if result.rowcount != 1:
+
+        session_current.rollback()
+
+        print('The record was linked by another operator or its lease has expired!')
+
+        return False
+
+    session_current.commit()
+
+    return True
+
+def link_marking_records(session_current, table_class, marking_column, marking, customer_id,
+                         operator=None):
+
+    """
+    This function links the other unlinked records of the table with the marking
+    to the customer with a conditional update committed at once: records leased
+    by another operator are passed by, the versions of the leases of the linked
+    records are increased so that a stale lease can't link them again.
+
+    Returns the count of linked records.
+
+    """
+
+    table_object = table_class.__table__
+
+    pk_column = table_object.c[table_class.__mapper__.primary_key[0].key]
+
+    link_conditions = [table_object.c[marking_column.key] == marking,
+                       table_object.c.customer_id.is_(None)]
+
+    if operator is not None:
+
+        link_conditions.append(~select(LinkLeases.lease_id).where(and_(
+                               LinkLeases.lease_table == table_class.__tablename__,
+                               LinkLeases.lease_record_id == pk_column,
+                               LinkLeases.lease_link == 'customer',
+                               LinkLeases.lease_operator != operator,
+                               LinkLeases.lease_expires > int(time.time()))).exists())
+
+    record_ids = [record_id for record_id, in session_current.execute(
+                  select(pk_column).where(and_(*link_conditions)))]
+
+    linked_count = 0
+
+    for chunk_start in range(0, len(record_ids), 500):
+
+        chunk_ids = record_ids[chunk_start:chunk_start + 500]
+
+        result = session_current.execute(table_object.update().where(and_(
+                                         pk_column.in_(chunk_ids), *link_conditions))
+                                         .values(customer_id=customer_id))
+
+        linked_count += result.rowcount
+
+        session_current.execute(LinkLeases.__table__.update().where(and_(
+                                LinkLeases.lease_table == table_class.__tablename__,
+                                LinkLeases.lease_link == 'customer',
+                                LinkLeases.lease_record_id.in_(chunk_ids)))
+                                .values(lease_version=LinkLeases.lease_version + 1))
+
+    session_current.commit()
+
+    return linked_count
+
+def empty_customer_id(session_current, operator=None):
+
+    """
+    This function fills an empty customer_id of tables.
+
+    Records with a marking of exactly one customer are linked automatically
+    by auto_link_customers, the operator is asked only about the rest.
+
+    With the operator's name the records are claimed by claimed_records,
+    so that several operators can link the records at the same time.
+
+    """
+
+    linked_counts = auto_link_customers(session_current)
+
+    for table_name, linked_count in linked_counts.items():
+
+        print(f'Linked {linked_count} records of {table_name} to customers automatically')
+
+    quit_for_loop = False
+
+    cus_id_queries = {Shipments:[Shipments.customer_id,
+                                 Shipments.shipment_marking,
+                                 Shipments.shipment_id],
+                      OperationsForever:[OperationsForever.customer_id,
+                                         OperationsForever.expense_marking,
+                                         OperationsForever.expense_forever_id],
+                      OperationsIphandlers:[OperationsIphandlers.customer_id,
+                                            OperationsIphandlers.expense_marking,
+                                            OperationsIphandlers.expense_ip_id],
+                      OperationsSales:[OperationsSales.customer_id,
+                                       OperationsSales.sale_marking,
+                                       OperationsSales.sale_id]}
+
+    for table, condition_list in cus_id_queries.items():
+
+        # Records where customer_id is None, except the skipped ones
+        if operator is None:
+
+            table_records = unlinked_records(session_current, table, 'customer')
+
+        else:
+
+            table_records = claimed_records(session_current, table, 'customer', operator)
+
+        for records_to_update in table_records:
+
+            if table == Shipments:
+
+                record_names = {table:[records_to_update.shipment_marking,
+                                       records_to_update.shipment_id]}
+
+            elif table == OperationsIphandlers:
+
+                record_names = {table:[records_to_update.expense_marking,
+                                       records_to_update.expense_ip_id]}
+
+            elif table == OperationsForever:
+
+                if (records_to_update.expense_full_box == 0E-10 and
+                    records_to_update.expense_volume == 0E-10):
+
+                    records_to_update.customer_id = '0'
+
+                    session_current.commit()
+
+                    continue
+
+                record_names = {table:[records_to_update.expense_marking,
+                                       records_to_update.expense_forever_id]}
+
+            elif table == OperationsSales:
+
+                record_names = {table:[records_to_update.sale_marking,
+                                       records_to_update.sale_id]}
+
+            new_id = ''
+
+            upload = 'no'
+
+            print(border_line)
+            print(f"Updating record:\n{records_to_update}.")
+            print("Input a customer_id number to link, skip, defer, next or exit")
+
+            match = marking_index(session_current)['markings'].get(
+                                          normalize_marking(record_names[table][0]), [])
+
+            for match_id, match_customer, _ in match:
+
+                print(border_line)
+                print(f"\nFound a potential match:\nCustomer's ID:{match_id}")
+                print(f"Customer's name:{match_customer}")
+                print(f"Marking's name:{record_names[table][0]}\n")
+
+            # Similar markings are suggested when there is no exact match
+            if not match:
+
+                index = marking_index(session_current)
+
+                for similar_name, score in index['matcher'].top(record_names[table][0]):
+
+                    for match_id, match_customer, _ in index['markings'][similar_name]:
+
+                        print(border_line)
+                        print(f"\nFound a similar marking ({score:.0%}):\nCustomer's ID:{match_id}")
+                        print(f"Customer's name:{match_customer}")
+                        print(f"Marking's name:{similar_name}\n")
+
+            print(border_line)
+
+            # No transaction is kept open while the operator thinks
+            session_current.commit()
+
+            while upload != 'yes':
+
+                new_id = input("\nYour input:\n")
+
+                if (new_id == 'skip' or
+                    new_id == 'defer' or
+                    new_id == 'exit' or
+                    new_id == 'next'):
+
+                    # Skipped records are not shown again, deferred ones until tomorrow
+                    if new_id == 'skip' or new_id == 'defer':
+
+                        skip_record(session_current, table, record_names[table][1],
+                                    'customer', 'skipped' if new_id == 'skip' else 'deferred')
+
+                    print('Skipping the record...')
+
+                    break
+
+                customer = marking_index(session_current)['customers'].get(
+                                    int(new_id) if new_id.isdigit() else None)
+
+                customer_marking = str(record_names[table][0])
+
+                if (customer is not None and
+                    customer_marking):
+
+                    customer_name, customer_address = customer
+
+                    print("\nA new record to be linked to a record:")
+                    print(f"Customer's name:{customer_name}")
+                    print(f"Customer's address:{customer_address}")
+                    print(f"Marking's name:{customer_marking}")
+
+                else:
+                    print('Something went wrong!')
+
+                    continue
+
+                upload = (input("Proceed?\n")).lower()
+
+                while upload != 'yes' and upload != 'no':
+
+                    print('The answer should be only yes or no!')
+
+                    upload = (input("Proceed?\n")).lower()
+
+            if (new_id != 'skip' and
+                new_id != 'defer' and
+                new_id != 'exit' and
+                new_id != 'next'):
+
+                if not link_record(session_current, table, record_names[table][1],
+                                   'customer', int(new_id), operator):
+
+                    continue
+
+                new_markings_df = pd.DataFrame({'marking_name':[customer_marking],
+                                                'marking_customer':[customer_name],
+                                                'marking_customer_address':[customer_address]}
+                )
+
+                print("\nA new record was added and linked:")
+                print(f"Customer's name:{customer_name}")
+                print(f"Customer's address:{customer_address}")
+                print(f"Marking's name:{customer_marking}")
+
+                create_table(new_markings_df, Markings, session_current)
+
+                new_markings_df.drop(0)
+
+                # Other unlinked records of the marking, except the ones leased by others
+                marking_count = link_marking_records(session_current, table, condition_list[1],
+                                                     record_names[table][0], int(new_id), operator)
+
+                if marking_count:
+
+                    print(f'Linked {marking_count} more records with the marking {customer_marking}')
+
+                journal_decisions(session_current, table, 'customer',
+                                  [[record_names[table][1], int(new_id)]])
+
+            elif new_id == 'exit':
+
+                print('Exiting the check loop...')
+
+                quit_for_loop = True
+
+                break
+
+            elif new_id == 'next':
+
+                print(f'Skipping the {table} check loop...')
+
+                break
+
+        if quit_for_loop:
+
+            break
+
+# Columns of the tables linked to shipments: primary key, awb, marking, full box,
+# date rule of the shipment, back-link column in shipments and country column
+shipment_links = {OperationsForever:{'id':OperationsForever.expense_forever_id,
+                                     'awb':OperationsForever.expense_awb,
+                                     'marking':OperationsForever.expense_marking,
+                                     'box':OperationsForever.expense_full_box,
+                                     'date':Shipments.shipment_date < OperationsForever.expense_date,
+                                     'back_link':Shipments.expense_forever_id,
+                                     'country':OperationsForever.expense_country},
+                  OperationsIphandlers:{'id':OperationsIphandlers.expense_ip_id,
+                                        'awb':OperationsIphandlers.expense_awb,
+                                        'marking':OperationsIphandlers.expense_marking,
+                                        'box':OperationsIphandlers.expense_full_box,
+                                        'date':Shipments.shipment_date > OperationsIphandlers.expense_eta_date,
+                                        'back_link':Shipments.expense_ip_id,
+                                        'country':None},
+                  OperationsSales:{'id':OperationsSales.sale_id,
+                                   'awb':OperationsSales.sale_awb,
+                                   'marking':OperationsSales.sale_marking,
+                                   'box':OperationsSales.sale_full_box,
+                                   'date':Shipments.shipment_date < OperationsSales.sale_date,
+                                   'back_link':Shipments.sale_id,
+                                   'country':OperationsSales.sale_country}}
+
+# Shipments columns compared with the linked tables
+shipment_link_keys = {'awb':Shipments.shipment_awb,
+                      'marking':Shipments.shipment_marking,
+                      'box':Shipments.shipment_box_full}
+
+# Criteria linking a record to a shipment automatically, in priority order.
+# Single awb or marking matches are too weak and are left to an operator
+shipment_tiers = [['awb', 'marking', 'box'],
+                  ['awb', 'marking'],
+                  ['awb', 'box'],
+                  ['marking', 'box']]
+
+# Names of the criteria printed to an operator
+shipment_criteria_names = {'awb':'AWB', 'marking':'marking', 'box':'full box'}
+
+def shipment_candidates(session_current, table_class, record_ids=None, first_id=None):
+
+    """
+    This function returns the shipments matching the records of the table
+    by awb or marking and the date rule, fetched in one query and labelled
+    with the criteria they satisfy. Without record_ids the candidates
+    of all the records with an empty shipment_id are returned, or of the
+    ones with primary keys greater than first_id.
+
+    Returns a dictionary: record id -> list of candidates, a candidate is
+    a dictionary of the shipment's columns and the list of 'criteria'
+    ('awb', 'marking', 'box') in the order of shipment_link_keys.
+
+    """
+
+    link_columns = shipment_links[table_class]
+
+    pk_column = link_columns['id']
+
+    # 1 for every criterion the shipment satisfies
+    criteria_columns = [case((shipment_link_keys[key] == link_columns[key], 1), else_=0).label(key)
+                        for key in shipment_link_keys]
+
+    query = session_current.query(pk_column,
+                                  Shipments.shipment_id,
+                                  Shipments.shipment_date,
+                                  Shipments.shipment_awb,
+                                  Shipments.shipment_marking,
+                                  Shipments.shipment_box_full,
+                                  *criteria_columns).select_from(table_class).join(Shipments, and_(
+                                  or_(Shipments.shipment_awb == link_columns['awb'],
+                                      Shipments.shipment_marking == link_columns['marking']),
+                                  link_columns['date']))
+
+    if record_ids is None:
+
+        query = query.filter(table_class.shipment_id.is_(None))
+
+        if first_id is not None:
+
+            query = query.filter(pk_column > first_id)
+
+    else:
+
+        query = query.filter(pk_column.in_(record_ids))
+
+    candidates = {}
+
+    for row in query:
+
+        candidate = {'shipment_id':row.shipment_id,
+                     'shipment_date':row.shipment_date,
+                     'shipment_awb':row.shipment_awb,
+                     'shipment_marking':row.shipment_marking,
+                     'shipment_box_full':row.shipment_box_full,
+                     'criteria':[key for key in shipment_link_keys if getattr(row, key)]}
+
+        candidates.setdefault(row[0], []).append(candidate)
+
+    return candidates
+
+def link_shipments_back(session_current, table_class):
+
+    """
+    This function links the shipments back to the linked records of the table
+    and fills the country of the records from their shipments
+
+    """
+
+    link_columns = shipment_links[table_class]
+
+    session_current.execute(update(Shipments).values({link_columns['back_link']:link_columns['id']})
+                            .where(and_(
+                                link_columns['back_link'].is_(None),
+                                table_class.shipment_id == Shipments.shipment_id)))
+
+    if link_columns['country'] is not None:
+
+        session_current.execute(update(table_class)
+                                .values({link_columns['country']:Shipments.shipment_country})
+                                .where(and_(
+                                    link_columns['country'].is_(None),
+                                    Shipments.shipment_id == table_class.shipment_id)))
+
+def auto_link_shipments(session_current, first_ids=None):
+
+    """
+    This function links the records with an empty shipment_id to the shipments
+    without asking an operator. Candidates of all the unlinked records are fetched
+    at once by shipment_candidates and checked against shipment_tiers in order:
+    a record is linked at the first tier with exactly one shipment, a record
+    with several shipments at its first matching tier is ambiguous and is left
+    to empty_shipment_id. With first_ids (table -> primary key) only the records
+    with greater primary keys are checked.
+
+    Returns a dictionary by table name of linked records count
+    and the list of ambiguous records ids.
+
+    """
+
+    link_results = {}
+
+    # Forever records without boxes and volume belong to no shipment
+    session_current.execute(update(OperationsForever).values(shipment_id='0').where(and_(
+                            OperationsForever.shipment_id.is_(None),
+                            OperationsForever.expense_full_box == 0,
+                            OperationsForever.expense_volume == 0)))
+
+    for table_class, link_columns in shipment_links.items():
+
+        table_object = table_class.__table__
+
+        pk_column = link_columns['id']
+
+        ambiguous_ids = []
+
+        links = []
+
+        first_id = first_ids[table_class] if first_ids is not None else None
+
+        for record_id, record_candidates in shipment_candidates(session_current, table_class,
+                                                                first_id=first_id).items():
+
+            for tier in shipment_tiers:
+
+                tier_ids = {candidate['shipment_id'] for candidate in record_candidates
+                            if set(tier) <= set(candidate['criteria'])}
+
+                # Records are decided by the first tier they match
+                if len(tier_ids) == 1:
+
+                    links.append({'b_id':record_id, 'b_shipment_id':tier_ids.pop()})
+
+                    break
+
+                if tier_ids:
+
+                    ambiguous_ids.append(record_id)
+
+                    break
+
+        # A shipment of a unique shipment_id column is linked to one record only
+        if table_class.__table__.c.shipment_id.unique:
+
+            taken_ids = {shipment_id for shipment_id, in session_current.query(
+                         table_class.shipment_id).filter(table_class.shipment_id.is_not(None))}
+
+            link_counts = {}
+
+            for link in links:
+
+                link_counts[link['b_shipment_id']] = link_counts.get(link['b_shipment_id'], 0) + 1
+
+            ambiguous_ids += [link['b_id'] for link in links
+                              if link['b_shipment_id'] in taken_ids
+                              or link_counts[link['b_shipment_id']] > 1]
+
+            links = [link for link in links
+                     if link['b_shipment_id'] not in taken_ids
+                     and link_counts[link['b_shipment_id']] == 1]
+
+        if links:
+
+            # Records linked by an operator meanwhile are left as they are
+            session_current.execute(table_object.update()
+                                    .where(and_(table_object.c[pk_column.key] == bindparam('b_id'),
+                                                table_object.c.shipment_id.is_(None)))
+                                    .values(shipment_id=bindparam('b_shipment_id')),
+                                    links)
+
+            link_shipments_back(session_current, table_class)
+
+        link_results[table_class.__tablename__] = [len(links), ambiguous_ids]
+
+    session_current.commit()
+
+    return link_results
+
+def table_watermarks(session_current):
+
+    """
+    This function returns the greatest primary key of every linked table,
+    records imported later get greater primary keys
+
+    """
+
+    return {table_class:session_current.query(
+                        func.max(table_class.__mapper__.primary_key[0])).scalar() or 0
+            for table_class in marking_columns}
+
+def link_new_records(session_current, watermarks):
+
+    """
+    This function links the records imported after the watermarks from
+    table_watermarks in one pass per table: customers by markings and
+    shipments by shipment_tiers. When new shipments were imported the older
+    unlinked records are checked against them too.
+
+    Prints and returns by table name the count of new records, of records linked
+    to customers and shipments (older records linked to new shipments included),
+    and of new records left open for the review.
+
+    """
+
+    customer_counts = auto_link_customers(session_current, watermarks)
+
+    last_shipment_id = session_current.query(func.max(Shipments.shipment_id)).scalar() or 0
+
+    new_shipments = last_shipment_id > watermarks[Shipments]
+
+    shipment_results = auto_link_shipments(session_current,
+                                           None if new_shipments else watermarks)
+
+    link_report = {}
+
+    print(border_line)
+
+    for table_class, watermark in watermarks.items():
+
+        table_name = table_class.__tablename__
+
+        pk_column = table_class.__mapper__.primary_key[0]
+
+        new_records = session_current.query(table_class).filter(pk_column > watermark)
+
+        table_report = {'new':new_records.count(),
+                        'customer_linked':customer_counts[table_name],
+                        'customer_open':new_records.filter(table_class.customer_id.is_(None)).count()}
+
+        report_line = (f"{table_name}: {table_report['new']} new records, "
+                       f"{table_report['customer_linked']} linked to customers "
+                       f"({table_report['customer_open']} open)")
+
+        if table_class in shipment_links:
+
+            table_report['shipment_linked'] = shipment_results[table_name][0]
+
+            table_report['shipment_open'] = new_records.filter(
+                                            table_class.shipment_id.is_(None)).count()
+
+            report_line += (f", {table_report['shipment_linked']} linked to shipments "
+                            f"({table_report['shipment_open']} open)")
+
+        print(report_line)
+
+        link_report[table_name] = table_report
+
+    print(border_line)
+
+    return link_report
+
+def empty_shipment_id(session_current, operator=None):
+
+    """
+    This function fills an empty shipment_id of tables.
+
+    Records with one shipment at a tier of shipment_tiers are linked
+    automatically by auto_link_shipments, the operator is asked only
+    about the ambiguous and not matched records.
+
+    With the operator's name the records are claimed by claimed_records,
+    so that several operators can link the records at the same time.
+
+    """
+
+    link_results = auto_link_shipments(session_current)
+
+    for table_name, (linked_count, ambiguous_ids) in link_results.items():
+
+        print(f'Linked {linked_count} records of {table_name} to shipments automatically, '
+              f'{len(ambiguous_ids)} records have several shipments')
+
+    quit_for_loop = False
+
+    ship_id_queries = {OperationsForever:[OperationsForever.shipment_id, 'expense_forever_id'],
+                       OperationsIphandlers:[OperationsIphandlers.shipment_id, 'expense_ip_id'],
+                       OperationsSales:[OperationsSales.shipment_id, 'sale_id']}
+
+    for table, condition_list in ship_id_queries.items():
+
+        # Records where shipment_id is None, except the skipped ones
+        if operator is None:
+
+            table_records = unlinked_records(session_current, table, 'shipment')
+
+        else:
+
+            table_records = claimed_records(session_current, table, 'shipment', operator)
+
+        for record in table_records:
+
+            if table == OperationsIphandlers:
+
+                record_names = {table:[record.expense_awb,
+                                       record.expense_full_box,
+                                       record.expense_marking,
+                                       record.expense_eta_date,
+                                       Shipments.shipment_date > record.expense_eta_date,
+                                       record.expense_ip_id]}
+
+            elif table == OperationsForever:
+
+                if (record.expense_full_box == 0E-10 and
+                    record.expense_volume == 0E-10):
+
+                    record.shipment_id = '0'
+
+                    continue
+
+                record_names = {table:[record.expense_awb,
+                                       record.expense_full_box,
+                                       record.expense_marking,
+                                       record.expense_date,
+                                       Shipments.shipment_date < record.expense_date,
+                                       record.expense_forever_id]}
+
+            elif table == OperationsSales:
+
+                record_names = {table:[record.sale_awb,
+                                       record.sale_full_box,
+                                       record.sale_marking,
+                                       record.sale_date,
+                                       Shipments.shipment_date < record.sale_date,
+                                       record.sale_id]}
 
             new_id = ''
 
-            upload = 'no'
+            upload = 'no'
+
+            print(border_line)
+            print(f"Updating record:\n{record}.")
+            print("Input a shipment_id number to link, skip, defer, next or exit")
+
+            candidates = shipment_candidates(session_current, table,
+                                             [record_names[table][5]]).get(record_names[table][5], [])
+
+            for candidate in candidates:
+
+                match_type = ' and '.join(shipment_criteria_names[key]
+                                          for key in candidate['criteria'])
+
+                print(border_line)
+                print(f"Found a match by {match_type}:")
+                print(f"Shipment's ID:{candidate['shipment_id']}")
+                print(f"Shipment's date:{candidate['shipment_date']}")
+                print(f"Shipment's awb:{candidate['shipment_awb']}")
+                print(f"Shipment's marking:{candidate['shipment_marking']}")
+                print(f"Shipment's full box:{candidate['shipment_box_full']}\n")
+
+            # No transaction is kept open while the operator thinks
+            session_current.commit()
+
+            while upload != 'yes':
+
+                print(border_line)
+
+                new_id = input("\nYour input:\n")
+
+                if (new_id == 'skip' or
+                    new_id == 'defer' or
+                    new_id == 'exit' or
+                    new_id == 'next'):
+
+                    # Skipped records are not shown again, deferred ones until tomorrow
+                    if new_id == 'skip' or new_id == 'defer':
+
+                        skip_record(session_current, table, record_names[table][5],
+                                    'shipment', 'skipped' if new_id == 'skip' else 'deferred')
+
+                    print('Skipping the record...')
+
+                    break
+
+                picked_record = session_current.query(Shipments).filter(
+                                                        Shipments.shipment_id.is_(new_id))
+
+                for p_row in picked_record:
+
+                    if p_row:
+
+                        print("\nA new record to be linked to a record:")
+                        print(f"Shipment's ID:{p_row.shipment_id}")
+                        print(f"Shipment's date:{p_row.shipment_date}")
+                        print(f"Shipment's awb:{p_row.shipment_awb}")
+                        print(f"Shipment's marking:{p_row.shipment_marking}")
+                        print(f"Shipment's full box:{p_row.shipment_box_full}")
+
+                        upload = (input("Proceed?\n")).lower()
+
+                        while upload != 'yes' and upload != 'no':
+
+                            print('The answer should be only yes or no!')
+
+                            upload = (input("Proceed?\n")).lower()
+
+                    elif not p_row:
+                        print('No record for this shipment_id!')
+
+            if (new_id != 'skip' and
+                new_id != 'defer' and
+                new_id != 'exit' and
+                new_id != 'next'):
+
+                if not link_record(session_current, table, record_names[table][5],
+                                   'shipment', int(new_id), operator):
+
+                    continue
+
+                journal_decisions(session_current, table, 'shipment',
+                                  [[record_names[table][5], int(new_id)]])
+
+            elif new_id == 'exit':
+
+                print('Exiting the check loop...')
+
+                quit_for_loop = True
+
+                break
+
+            elif new_id == 'next':
+
+                print(f'Skipping the {table} check loop...')
+
+                break
+
+        session_current.commit()
+
+        if quit_for_loop:
+
+            break
+
+# Tables linked by the review queue by name
+review_tables = {table_class.__tablename__:table_class for table_class in marking_columns}
+
+def queue_reviews(session_current):
+
+    """
+    This function writes the records left unlinked by auto_link_customers and
+    auto_link_shipments to the table 'review_queue' with their candidates:
+    customers of the same or similar markings and shipments matching by awb
+    or marking. Records skipped in the table 'link_skips' and records deferred
+    today are not queued, the same way as in the linking loops. Open reviews
+    of the records linked or skipped since then are closed.
+
+    Returns the count of open reviews.
+
+    """
+
+    index = marking_index(session_current)
+
+    today = date.today()
+
+    reviews = []
+
+    # Statuses of the records skipped or deferred by the operators, they aren't queued
+    skipped_keys = {}
+
+    for table_class, marking_column in marking_columns.items():
+
+        pk_column = table_class.__mapper__.primary_key[0]
+
+        records = session_current.query(pk_column, marking_column, LinkSkips.skip_status).outerjoin(
+                                        LinkSkips, skip_condition(table_class, 'customer')).filter(
+                                        table_class.customer_id.is_(None))
+
+        # Candidates are the same for every record of a marking
+        marking_candidates = {}
+
+        for record_id, marking_name, skip_status in records:
+
+            if skip_status is not None:
+
+                skipped_keys[(table_class.__tablename__, record_id, 'customer')] = skip_status
+
+                continue
+
+            if marking_name not in marking_candidates:
+
+                candidates = []
+
+                similar_names = index['matcher'].top(marking_name, count=3)
+
+                for similar_name, score in similar_names:
+
+                    for match_id, match_customer, _ in index['markings'][similar_name]:
+
+                        candidates.append(f'{match_id}: {match_customer} '
+                                          f'({similar_name}, {score:.0%})')
+
+                marking_candidates[marking_name] = '; '.join(candidates)
+
+            reviews.append({'review_date':today,
+                            'review_table':table_class.__tablename__,
+                            'review_record_id':record_id,
+                            'review_link':'customer',
+                            'review_marking':marking_name,
+                            'review_candidates':marking_candidates[marking_name],
+                            'review_status':'open'})
+
+    for table_class, link_columns in shipment_links.items():
+
+        pk_column = link_columns['id']
+
+        candidates = shipment_candidates(session_current, table_class)
+
+        records = session_current.query(pk_column, link_columns['marking'],
+                                        LinkSkips.skip_status).outerjoin(
+                                        LinkSkips, skip_condition(table_class, 'shipment')).filter(
+                                        table_class.shipment_id.is_(None))
+
+        for record_id, marking_name, skip_status in records:
+
+            if skip_status is not None:
+
+                skipped_keys[(table_class.__tablename__, record_id, 'shipment')] = skip_status
+
+                continue
+
+            review_candidates = '; '.join(
+                f"{candidate['shipment_id']}: {candidate['shipment_date']} "
+                f"{candidate['shipment_awb']} {candidate['shipment_marking']} "
+                f"(by {' and '.join(shipment_criteria_names[key] for key in candidate['criteria'])})"
+                for candidate in candidates.get(record_id, []))
+
+            reviews.append({'review_date':today,
+                            'review_table':table_class.__tablename__,
+                            'review_record_id':record_id,
+                            'review_link':'shipment',
+                            'review_marking':marking_name,
+                            'review_candidates':review_candidates,
+                            'review_status':'open'})
+
+    review_statement = sqlite_insert(ReviewQueue.__table__)
+
+    # Open reviews get fresh candidates, decided reviews are kept as they are
+    review_statement = review_statement.on_conflict_do_update(
+                       index_elements=['review_table', 'review_record_id', 'review_link'],
+                       set_={'review_date':review_statement.excluded.review_date,
+                             'review_candidates':review_statement.excluded.review_candidates},
+                       where=ReviewQueue.review_status == 'open')
+
+    for batch_start in range(0, len(reviews), 500):
+
+        session_current.execute(review_statement, reviews[batch_start:batch_start + 500])
+
+    # Close the open reviews of the records linked or skipped since they were queued,
+    # reviews of the records deferred today stay open
+    queued_keys = {(review['review_table'], review['review_record_id'], review['review_link'])
+                   for review in reviews}
+
+    linked_reviews = [{'b_id':review_id,
+                       'b_status':'skipped' if (review_table, record_id, review_link)
+                                               in skipped_keys else 'linked'}
+                      for review_id, review_table, record_id, review_link in session_current.query(
+                          ReviewQueue.review_id,
+                          ReviewQueue.review_table,
+                          ReviewQueue.review_record_id,
+                          ReviewQueue.review_link).filter(ReviewQueue.review_status == 'open')
+                      if (review_table, record_id, review_link) not in queued_keys and
+                      skipped_keys.get((review_table, record_id, review_link)) != 'deferred']
+
+    if linked_reviews:
+
+        session_current.execute(ReviewQueue.__table__.update()
+                                .where(ReviewQueue.__table__.c.review_id == bindparam('b_id'))
+                                .values(review_status=bindparam('b_status')),
+                                linked_reviews)
+
+    session_current.commit()
+
+    return session_current.query(func.count(ReviewQueue.review_id)).filter(
+                                 ReviewQueue.review_status == 'open').scalar()
+
+def export_review_queue(session_current):
+
+    """
+    This function saves the open reviews to the review_queue.xlsx file,
+    an operator fills the column 'review_decision' with a customer_id or
+    shipment_id to link, or with 'skip', for apply_review_decisions
+
+    Returns the path of the file.
+
+    """
+
+    if os.path.exists('C:/autocargo_reports/export/'):
+
+        directory_name = 'C:/autocargo_reports/export/'
+
+    else:
+
+        directory_name = 'C:/'
+
+        print('Couldnt find a path to save the file, saving to the disc C')
+
+    review_path = f'{directory_name}review_queue.xlsx'
+
+    review_df = pd.read_sql(select(ReviewQueue.review_id,
+                                   ReviewQueue.review_date,
+                                   ReviewQueue.review_table,
+                                   ReviewQueue.review_record_id,
+                                   ReviewQueue.review_link,
+                                   ReviewQueue.review_marking,
+                                   ReviewQueue.review_candidates,
+                                   ReviewQueue.review_decision)
+                            .where(ReviewQueue.review_status == 'open')
+                            .order_by(ReviewQueue.review_link, ReviewQueue.review_marking),
+                            session_current.connection())
+
+    review_df.to_excel(review_path, index=False)
+
+    print(f'{len(review_df.index)} open reviews were saved to {review_path}')
+
+    return review_path
+
+def apply_review_decisions(session_current, review_path=None):
+
+    """
+    This function applies the decisions of an operator from the review_queue.xlsx
+    file in bulk: customer_id and shipment_id are written to the records with
+    one statement per table, markings of the linked customers are added to
+    the table 'markings' so that the next imports are linked automatically,
+    and the reviews are closed as 'applied' or 'skipped'.
+
+    Returns a dictionary of applied and skipped decisions count.
+
+    """
+
+    if review_path is None:
+
+        review_path = 'C:/autocargo_reports/export/review_queue.xlsx'
+
+    if not os.path.exists(review_path):
+
+        print('Review queue file was not found!')
+        print('Decisions were not applied.')
+
+        return {'applied':0, 'skipped':0}
+
+    review_df = pd.read_excel(review_path, dtype={'review_decision':str})
+
+    review_df = review_df[review_df['review_decision'].notna()]
+
+    index = marking_index(session_current)
+
+    links = {}
+
+    closed_reviews = []
+
+    skipped_records = []
+
+    new_markings = {}
+
+    decisions = []
+
+    for review in review_df.to_dict('records'):
+
+        decision = str(review['review_decision']).strip().lower()
+
+        if decision.endswith('.0'):
+
+            decision = decision[:-2]
+
+        decisions.append((review, decision))
+
+    shipment_decisions = [(review, int(decision)) for review, decision in decisions
+                          if review['review_link'] == 'shipment' and decision.isdigit()
+                          and review_tables.get(review['review_table']) in shipment_links]
+
+    chosen_ids = sorted({shipment_id for _, shipment_id in shipment_decisions})
+
+    review_ids = [review['review_id'] for review, _ in shipment_decisions]
+
+    # Shipments of the decisions that exist in the table 'shipments'
+    known_shipments = set()
+
+    # Shipments queued as candidates of the reviews
+    queued_candidates = {}
+
+    for chunk_start in range(0, max(len(chosen_ids), len(review_ids)), 500):
+
+        known_shipments.update(shipment_id for shipment_id, in session_current.query(
+                               Shipments.shipment_id).filter(Shipments.shipment_id.in_(
+                               chosen_ids[chunk_start:chunk_start + 500])))
+
+        for review_id, review_candidates in session_current.query(
+                                            ReviewQueue.review_id, ReviewQueue.review_candidates).filter(
+                                            ReviewQueue.review_id.in_(review_ids[chunk_start:chunk_start + 500])):
 
-            print(border_line)
-            print(f"Updating record:\n{records_to_update}.")
-            print("Input a customer_id number to link, skip, next or exit")
+            queued_candidates[review_id] = {int(candidate.split(':')[0])
+                                            for candidate in (review_candidates or '').split('; ')
+                                            if candidate.split(':')[0].strip().isdigit()}
 
-            match = session_current.query(Markings.customer_id,
-                                          Markings.marking_customer,
-                                          Markings.marking_name).filter(
-                                          Markings.marking_name.in_([record_names[table][0]])
-            )
+    # Decisions of the existing shipments queued as candidates of their reviews
+    valid_decisions = [(review, shipment_id) for review, shipment_id in shipment_decisions
+                       if shipment_id in known_shipments and
+                       (not queued_candidates.get(review['review_id']) or
+                        shipment_id in queued_candidates[review['review_id']])]
 
-            update_id = update(table).values(customer_id=session_current
-                                     .query(Markings.customer_id)
-                                     .filter(Markings.marking_name == condition_list[1])
-                                     .as_scalar()
-                                     ).where(condition_list[1] == record_names[table][0])
+    # Shipments of a unique shipment_id column linked to another record or chosen twice
+    taken_shipments = {}
 
-            for row in match:
+    for table_class in shipment_links:
 
-                print(border_line)
-                print(f"\nFound a potential match:\nCustomer's ID:{row.customer_id}")
-                print(f"Customer's name:{row.marking_customer}")
-                print(f"Marking's name:{row.marking_name}\n")
+        if not table_class.__table__.c.shipment_id.unique:
 
-            print(border_line)
+            continue
 
-            while upload != 'yes':
+        pk_column = table_class.__mapper__.primary_key[0]
 
-                new_id = input("\nYour input:\n")
+        table_chosen = [shipment_id for review, shipment_id in valid_decisions
+                        if review['review_table'] == table_class.__tablename__]
 
-                if (new_id == 'skip' or
-                    new_id == 'exit' or
-                    new_id == 'next'):
+        table_taken = {}
 
-                    if new_id == 'skip':
+        for chunk_start in range(0, len(table_chosen), 500):
 
-                        skip_id.append(int(record_names[table][1]))
+            table_taken.update({shipment_id:record_id for record_id, shipment_id in
+                                session_current.query(pk_column, table_class.shipment_id).filter(
+                                table_class.shipment_id.in_(table_chosen[chunk_start:chunk_start + 500]))})
 
-                    print('Skipping the record...')
+        for shipment_id in table_chosen:
 
-                    break
+            if table_chosen.count(shipment_id) > 1:
 
-                customer_name = session_current.query(Markings.marking_customer).filter(
-                                                    Markings.customer_id.is_(new_id)).first()
+                table_taken[shipment_id] = None
 
-                customer_address = session_current.query(Markings.marking_customer_address).filter(
-                                                    Markings.customer_id.is_(new_id)).first()
+        taken_shipments[table_class.__tablename__] = table_taken
 
-                customer_marking = str(record_names[table][0])
+    for review, decision in decisions:
 
-                if (customer_name is not None and
-                    customer_address is not None and
-                    customer_marking):
+        if decision == 'skip':
 
-                    print("\nA new record to be linked to a record:")
-                    print(f"Customer's name:{customer_name[0]}")
-                    print(f"Customer's address:{customer_address[0]}")
-                    print(f"Marking's name:{customer_marking}")
+            closed_reviews.append({'b_id':review['review_id'],
+                                   'b_decision':decision,
+                                   'b_status':'skipped'})
 
-                else:
-                    print('Something went wrong!')
+            skipped_records.append([review['review_table'], review['review_record_id'],
+                                    review['review_link']])
 
-                    continue
+            continue
 
-                upload = (input("Proceed?\n")).lower()
+        if not decision.isdigit() or review['review_table'] not in review_tables:
 
-                while upload != 'yes' and upload != 'no':
+            print(f"Decision {review['review_decision']} of review {review['review_id']} "
+                  f"is not valid, the review is left open")
 
-                    print('The answer should be only yes or no!')
+            continue
 
-                    upload = (input("Proceed?\n")).lower()
+        if review['review_link'] == 'customer':
 
-            if (new_id != 'skip' and
-                new_id != 'exit' and
-                new_id != 'next'):
+            customer = index['customers'].get(int(decision))
 
-                records_to_update.customer_id = new_id
+            if customer is None:
 
-                new_markings_df = pd.DataFrame({'marking_name':[customer_marking],
-                                                'marking_customer':[customer_name[0]],
-                                                'marking_customer_address':[customer_address[0]]}
-                )
+                print(f"Customer {decision} of review {review['review_id']} has no markings, "
+                      f"the review is left open")
 
-                print("\nA new record was added and linked:")
-                print(f"Customer's name:{customer_name[0]}")
-                print(f"Customer's address:{customer_address[0]}")
-                print(f"Marking's name:{customer_marking}")
+                continue
 
-                if os.path.exists('C:/autocargo_reports/export/'):
+            # The marking is linked to the customer for the next imports
+            if normalize_marking(review['review_marking']) not in index['markings']:
 
-                    directory_name = 'C:/autocargo_reports/export/'
+                new_markings[normalize_marking(review['review_marking'])] = [
+                                review['review_marking'], customer[0], customer[1]]
 
-                else:
+        elif review['review_link'] == 'shipment':
 
-                    directory_name = 'C:/'
+            shipment_id = int(decision)
 
-                    print('Couldnt find a path to save the file, saving to the disc C')
+            candidate_ids = queued_candidates.get(review['review_id'], set())
 
-                new_markings_path = f'{directory_name}new_marking.xlsx'
+            table_taken = taken_shipments.get(review['review_table'], {})
 
-                new_markings_df.to_excel(new_markings_path)
+            if shipment_id not in known_shipments:
 
-                create_table(new_markings_df, Markings, session_current)
+                print(f"Shipment {decision} of review {review['review_id']} doesn't exist, "
+                      f"the review is left open")
 
-                new_markings_df.drop(0)
+                continue
 
-                session_current.execute(update_id)
+            # Reviews without candidates accept any shipment
+            if candidate_ids and shipment_id not in candidate_ids:
 
-                session_current.commit()
+                print(f"Shipment {decision} of review {review['review_id']} is not "
+                      f"one of its candidates, the review is left open")
 
-            elif new_id == 'exit':
+                continue
 
-                print('Exiting the check loop...')
+            if (shipment_id in table_taken and
+                table_taken[shipment_id] != int(review['review_record_id'])):
 
-                quit_for_loop = True
+                print(f"Shipment {decision} of review {review['review_id']} is linked to "
+                      f"another record or chosen twice, the review is left open")
 
-                break
+                continue
 
-            elif new_id == 'next':
+        links.setdefault((review['review_table'], review['review_link']), []).append(
+                         {'b_id':review['review_record_id'], 'b_link_id':int(decision)})
 
-                print(f'Skipping the {table} check loop...')
+        closed_reviews.append({'b_id':review['review_id'],
+                               'b_decision':decision,
+                               'b_status':'applied'})
 
-                break
+    try:
 
-            if not skip_id:
+        for (table_name, review_link), table_links in links.items():
 
-                # Fetch the records that match the empty condition
-                records_to_update = session_current.query(table).filter(condition).first()
+            table_class = review_tables[table_name]
 
-            if skip_id:
+            table_object = table_class.__table__
 
-                records_to_update = session_current.query(table).filter(and_(condition, condition_list[2].not_in(skip_id))).first()
+            pk_column = table_class.__mapper__.primary_key[0]
 
-        if quit_for_loop:
+            session_current.execute(table_object.update()
+                                    .where(table_object.c[pk_column.key] == bindparam('b_id'))
+                                    .values({f'{review_link}_id':bindparam('b_link_id')}),
+                                    table_links)
 
-            break
+            if review_link == 'shipment':
+
+                link_shipments_back(session_current, table_class)
+
+        if closed_reviews:
+
+            session_current.execute(ReviewQueue.__table__.update()
+                                    .where(ReviewQueue.__table__.c.review_id == bindparam('b_id'))
+                                    .values(review_decision=bindparam('b_decision'),
+                                            review_status=bindparam('b_status')),
+                                    closed_reviews)
+
+        session_current.commit()
+
+    except IntegrityError:
 
-def empty_shipment_id(session_current):
+        session_current.rollback()
+
+        print('A shipment of the decisions is already linked to another record!')
+        print('Decisions were not applied.')
+
+        return {'applied':0, 'skipped':0}
+
+    for (table_name, review_link), table_links in links.items():
+
+        journal_decisions(session_current, review_tables[table_name], review_link,
+                          [[link['b_id'], link['b_link_id']] for link in table_links])
+
+    # Skipped records are not shown in the linking loops either
+    for table_name, record_id, review_link in skipped_records:
+
+        if table_name in review_tables:
+
+            skip_record(session_current, review_tables[table_name], record_id, review_link)
+
+    if new_markings:
+
+        create_table(pd.DataFrame(new_markings.values(),
+                                  columns=['marking_name', 'marking_customer',
+                                           'marking_customer_address']),
+                     Markings, session_current, bulk=True)
+
+        # Other records of the new markings are linked right away
+        auto_link_customers(session_current)
+
+    applied_count = sum(1 for review in closed_reviews if review['b_status'] == 'applied')
+
+    print(f'{applied_count} decisions were applied, '
+          f'{len(closed_reviews) - applied_count} reviews were skipped')
+
+    return {'applied':applied_count, 'skipped':len(closed_reviews) - applied_count}
+
+def decision_journal_path():
 
     """
-    This function fills an empty shipment_id of tables
+    This function returns the path of the journal of the linking decisions
 
     """
 
-    quit_for_loop = False
+    if os.path.exists('C:/autocargo_reports/export/'):
 
-    ship_id_queries = {OperationsForever:[OperationsForever.shipment_id, 'expense_forever_id'],
-                       OperationsIphandlers:[OperationsIphandlers.shipment_id, 'expense_ip_id'],
-                       OperationsSales:[OperationsSales.shipment_id, 'sale_id']}
+        directory_name = 'C:/autocargo_reports/export/'
 
-    for table, condition_list in ship_id_queries.items():
+    else:
 
-        # SCondition to identify records where customer_id is None
-        condition = condition_list[0].is_(None)
+        directory_name = 'C:/'
 
-        # Fetch the records that match the empty condition
-        records_to_update = session_current.query(table).filter(condition).all()
+        print('Couldnt find a path to save the file, saving to the disc C')
 
-        for record in records_to_update:
+    return f'{directory_name}link_decisions.jsonl'
 
-            if table == OperationsIphandlers:
+def journal_decisions(session_current, table_class, link, decisions):
 
-                record_names = {table:[record.expense_awb,
-                                       record.expense_full_box,
-                                       record.expense_marking,
-                                       record.expense_eta_date,
-                                       Shipments.shipment_date > record.expense_eta_date,
-                                       record.expense_ip_id]}
+    """
+    This function appends the linking decisions of an operator to the journal,
+    one compact JSON line per decision. Decisions are [record's id, customer_id
+    or shipment_id] lists, link is 'customer' or 'shipment'. Records and shipments
+    are written by their duplicate_keys instead of the ids, so the journal
+    can be replayed on a rebuilt database by replay_decisions.
 
-            elif table == OperationsForever:
+    Returns the count of journaled decisions.
 
-                if (record.expense_full_box == 0E-10 and
-                    record.expense_volume == 0E-10):
+    """
 
-                    record.shipment_id = '0'
+    pk_column = table_class.__mapper__.primary_key[0]
 
-                    continue
+    key_columns = [getattr(table_class, key) for key in duplicate_keys[table_class]]
 
-                record_names = {table:[record.expense_awb,
-                                       record.expense_full_box,
-                                       record.expense_marking,
-                                       record.expense_date,
-                                       Shipments.shipment_date < record.expense_date,
-                                       record.expense_forever_id]}
+    decision_ids = dict(decisions)
 
-            elif table == OperationsSales:
+    record_keys = {}
 
-                record_names = {table:[record.sale_awb,
-                                       record.sale_full_box,
-                                       record.sale_marking,
-                                       record.sale_date,
-                                       Shipments.shipment_date < record.sale_date,
-                                       record.sale_id]}
+    shipment_keys = {}
 
-            new_id = ''
+    record_ids = list(decision_ids)
 
-            upload = 'no'
+    for chunk_start in range(0, len(record_ids), 500):
 
-            print(border_line)
-            print(f"Updating record:\n{record}.")
-            print("Input a shipment_id number to link, skip, next or exit")
-
-            awb_match = session_current.query(Shipments.shipment_id,
-                                              Shipments.shipment_awb,
-                                              Shipments.shipment_box_full,
-                                              Shipments.shipment_marking,
-                                              Shipments.shipment_date).filter(and_(
-                                              Shipments.shipment_awb == record_names[table][0],
-                                              record_names[table][4]
-                                              )
-            )
-
-            marking_match = session_current.query(Shipments.shipment_id,
-                                                  Shipments.shipment_awb,
-                                                  Shipments.shipment_box_full,
-                                                  Shipments.shipment_marking,
-                                                  Shipments.shipment_date).filter(and_(
-                                                  Shipments.shipment_marking == record_names[table][2],
-                                                  record_names[table][4]
-                                                  )
-            )
-
-            awb_box_match = session_current.query(Shipments.shipment_id,
-                                                  Shipments.shipment_awb,
-                                                  Shipments.shipment_box_full,
-                                                  Shipments.shipment_marking,
-                                                  Shipments.shipment_date).filter(and_(
-                                                  Shipments.shipment_awb == record_names[table][0],
-                                                  Shipments.shipment_box_full == record_names[table][1],
-                                                  record_names[table][4]
-                                                  )
-            )
-
-            awb_marking_match = session_current.query(Shipments.shipment_id,
-                                                      Shipments.shipment_awb,
-                                                      Shipments.shipment_box_full,
-                                                      Shipments.shipment_marking,
-                                                      Shipments.shipment_date).filter(and_(
-                                                      Shipments.shipment_awb == record_names[table][0],
-                                                      Shipments.shipment_marking == record_names[table][2],
-                                                      record_names[table][4]
-                                                      )
-            )
-
-            box_marking_match = session_current.query(Shipments.shipment_id,
-                                                      Shipments.shipment_awb,
-                                                      Shipments.shipment_box_full,
-                                                      Shipments.shipment_marking,
-                                                      Shipments.shipment_date).filter(and_(
-                                                      Shipments.shipment_box_full == record_names[table][1],
-                                                      Shipments.shipment_marking == record_names[table][2],
-                                                      record_names[table][4]
-                                                      )
-            )
-
-            match_list = {'Found a match by AWB:':awb_match,
-                          'Found a match by marking:':marking_match,
-                          'Found a match by AWB and full box:':awb_box_match,
-                          'Found a match by AWB and marking:':awb_marking_match,
-                          'Found a match by marking and full box:':box_marking_match}
-
-            for match_type, match in match_list.items():
-
-                for row in match:
-
-                    print(border_line)
-                    print(match_type)
-                    print(f"Shipment's ID:{row.shipment_id}")
-                    print(f"Shipment's date:{row.shipment_date}")
-                    print(f"Shipment's awb:{row.shipment_awb}")
-                    print(f"Shipment's marking:{row.shipment_marking}")
-                    print(f"Shipment's full box:{row.shipment_box_full}\n")
+        for row in session_current.query(pk_column, marking_columns[table_class], *key_columns).filter(
+                                         pk_column.in_(record_ids[chunk_start:chunk_start + 500])):
 
-            while upload != 'yes':
+            record_keys[row[0]] = [row[1], dict(zip(duplicate_keys[table_class], row[2:]))]
 
-                print(border_line)
+    if link == 'shipment':
 
-                new_id = input("\nYour input:\n")
+        shipment_ids = list(set(decision_ids.values()))
 
-                if (new_id == 'skip' or
-                    new_id == 'exit' or
-                    new_id == 'next'):
+        shipment_columns = [getattr(Shipments, key) for key in duplicate_keys[Shipments]]
 
-                    print('Skipping the record...')
+        for chunk_start in range(0, len(shipment_ids), 500):
 
-                    break
+            for row in session_current.query(Shipments.shipment_id, *shipment_columns).filter(
+                            Shipments.shipment_id.in_(shipment_ids[chunk_start:chunk_start + 500])):
 
-                picked_record = session_current.query(Shipments).filter(
-                                                        Shipments.shipment_id.is_(new_id))
+                shipment_keys[row[0]] = dict(zip(duplicate_keys[Shipments], row[1:]))
 
-                for p_row in picked_record:
+    customers = marking_index(session_current)['customers']
 
-                    if p_row:
+    journal_time = datetime.now().isoformat(timespec='seconds')
 
-                        print("\nA new record to be linked to a record:")
-                        print(f"Shipment's ID:{p_row.shipment_id}")
-                        print(f"Shipment's date:{p_row.shipment_date}")
-                        print(f"Shipment's awb:{p_row.shipment_awb}")
-                        print(f"Shipment's marking:{p_row.shipment_marking}")
-                        print(f"Shipment's full box:{p_row.shipment_box_full}")
+    journaled_count = 0
 
-                        upload = (input("Proceed?\n")).lower()
+    with open(decision_journal_path(), 'a', encoding='utf_8') as file:
 
-                        while upload != 'yes' and upload != 'no':
+        for record_id, link_id in decisions:
 
-                            print('The answer should be only yes or no!')
+            if record_id not in record_keys:
 
-                            upload = (input("Proceed?\n")).lower()
+                continue
 
-                    elif not p_row:
-                        print('No record for this shipment_id!')
+            marking_name, keys = record_keys[record_id]
 
-            if (new_id != 'skip' and
-                new_id != 'exit' and
-                new_id != 'next'):
+            journal_line = {'time':journal_time,
+                            'table':table_class.__tablename__,
+                            'link':link,
+                            'record':keys}
 
-                record.shipment_id = new_id
+            if link == 'customer':
 
-                new_ship_id_df = pd.DataFrame({condition_list[1]:[record_names[table][5]],
-                                                'shipment_id':[new_id]}
-                )
+                customer_name, customer_address = customers.get(link_id, (None, None))
 
-                if os.path.exists('C:/autocargo_reports/export/'):
+                journal_line.update({'customer_id':link_id,
+                                     'marking':marking_name,
+                                     'customer':customer_name,
+                                     'address':customer_address})
 
-                    directory_name = 'C:/autocargo_reports/export/'
+            elif link_id in shipment_keys:
 
-                else:
+                journal_line['shipment'] = shipment_keys[link_id]
 
-                    directory_name = 'C:/'
+            else:
 
-                    print('Couldnt find a path to save the file, saving to the disc C')
+                continue
 
-                new_ship_id_path = f'{directory_name}new_shipment_log.xlsx'
+            file.write(json.dumps(journal_line, ensure_ascii=False, default=str) + '\n')
 
-                new_ship_id_df.to_excel(new_ship_id_path)
+            journaled_count += 1
 
-            elif new_id == 'exit':
+    return journaled_count
 
-                print('Exiting the check loop...')
+def replay_decisions(session_current, journal_path=None):
 
-                quit_for_loop = True
+    """
+    This function applies the linking decisions of the journal to the records
+    still missing the customer_id or shipment_id, e.g. after the database was
+    rebuilt. Records and shipments are found by their duplicate_keys with one
+    executemany-style update per table, the latest decision of a record wins,
+    and the journaled markings are added to the table 'markings'. The records
+    of the added markings left unlinked are linked by auto_link_customers.
 
-                break
+    Returns a dictionary by table name and link of the linked records count.
 
-            elif new_id == 'next':
+    """
 
-                print(f'Skipping the {table} check loop...')
+    # The journal is found where journal_decisions writes it
+    if journal_path is None:
 
-                break
+        journal_path = decision_journal_path()
 
-        session_current.commit()
+    if not os.path.exists(journal_path):
 
-        if quit_for_loop:
+        print('Linking decisions journal was not found!')
+        print('Decisions were not replayed.')
 
-            break
+        return {}
+
+    # The latest decision of a record replaces the earlier ones
+    decisions = {}
+
+    with open(journal_path, 'r', encoding='utf_8') as file:
+
+        for line in file:
+
+            if not line.strip():
+
+                continue
+
+            journal_line = json.loads(line)
+
+            if journal_line['table'] not in review_tables:
+
+                continue
+
+            record_key = tuple(journal_line['record'].get(key) for key in
+                               duplicate_keys[review_tables[journal_line['table']]])
+
+            decisions[(journal_line['table'], journal_line['link'], record_key)] = journal_line
+
+    new_markings = {}
+
+    replay_params = {}
+
+    for (table_name, link, record_key), journal_line in decisions.items():
+
+        params = {f'b_{key}':value for key, value in journal_line['record'].items()}
+
+        if link == 'customer':
+
+            params['b_link_id'] = journal_line['customer_id']
+
+            if journal_line.get('customer') is not None:
+
+                new_markings[normalize_marking(journal_line['marking'])] = [
+                             journal_line['marking'], journal_line['customer'],
+                             journal_line['address']]
+
+        else:
+
+            params.update({f'b_shipment_{key}':value
+                           for key, value in journal_line['shipment'].items()})
+
+        replay_params.setdefault((table_name, link), []).append(params)
+
+    # Markings go first so that the customers are known for the next imports
+    if new_markings:
+
+        create_table(pd.DataFrame(new_markings.values(),
+                                  columns=['marking_name', 'marking_customer',
+                                           'marking_customer_address']),
+                     Markings, session_current, bulk=True)
+
+    replay_counts = {}
+
+    for (table_name, link), params in replay_params.items():
+
+        table_class = review_tables[table_name]
+
+        keys = duplicate_keys[table_class]
+
+        # Plain columns keep the journaled values as they are stored in SQLite
+        record_table = sql_table(table_name, *[sql_column(key) for key in keys + [f'{link}_id']])
+
+        if link == 'customer':
+
+            link_value = bindparam('b_link_id')
+
+        else:
+
+            shipment_table = sql_table(Shipments.__tablename__,
+                                       *[sql_column(key) for key in
+                                         duplicate_keys[Shipments] + ['shipment_id']])
+
+            link_value = select(shipment_table.c.shipment_id).where(and_(
+                         *[shipment_table.c[key].is_(bindparam(f'b_shipment_{key}'))
+                           for key in duplicate_keys[Shipments]])).limit(1).scalar_subquery()
+
+        result = session_current.execute(record_table.update().where(and_(
+                                         *[record_table.c[key].is_(bindparam(f'b_{key}'))
+                                           for key in keys],
+                                         record_table.c[f'{link}_id'].is_(None)))
+                                         .values({f'{link}_id':link_value}),
+                                         params)
+
+        replay_counts[f'{table_name} {link}'] = result.rowcount
+
+        if link == 'shipment':
+
+            link_shipments_back(session_current, table_class)
+
+    session_current.commit()
+
+    # Records of the replayed markings without a journaled decision
+    if new_markings:
+
+        for table_name, linked_count in auto_link_customers(session_current).items():
+
+            if linked_count:
+
+                replay_counts[f'{table_name} marking'] = linked_count
+
+    for replay_name, replay_count in replay_counts.items():
+
+        print(f'Replayed {replay_count} decisions of {replay_name}')
+
+    return replay_counts
+
+# Relations checked by reconciliation_report: name -> left table, left keys,
+# left filter (column, value), right table, right keys
+reconciliation_relations = {'sales - forever':[OperationsSales,
+                                               ['sale_awb', 'sale_full_box', 'sale_marking'],
+                                               ['supplier_id', 2],
+                                               OperationsForever,
+                                               ['expense_awb', 'expense_full_box', 'expense_marking']],
+                            'sales - iphandlers':[OperationsSales,
+                                                  ['sale_awb', 'sale_full_box', 'sale_marking'],
+                                                  ['supplier_id', 5],
+                                                  OperationsIphandlers,
+                                                  ['expense_awb', 'expense_full_box',
+                                                   'expense_marking']],
+                            'shipments - forever':[Shipments,
+                                                   ['shipment_awb', 'shipment_box_full',
+                                                    'shipment_marking'],
+                                                   None,
+                                                   OperationsForever,
+                                                   ['expense_awb', 'expense_full_box',
+                                                    'expense_marking']],
+                            'shipments - iphandlers':[Shipments,
+                                                      ['shipment_awb', 'shipment_marking'],
+                                                      None,
+                                                      OperationsIphandlers,
+                                                      ['expense_awb', 'expense_marking']]}
+
+def match_key_values(key_series):
+
+    """
+    This function returns the key values as strings of one representation:
+    numbers stored as integers, floats or text (12345678901, 12345678901.0,
+    '12345678901') give the same string, other text is stripped
+
+    """
+
+    key_numbers = pd.to_numeric(key_series, errors='coerce')
+
+    key_strings = key_series.astype(str).str.strip()
+
+    whole_numbers = (key_numbers.notna() & (key_numbers == key_numbers.round())
+                     & (key_numbers.abs() < 2 ** 53))
+
+    key_strings[whole_numbers] = key_numbers[whole_numbers].astype('int64').astype(str)
+
+    fractional_numbers = key_numbers.notna() & ~whole_numbers
+
+    key_strings[fractional_numbers] = key_numbers[fractional_numbers].astype(str)
+
+    return key_strings
+
+def match_counts(left_frame, left_keys, right_frame, right_keys):
+
+    """
+    This function returns the left dataframe with the column 'match_count',
+    the count of the right dataframe rows with the same keys, found by
+    one hash join of the left rows with the grouped right keys.
+
+    The keys of both dataframes are compared by match_key_values, an awb
+    stored as a number in one table matches the same awb stored as text
+
+    """
+
+    match_keys = [f'match_key_{key_number}' for key_number in range(len(left_keys))]
+
+    right_counts = pd.DataFrame({match_key:match_key_values(right_frame[right_key])
+                                 for match_key, right_key in zip(match_keys, right_keys)})
+
+    right_counts = right_counts.groupby(match_keys).size().reset_index(name='match_count')
+
+    matched_frame = left_frame.assign(**{match_key:match_key_values(left_frame[left_key])
+                                         for match_key, left_key in zip(match_keys, left_keys)})
+
+    matched_frame = matched_frame.merge(right_counts, how='left', on=match_keys).drop(columns=match_keys)
+
+    matched_frame['match_count'] = matched_frame['match_count'].fillna(0).astype('int64')
+
+    return matched_frame
+
+def reconciliation_report(session_current, report_path=None, detail_rows=20000):
+
+    """
+    This function loads the keys of the tables of reconciliation_relations
+    into dataframes once and matches every relation in both directions in memory,
+    reporting per source the count of matched (one record), unmatched (no records)
+    and multiply matched (several records) rows.
+
+    The summary and up to detail_rows unmatched and multiply matched rows
+    of every source are saved to the reconciliation.xlsx file, the writing
+    of the file takes longer than the matching. Returns the summary dataframe.
+
+    """
+
+    # Columns of every table needed by the relations
+    table_columns = {}
+
+    for left_table, left_keys, left_filter, right_table, right_keys in reconciliation_relations.values():
+
+        left_columns = table_columns.setdefault(left_table, [left_table.__mapper__.primary_key[0].key])
+
+        left_columns += [key for key in left_keys + ([left_filter[0]] if left_filter else [])
+                         if key not in left_columns]
+
+        right_columns = table_columns.setdefault(right_table, [right_table.__mapper__.primary_key[0].key])
+
+        right_columns += [key for key in right_keys if key not in right_columns]
+
+    # Plain columns keep the values as they are stored in SQLite
+    table_frames = {table_class:pd.read_sql(select(sql_table(table_class.__tablename__,
+                                                             *[sql_column(key) for key in columns])),
+                                            session_current.connection())
+                    for table_class, columns in table_columns.items()}
+
+    summary = []
+
+    details = {}
+
+    for relation_name, (left_table, left_keys, left_filter,
+                        right_table, right_keys) in reconciliation_relations.items():
+
+        left_frame = table_frames[left_table]
+
+        if left_filter:
+
+            left_frame = left_frame[left_frame[left_filter[0]] == left_filter[1]]
+
+        # Records without a key value can't be matched
+        left_frame = left_frame.dropna(subset=left_keys)
+
+        right_frame = table_frames[right_table].dropna(subset=right_keys)
+
+        for source_table, source_frame, source_keys, target_frame, target_keys in [
+            [left_table, left_frame, left_keys, right_frame, right_keys],
+            [right_table, right_frame, right_keys, left_frame, left_keys]]:
+
+            matched_frame = match_counts(source_frame[[source_table.__mapper__.primary_key[0].key]
+                                                     + source_keys],
+                                         source_keys,
+                                         target_frame[target_keys],
+                                         target_keys)
+
+            summary.append({'relation':relation_name,
+                            'source':source_table.__tablename__,
+                            'records':len(matched_frame.index),
+                            'matched':int((matched_frame['match_count'] == 1).sum()),
+                            'unmatched':int((matched_frame['match_count'] == 0).sum()),
+                            'multiple':int((matched_frame['match_count'] > 1).sum())})
+
+            detail_frame = matched_frame[matched_frame['match_count'] != 1].copy()
+
+            detail_frame.insert(0, 'relation', relation_name)
+
+            details[f'{len(details) + 1} {source_table.__tablename__}'[:31]] = detail_frame
+
+    summary_frame = pd.DataFrame(summary)
+
+    print(border_line)
+    print(summary_frame.to_string(index=False))
+    print(border_line)
+
+    if report_path is None:
+
+        if os.path.exists('C:/autocargo_reports/export/'):
+
+            directory_name = 'C:/autocargo_reports/export/'
+
+        else:
+
+            directory_name = 'C:/'
+
+            print('Couldnt find a path to save the file, saving to the disc C')
+
+        report_path = f'{directory_name}reconciliation.xlsx'
+
+    with pd.ExcelWriter(report_path) as writer:
+
+        summary_frame.to_excel(writer, sheet_name='summary', index=False)
+
+        for sheet_name, detail_frame in details.items():
+
+            detail_frame.head(detail_rows).to_excel(writer, sheet_name=sheet_name, index=False)
+
+    print(f'Reconciliation report was saved to {report_path}')
+
+    return summary_frame
@@ -0,0 +1,146 @@
+"""
+This module contains connection profiles of the SQLite database,
+the function creating an engine with the profile's pragmas applied
+to every connection, and the shared engines and session factories
+reused by every stage of the program in one process.
+
+"""
+
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+# SQLite pragmas set on every new connection, by profile name
+connection_profiles = {'bulk-ingest':{'journal_mode':'WAL',
+                                      'synchronous':'NORMAL',
+                                      'cache_size':-200000,
+                                      'mmap_size':268435456,
+                                      'temp_store':'MEMORY',
+                                      'busy_timeout':30000},
+                       'interactive':{'journal_mode':'WAL',
+                                      'synchronous':'NORMAL',
+                                      'cache_size':-20000,
+                                      'mmap_size':67108864,
+                                      'temp_store':'MEMORY',
+                                      'busy_timeout':5000}}
+
+# Functions called with every new DBAPI connection after the pragmas are set
+connection_hooks = []
+
+# Engines and session factories by database path and profile
+database_engines = {}
+session_factories = {}
+
+def create_database_engine(database_path, profile='interactive'):
+
+    """
+    This function creates an engine for the SQLite database with
+    the pragmas of the connection profile set through a connect event.
+
+    - 'bulk-ingest' profile uses WAL journal with NORMAL synchronous mode,
+    a large page cache and memory map for the nightly imports;
+
+    - 'interactive' profile uses the same journal with a smaller cache
+    for the linking sessions of operators;
+
+    """
+
+    if profile not in connection_profiles:
+
+        print(f'Connection profile {profile} was not found, interactive profile is used')
+
+        profile = 'interactive'
+
+    engine = create_engine(f"sqlite:///{database_path}", echo = False)
+
+    pragmas = connection_profiles[profile]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+
+        cursor = dbapi_connection.cursor()
+
+        for pragma, value in pragmas.items():
+
+            cursor.execute(f'PRAGMA {pragma}={value}')
+
+        cursor.close()
+
+        for connection_hook in connection_hooks:
+
+            connection_hook(dbapi_connection)
+
+    return engine
+
+def get_engine(database_path, profile='interactive'):
+
+    """
+    This function returns the engine of the database and profile,
+    the engine is created once and its connection pool is shared
+    by all the callers.
+
+    """
+
+    engine_key = (os.path.abspath(database_path), profile)
+
+    if engine_key not in database_engines:
+
+        database_engines[engine_key] = create_database_engine(database_path, profile)
+
+    return database_engines[engine_key]
+
+def get_session_factory(database_path, profile='interactive', scoped=False):
+
+    """
+    This function returns the session factory bound to the shared engine.
+
+    With scoped set to True the factory is a scoped_session giving every
+    worker thread its own session, scoped_session.remove() closes the
+    session of the current thread.
+
+    """
+
+    factory_key = (os.path.abspath(database_path), profile, scoped)
+
+    if factory_key not in session_factories:
+
+        session = sessionmaker(bind=get_engine(database_path, profile))
+
+        if scoped:
+
+            session = scoped_session(session)
+
+        session_factories[factory_key] = session
+
+    return session_factories[factory_key]
+
+def dispose_engines(database_path=None):
+
+    """
+    This function closes the pooled connections of the shared engines
+    and forgets the engines and session factories, of all the databases
+    or only of the database at database_path.
+
+    """
+
+    database_key = None if database_path is None else os.path.abspath(database_path)
+
+    for factory_key in list(session_factories):
+
+        if database_key is not None and factory_key[0] != database_key:
+
+            continue
+
+        session = session_factories.pop(factory_key)
+
+        if isinstance(session, scoped_session):
+
+            session.remove()
+
+    for engine_key in list(database_engines):
+
+        if database_key is not None and engine_key[0] != database_key:
+
+            continue
+
+        database_engines.pop(engine_key).dispose()
@@ -33,12 +33,11 @@ app.window(title = 'AutoCargo - ООО "Флауэрс Лайф" - ЕВГЕНИ
 import os
 from datetime import datetime
 import calendar
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
 import autocargo_functions
 import report_prep
 import database_classes
+import database_engine
 import web_scrap_functions
 
 def main_loop (time_list, operation_codes, balance_day, truck_day):
@@ -80,10 +79,32 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
     - 7.1 OPERATION CODE. Creates sale files based on the iphandlers files from operation code 7.
     Imports newly created sale files into the database;
 
+    - 8 OPERATION CODE. Asks an operator to link the records left unlinked by
+    the automatic linking of the imports to customers and shipments, several
+    operators can run it at the same time on different records;
+
+    - 9 OPERATION CODE. Applies the operator's decisions from the review queue file
+    exported after the imports (C:/autocargo_reports/export/review_queue.xlsx);
+
+    - 10 OPERATION CODE. Replays the journal of the linking decisions
+    (C:/autocargo_reports/export/link_decisions.jsonl) on the records left unlinked,
+    e.g. after the database was rebuilt and the reports were imported again;
+
+    - 11 OPERATION CODE. Reconciles sales, expenses and shipments by their keys and
+    saves the matched, unmatched and multiply matched counts to the reconciliation file;
+
+    - 12 OPERATION CODE. Removes the duplicate shipments of an older database and
+    creates the indexes declared on the tables, the truck imports of operation code 6
+    then update the known shipments with one upsert;
+
+    Records imported by operation codes 5 - 7.1 are linked to customers and shipments
+    in one phase after all the imports, the records left unlinked are written to
+    the review queue and exported to the review queue file at the end of the run.
+
     """
 
     # Conditions to check if argument format is correct
-    correct_codes = [1, 2, 3, 4, 5, 5.1, 6, 7, 7.1]
+    correct_codes = [1, 2, 3, 4, 5, 5.1, 6, 7, 7.1, 8, 9, 10, 11, 12]
 
     if (not isinstance(time_list[0], int) or
         not isinstance(time_list[1], int)):
@@ -224,13 +245,14 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
 
         database_classes.database_create(database_path)
 
-    # Create database session
-    engine = create_engine(f"sqlite:///{database_path}", echo = False)
-
-    session = sessionmaker(bind=engine)
+    # Create database session on the engine shared with database_create
+    session = database_engine.get_session_factory(database_path, 'bulk-ingest')
 
     session_current = session()
 
+    # Records imported by this run get primary keys greater than the watermarks
+    link_watermarks = database_classes.table_watermarks(session_current)
+
     # Iterate based on the operations_list codes
     for code in operations_list:
 
@@ -280,9 +302,11 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
 
                 balance_dates = autocargo_functions.balance_date_calc(balance_date)
 
+                # Balance files are cleaned by a pool of processes
                 balance_df_list = report_prep.prepare_balance(balance_dates[0],
                                                               balance_dates[1],
-                                                              balance_dates[2])
+                                                              balance_dates[2],
+                                                              parallel=True)
 
                 if balance_df_list:
 
@@ -292,10 +316,8 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
 
                         database_classes.create_table(b_df,
                                                         database_classes.OperationsForever,
-                                                        session_current)
-
-                        database_classes.empty_customer_id(session_current)
-                        database_classes.empty_shipment_id(session_current)
+                                                        session_current,
+                                                        bulk=True)
 
                 else:
 
@@ -323,10 +345,8 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
 
                                     database_classes.create_table(s_df,
                                                                   database_classes.OperationsSales,
-                                                                  session_current)
-
-                                    database_classes.empty_customer_id(session_current)
-                                    database_classes.empty_shipment_id(session_current)
+                                                                  session_current,
+                                                                  bulk=True)
 
                             else:
 
@@ -359,9 +379,8 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
 
                         database_classes.create_table(t_df,
                                                         database_classes.Shipments,
-                                                        session_current)
-
-                        database_classes.empty_customer_id(session_current)
+                                                        session_current,
+                                                        upsert=True)
 
                 else:
 
@@ -380,10 +399,8 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
 
                     database_classes.create_table(ip_df,
                                                     database_classes.OperationsIphandlers,
-                                                    session_current)
-
-                    database_classes.empty_customer_id(session_current)
-                    database_classes.empty_shipment_id(session_current)
+                                                    session_current,
+                                                    bulk=True)
 
             else:
 
@@ -405,10 +422,8 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
 
                                 database_classes.create_table(s_i_df,
                                                               database_classes.OperationsSales,
-                                                              session_current)
-
-                                database_classes.empty_customer_id(session_current)
-                                database_classes.empty_shipment_id(session_current)
+                                                              session_current,
+                                                              bulk=True)
 
                         else:
 
@@ -420,8 +435,74 @@ def main_loop (time_list, operation_codes, balance_day, truck_day):
                     print("Ip file is empty!")
                     print("Operations Iphandlers tables weren't created")
 
-# Example of using the main function
-main_loop([14, 40],
-          [1, 2, 3, 4, 6, 5, 5.2, 7, 7.1],
-          [-2, -1],
-          [-2, -1])
+        # Link the records left by the automatic linking with an operator
+        elif operation_code == 8:
+
+            print('Linking the records left unlinked')
+
+            # Records are claimed by the operator, others can link at the same time
+            operator_name = f"{os.environ.get('USERNAME', 'operator')}-{os.getpid()}"
+
+            # The operator's session uses the interactive connection profile
+            session_operator = database_engine.get_session_factory(database_path,
+                                                                   'interactive')()
+
+            database_classes.empty_customer_id(session_operator, operator_name)
+            database_classes.empty_shipment_id(session_operator, operator_name)
+
+            session_operator.close()
+
+        # Apply the operator's decisions from the review queue file
+        elif operation_code == 9:
+
+            print('Applying review decisions')
+
+            database_classes.apply_review_decisions(session_current)
+
+        # Apply the journaled linking decisions again
+        elif operation_code == 10:
+
+            print('Replaying linking decisions')
+
+            database_classes.replay_decisions(session_current)
+
+        # Report the records of the sources that don't match each other
+        elif operation_code == 11:
+
+            print('Reconciling sales, expenses and shipments')
+
+            database_classes.reconciliation_report(session_current)
+
+        # Remove duplicate shipments and create the indexes of an older database
+        elif operation_code == 12:
+
+            print('Removing duplicate shipments')
+
+            database_classes.remove_duplicate_shipments(session_current)
+
+            session_current.close()
+
+            database_classes.database_indexes(database_path)
+
+    # Link the imported records once all the imports are finished
+    # and queue the records left unlinked for an operator
+    if any(code in operations_list for code in [5, 5.1, 6, 7, 7.1]):
+
+        print('Linking imported records')
+
+        database_classes.link_new_records(session_current, link_watermarks)
+
+        print('Queueing unlinked records for review')
+
+        database_classes.queue_reviews(session_current)
+
+        database_classes.export_review_queue(session_current)
+
+# Example of using the main function, the guard keeps the worker
+# processes of the balance cleaning from running the main loop again
+if __name__ == '__main__':
+
+    main_loop([14, 40],
+              [1, 2, 3, 4, 6, 5, 5.2, 7, 7.1],
+              [-2, -1],
+              [-2, -1])
@@ -0,0 +1,118 @@
+"""
+This module contains the normalization of marking names and the fuzzy
+matcher of markings based on an in-memory trigram index.
+
+Markings from AutoCargo, IP Handlers and pdf files differ from the names
+in the table 'markings' by spacing, case, suffixes and Cyrillic letters
+looking like Latin ones, so the matcher compares trigrams of the folded names.
+
+"""
+
+import re
+
+# Cyrillic letters looking like Latin ones
+homoglyphs = str.maketrans({'а':'a', 'в':'b', 'е':'e', 'ё':'e', 'к':'k', 'м':'m',
+                            'н':'h', 'о':'o', 'р':'p', 'с':'c', 'т':'t', 'у':'y',
+                            'х':'x', 'і':'i', 'ј':'j', 'ѕ':'s'})
+
+def normalize_marking(marking_name):
+
+    """
+    This function returns the marking name in lower case with Cyrillic
+    homoglyphs folded to Latin letters, punctuation replaced by spaces,
+    and spaces stripped and collapsed
+
+    """
+
+    if marking_name is None:
+
+        return ''
+
+    marking_name = str(marking_name).lower().translate(homoglyphs)
+
+    return ' '.join(re.sub(r'[^\w]+', ' ', marking_name).split())
+
+def marking_trigrams(marking_name):
+
+    """
+    This function returns the set of trigrams of the normalized marking name,
+    the name is padded so that short names and name starts get trigrams too
+
+    """
+
+    padded_name = f'  {marking_name} '
+
+    return {padded_name[i:i + 3] for i in range(len(padded_name) - 2)}
+
+class MarkingMatcher:
+
+    """
+    This class keeps a trigram index of the normalized marking names
+    and returns the names most similar to a marking with the scores
+    """
+
+    def __init__(self, marking_names):
+
+        # Normalized names and their trigrams by position
+        self.names = []
+        self.trigrams = []
+
+        # Positions of the names by trigram
+        self.postings = {}
+
+        for marking_name in marking_names:
+
+            self.add(marking_name)
+
+    def add(self, marking_name):
+
+        """
+        This function adds a marking name to the index
+        """
+
+        marking_name = normalize_marking(marking_name)
+
+        name_trigrams = marking_trigrams(marking_name)
+
+        position = len(self.names)
+
+        self.names.append(marking_name)
+        self.trigrams.append(name_trigrams)
+
+        for trigram in name_trigrams:
+
+            self.postings.setdefault(trigram, []).append(position)
+
+    def top(self, marking_name, count=5, min_score=0.3):
+
+        """
+        This function returns up to count pairs of a normalized marking name
+        and its Dice similarity score (from 0 to 1) to the marking,
+        best scores first, scores lower than min_score are dropped,
+        with count set to None all the pairs are returned
+
+        """
+
+        name_trigrams = marking_trigrams(normalize_marking(marking_name))
+
+        shared_counts = {}
+
+        for trigram in name_trigrams:
+
+            for position in self.postings.get(trigram, []):
+
+                shared_counts[position] = shared_counts.get(position, 0) + 1
+
+        scores = []
+
+        for position, shared_count in shared_counts.items():
+
+            score = 2 * shared_count / (len(name_trigrams) + len(self.trigrams[position]))
+
+            if score >= min_score:
+
+                scores.append((self.names[position], round(score, 3)))
+
+        scores.sort(key=lambda name_score: (-name_score[1], name_score[0]))
+
+        return scores[:count]
@@ -6,508 +6,643 @@ from AutoCargo program, create sale file based on the expenses from balance file
 
 import os
 import math
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import pandas as pd
 
-from openpyxl.styles.colors import WHITE, RGB
-__old_rgb_set__ = RGB.__set__
+from report_reader import read_report
 
-# Fix the ARGB hex values error by making it white
-def __rgb_set_fixed__(self, instance, value):
+def amount_column(column):
 
-    try:
+    """
+    This function returns the column as float64 amounts,
+    empty and not numeric cells are turned to 0
 
-        __old_rgb_set__(self, instance, value)
+    """
 
-    except ValueError as e:
+    return pd.to_numeric(column, errors='coerce').fillna(0).astype('float64')
 
-        if e.args[0] == 'Colors must be aRGB hex values':
-            __old_rgb_set__(self, instance, WHITE)
-
-# Clean balance reports
-def prepare_balance(balance_day, balance_month_full, balance_year):
+def normalize_balance_amounts(balance_file, balance_currency):
 
     """
-    This function prepares balance and truck reports
-    for the future import to the database
+    This function fills the rub, usd and eur amount columns of a balance report
+    for the balance currency ('usd' or 'rub') and the currency of every row,
+    and turns the expenses to positive numbers, column by column.
+
+    In the raw report the row currency is in the column expense_total_rub,
+    the currency rate is in the column expense_currency and the amount in
+    the row currency is in the column expense_currency_rate, the values are
+    moved to their columns here. Amount columns are returned as float64.
 
     """
-    # List of df to be returned
-    balance_df_list = []
 
-    # Settings for cleaning balance reports
-    balance_cols = 'A:C, E, G, J, K, M, N, R, U:W'
+    currency = balance_file['expense_total_rub']
+    currency_rate = balance_file['expense_currency']
 
-    balance_skip_rows = [0, 1, 2, 3, 4]
+    row_currency = currency.astype(str).str.lower()
 
-    balance_rename_cols = ['expense_date', 'expense_content_supplier', 'expense_type',
-                           'expense_awb', 'expense_currency_rate', 'expense_total_rub',
-                           'expense_currency','expense_total_usd', 'expense_total_eur',
-                           'expense_marking','expense_full_box', 'expense_weight',
-                           'expense_volume']
+    is_usd = row_currency.str.contains('usd', regex=False)
+    is_eur = row_currency.str.contains('eur', regex=False)
+    is_rub = row_currency.str.contains('rub', regex=False)
 
-    # Fix the ARGB hex values error by making it white
-    RGB.__set__ = __rgb_set_fixed__
+    row_amount = amount_column(balance_file['expense_currency_rate'])
+    balance_amount = amount_column(balance_file['expense_total_usd'])
+    eur_amount = amount_column(balance_file['expense_total_eur'])
 
-    # List of usd balances
-    usd_balance_codes = [3, 5, 8, 11]
+    if balance_currency == 'usd':
 
-    # List of rub balances
-    rub_balance_codes = [1, 2, 4, 6, 7, 9, 10, 12]
+        # Usd amount is the balance amount, the row amount goes to rub or eur
+        total_usd = balance_amount
+        total_rub = row_amount.where(is_rub & ~is_eur & ~is_usd, 0.0)
+        total_eur = eur_amount.where(~(is_rub | is_usd), 0.0).mask(is_eur & ~is_usd, row_amount)
 
-    # Total count of the balances available to check in the Autocargo
-    balance_count = 12
+    else:
 
-    # Dictionary translating balance code to the balance name
-    balance_codes_translation = {1:'', 2:'', 3:'',
-                                 4:'', 5:'', 6:'',
-                                 7:'', 8:'', 9:'',
-                                 10:'', 11:'', 12:'',
-                                 13:'', 14:'', 15:'', 16:'',
-                                 17:''}
+        # Rub amount is the balance amount, the row amount goes to usd or eur
+        total_rub = balance_amount
+        total_usd = balance_amount.mask(is_usd, row_amount).mask(~is_usd & (is_eur | is_rub), 0.0)
+        total_eur = eur_amount.mask(is_usd | is_rub, 0.0).mask(~is_usd & is_eur, row_amount)
 
-    # Detect row with precool
-    docs_dict = {}
+    # Only the first negative amount of the row (rub, usd, eur) is turned positive
+    rub_negative = total_rub < 0
+    usd_negative = ~rub_negative & (total_usd < 0)
+    eur_negative = ~rub_negative & ~usd_negative & (total_eur < 0)
 
-    # Detect Ams rows with the same marking and date
-    ams_dict = {}
+    balance_file['expense_total_rub'] = total_rub.mask(rub_negative, -total_rub)
+    balance_file['expense_total_usd'] = total_usd.mask(usd_negative, -total_usd)
+    balance_file['expense_total_eur'] = total_eur.mask(eur_negative, -total_eur)
 
-    # Detect consolidation rows with the same marking and awb
-    consolidation_dict = {}
+    balance_file['expense_currency'] = currency
+    balance_file['expense_currency_rate'] = currency_rate
+    balance_file['expense_balance_currency'] = balance_currency
 
-    # Rows to delete after uniting Ams shipments
-    extra_ams_rows = []
+    return balance_file
 
-    # Rows to delete after uniting non Ams shipments
-    extra_rows = []
+def box_type_rows(balance_file, rows, rule_context):
 
-    # Rows to delete
-    extra_precool_rows = []
+    """
+    This function adds the box size counted from the volume
+    and the amount of boxes to the type of the box rows without name
 
-    # Clean the balance reports, import them to the database and create a sale info
-    for balance in range(balance_count):
+    """
 
-        balance_code = balance + 1
+    box_sizes = 1/(balance_file.loc[rows, 'expense_volume'].astype(float)/
+                   balance_file.loc[rows, 'expense_full_box'].astype(float))
 
-        # Assign file name, path and new path
-        balance_name = f'balance_{balance_code}_{balance_day}_{balance_month_full}_{balance_year}'
-        balance_path = f'C:/autocargo_reports/{balance_name}.xlsx'
+    balance_file.loc[rows, 'expense_type'] = [f'{expense_type[:expense_type.find("]")]}{int(math.ceil(box_size))}]'
+                                              for expense_type, box_size
+                                              in zip(balance_file.loc[rows, 'expense_type'], box_sizes)]
 
-        print(f'Start {balance_name}')
+def cut_marking_rows(balance_file, rows, rule_context):
 
-        if os.path.exists(balance_path):
+    """
+    This function keeps the shipment marking before '{' in the marking rows
+    """
 
-            # Read the xls file into pandas DataFrame
-            balance_file = pd.read_excel(balance_path, usecols=balance_cols,
-                                         skiprows=balance_skip_rows, engine='openpyxl')
+    balance_file.loc[rows, 'expense_marking'] = (
+        balance_file.loc[rows, 'expense_marking'].str.split('{').str[0].str.strip()
+    )
 
-            # Rename columns
-            for name in balance_rename_cols:
+def precool_rows(balance_file, rows, rule_context):
 
-                balance_file.columns.values[balance_rename_cols.index(name)] = (
-                    balance_rename_cols[balance_rename_cols.index(name)]
-                )
+    """
+    This function moves the awb number of the pre-cool rows with all the amounts
+    to the column expense_awb, pre-cool rows without amounts are deleted later
 
-            # Delete various rows
-            balance_file = balance_file.drop(balance_file[balance_file['expense_date'] == 'ДАТА'].index)
-            balance_file = balance_file.drop(balance_file[balance_file['expense_type'] == ' >>>'].index)
+    """
 
-            for ind in balance_file.index:
+    amounts = balance_file.loc[rows, ['expense_total_rub', 'expense_total_usd', 'expense_total_eur']]
 
-                if 'Страница' in str(balance_file['expense_date'][ind]):
+    full_rows = rows[(amounts != 0).all(axis=1).to_numpy()]
+    empty_rows = rows[(amounts == 0).all(axis=1).to_numpy()]
 
-                    balance_file = balance_file.drop([ind])
+    balance_file.loc[full_rows, 'expense_awb'] = balance_file.loc[full_rows, 'expense_type'].str.strip()
+    balance_file.loc[full_rows, 'expense_type'] = 'прикулинг'
 
-            balance_file.dropna(subset = ['expense_date'], inplace = True)
+    rule_context['drop_rows'].extend(empty_rows)
 
-            # Add columns
-            balance_file.insert(loc=13, column='expense_balance_code', value = '')
-            balance_file.insert(loc=14, column='expense_balance_currency', value = '')
-            balance_file.insert(loc=15, column='supplier_id', value = '')
+def transfer_rows(balance_file, rows, rule_context):
 
-            # Normalize and sort the data
-            for ind in balance_file.index:
+    """
+    This function marks who sends and who receives the transfer
+    """
 
-                currency = balance_file['expense_total_rub'][ind]
-                currency_rate = balance_file['expense_currency'][ind]
+    transfer_markings = []
 
-                # Fill currency information based on the balance type
-                if balance_code in usd_balance_codes:
+    for marking in balance_file.loc[rows, 'expense_marking']:
 
-                    balance_file['expense_balance_currency'][ind] = 'usd'
+        marking = marking[1:(len(marking))-2]
+        transfer_separator = marking.find('->')
 
-                    if 'rub' in currency.lower():
+        # Identify who sends/receives the transfer
+        if rule_context['balance_name'] in marking[:transfer_separator].lower():
 
-                        balance_file['expense_total_rub'][ind] = balance_file['expense_currency_rate'][ind]
-                        balance_file['expense_total_eur'][ind] = 0
+            marking += ' = отправитель'
 
-                    if 'eur' in currency.lower():
+        elif rule_context['balance_name'] in marking[transfer_separator:].lower():
 
-                        if balance_file['expense_currency_rate'][ind] != ' ':
+            marking += ' = получатель'
 
-                            balance_file['expense_total_eur'][ind] = balance_file['expense_currency_rate'][ind]
+        transfer_markings.append(marking)
 
-                        else:
-                            balance_file['expense_total_eur'][ind] = 0
+    balance_file.loc[rows, 'expense_marking'] = transfer_markings
 
-                        balance_file['expense_total_rub'][ind] = 0
+def docs_rows(balance_file, rows, rule_context):
 
-                    if 'usd' in str(currency).lower():
+    """
+    This function clears the boxes, weight and volume of the documents fee rows,
+    separates the content supplier from the marking and keeps the fees
+    in rule_context['docs_dict'] to add them to the Ams shipments
 
-                        balance_file['expense_total_rub'][ind] = 0
-                        balance_file['expense_total_eur'][ind] = 0
+    """
 
-                elif balance_code in rub_balance_codes:
+    balance_file.loc[rows, ['expense_full_box', 'expense_weight', 'expense_volume']] = 0
+
+    # Extract shipments markings and content supplier
+    marking = balance_file.loc[rows, 'expense_marking']
+
+    company_rows = marking.str.contains('_', regex=False)
+
+    marking_parts = marking[company_rows].str.split('_', n=1)
+
+    balance_file.loc[marking_parts.index, 'expense_content_supplier'] = marking_parts.str[0].str.strip()
+    balance_file.loc[marking_parts.index, 'expense_marking'] = marking_parts.str[1].str.replace('_', '').str.strip()
+
+    docs = balance_file.loc[rows, ['expense_marking', 'expense_date', 'expense_total_usd',
+                                   'expense_total_eur', 'expense_total_rub']]
+
+    for ind, doc_marking, doc_date, docs_total_usd, docs_total_eur, docs_total_rub in docs.itertuples():
+
+        rule_context['docs_dict'][f'{doc_marking}{doc_date}'] = [ind,
+                                                                 float(docs_total_usd),
+                                                                 float(docs_total_eur),
+                                                                 float(docs_total_rub)]
+
+# Classification rules of the balance rows, checked in the order of the list:
+# - the row matches the rule when all the keywords are in the lowercased column;
+# - expense_type is the new type of the matched rows, type_from is the column
+#   the new type is copied from, action is the function changing the other columns;
+# - a row is classified by the first exclusive rule it matches,
+#   not exclusive rules are applied to every matched row
+balance_type_rules = [{'rule':'box type', 'column':'expense_type', 'keywords':['тара'],
+                       'expense_type':None, 'type_from':None, 'action':box_type_rows, 'exclusive':False},
+                      {'rule':'marking', 'column':'expense_marking', 'keywords':['{'],
+                       'expense_type':None, 'type_from':None, 'action':cut_marking_rows, 'exclusive':True},
+                      {'rule':'telegram sending', 'column':'expense_marking', 'keywords':['отправка', 'телег'],
+                       'expense_type':None, 'type_from':'expense_marking', 'action':None, 'exclusive':True},
+                      {'rule':'fine', 'column':'expense_marking', 'keywords':['штраф'],
+                       'expense_type':None, 'type_from':'expense_marking', 'action':None, 'exclusive':True},
+                      {'rule':'pre-cool', 'column':'expense_marking', 'keywords':['прикулинг'],
+                       'expense_type':None, 'type_from':None, 'action':precool_rows, 'exclusive':True},
+                      {'rule':'transfer', 'column':'expense_marking', 'keywords':['трансфер'],
+                       'expense_type':'трансфер', 'type_from':None, 'action':transfer_rows, 'exclusive':True},
+                      {'rule':'documents', 'column':'expense_type', 'keywords':['док'],
+                       'expense_type':'оформление документов', 'type_from':None, 'action':docs_rows, 'exclusive':True},
+                      {'rule':'fee', 'column':'expense_marking', 'keywords':['комиссия'],
+                       'expense_type':'комиссия', 'type_from':None, 'action':None, 'exclusive':True},
+                      {'rule':'payment', 'column':'expense_awb', 'keywords':['оплата'],
+                       'expense_type':None, 'type_from':'expense_awb', 'action':None, 'exclusive':True}]
+
+def classify_balance_rows(balance_file, rule_context, type_rules=balance_type_rules):
 
-                    balance_file['expense_balance_currency'][ind] = 'rub'
-                    balance_file['expense_total_rub'][ind] = balance_file['expense_total_usd'][ind]
+    """
+    This function applies the classification rules to the whole columns
+    of the balance report, the rows of every rule are found by one mask.
 
-                    if 'usd' in str(currency).lower():
+    rule_context is passed to the actions of the rules: the balance name
+    ('balance_name'), the documents fees ('docs_dict') and the list of
+    the rows to delete ('drop_rows').
 
-                        balance_file['expense_total_usd'][ind] = balance_file['expense_currency_rate'][ind]
-                        balance_file['expense_total_eur'][ind] = 0
+    Returns the dictionary of the rules names and the amount of their rows.
 
-                    elif 'eur' in str(currency).lower():
+    """
 
-                        if balance_file['expense_currency_rate'][ind] != ' ':
+    rule_hits = {}
 
-                            balance_file['expense_total_eur'][ind] = balance_file['expense_currency_rate'][ind]
+    # Rows already classified by an exclusive rule
+    classified_rows = pd.Series(False, index=balance_file.index)
 
-                        else:
-                            balance_file['expense_total_eur'][ind] = 0
+    # Lowercased columns and keyword masks, an exclusive rule changes only
+    # the classified rows, so they are valid until a not exclusive rule
+    lowered_columns = {}
+    keyword_masks = {}
 
-                        balance_file['expense_total_usd'][ind] = 0
+    for type_rule in type_rules:
 
-                    elif 'rub' in str(currency).lower():
+        if not type_rule['exclusive']:
 
-                        balance_file['expense_total_eur'][ind] = 0
-                        balance_file['expense_total_usd'][ind] = 0
+            lowered_columns.clear()
+            keyword_masks.clear()
 
-                balance_file['expense_currency'][ind] = currency
-                balance_file['expense_currency_rate'][ind] = currency_rate
+        column_name = type_rule['column']
 
-                # Fill empty values
-                empty_fill = {'expense_currency_rate':0,
-                              'expense_volume':0,
-                              'expense_weight':0,
-                              'expense_full_box':0,
-                              'expense_content_supplier':'none',
-                              'expense_awb':'none',
-                              'expense_total_usd':0,
-                              'expense_total_eur':0,
-                              'expense_total_rub':0
-                              }
+        if column_name not in lowered_columns:
 
-                for column, value in empty_fill.items():
+            lowered_columns[column_name] = balance_file[column_name].str.lower()
 
-                    if (pd.isnull(balance_file.at[ind, column]) or
-                        balance_file.at[ind, column] == ' ' or
-                        balance_file.at[ind, column] == '' or
-                        str(balance_file.at[ind, column]).lower() == 'nan'):
+        rule_mask = pd.Series(True, index=balance_file.index)
 
-                        balance_file.at[ind, column] = value
+        for keyword in type_rule['keywords']:
 
-                # Find and separate awb number and company name of shipment
-                if (balance_file['expense_content_supplier'][ind][1:4].isnumeric() and
-                    balance_file['expense_content_supplier'][ind][5:13].isnumeric()):
+            if (column_name, keyword) not in keyword_masks:
 
-                    awb = balance_file['expense_content_supplier'][ind][:13].strip()
-                    company = balance_file['expense_content_supplier'][ind][13:].strip()
+                keyword_masks[(column_name, keyword)] = (
+                    lowered_columns[column_name].str.contains(keyword, regex=False)
+                )
 
-                    balance_file['expense_content_supplier'][ind] = company
-                    balance_file['expense_awb'][ind] = awb
+            rule_mask &= keyword_masks[(column_name, keyword)]
 
-                # Identify the box type without name
-                if 'тара' in balance_file['expense_type'][ind].lower():
+        if type_rule['exclusive']:
 
-                    box_size = 1/(float(balance_file['expense_volume'][ind])/float(balance_file['expense_full_box'][ind]))
-                    box_size = int(math.ceil(box_size))
-                    box_type_ind = balance_file["expense_type"][ind].find(']')
-                    balance_file["expense_type"][ind] = balance_file["expense_type"][ind][:box_type_ind]
-                    balance_file["expense_type"][ind] += f'{str(box_size)}]'
+            rule_mask &= ~classified_rows
+            classified_rows |= rule_mask
 
-                # Extract shipments markings
-                if '{' in balance_file['expense_marking'][ind]:
+        rows = balance_file.index[rule_mask.to_numpy()]
 
-                    marking = ''
+        rule_hits[type_rule['rule']] = len(rows)
 
-                    for letter in balance_file['expense_marking'][ind]:
+        if not type_rule['exclusive'] and not rows.empty:
 
-                        if letter != '{':
+            lowered_columns.clear()
+            keyword_masks.clear()
 
-                            marking += letter
+        if rows.empty:
 
-                        elif letter == '{':
+            continue
 
-                            break
+        if type_rule['action'] is not None:
 
-                    balance_file['expense_marking'][ind] = marking.strip()
+            type_rule['action'](balance_file, rows, rule_context)
 
-                elif ('отправка' in balance_file['expense_marking'][ind].lower() and
-                      'телег' in balance_file['expense_marking'][ind].lower()):
+        if type_rule['type_from'] is not None:
 
-                    balance_file['expense_type'][ind] = balance_file['expense_marking'][ind]
+            balance_file.loc[rows, 'expense_type'] = balance_file.loc[rows, type_rule['type_from']]
 
-                elif 'штраф' in balance_file['expense_marking'][ind].lower():
+        elif type_rule['expense_type'] is not None:
 
-                    balance_file['expense_type'][ind] = balance_file['expense_marking'][ind]
+            balance_file.loc[rows, 'expense_type'] = type_rule['expense_type']
 
-                # Find weight and identify the type for pre-cool rows
-                elif 'прикулинг' in balance_file['expense_marking'][ind].lower():
+    return rule_hits
 
-                    if (balance_file['expense_total_rub'][ind] != 0 and
-                        balance_file['expense_total_usd'][ind] != 0 and
-                        balance_file['expense_total_eur'][ind] != 0):
+# Clean one balance report
+def prepare_balance_file(balance_code, balance_day, balance_month_full, balance_year):
 
-                        balance_file['expense_awb'][ind] = balance_file['expense_type'][ind].strip()
-                        balance_file['expense_type'][ind] = 'прикулинг'
+    """
+    This function cleans the balance report of the balance code
+    and saves the cleaned report to the export folder.
 
-                    elif (balance_file['expense_total_rub'][ind] == 0 and
-                          balance_file['expense_total_usd'][ind] == 0 and
-                          balance_file['expense_total_eur'][ind] == 0):
+    Returns the cleaned DataFrame and the amount of rows of every
+    classification rule, or None and an empty dictionary when the
+    report wasn't found.
 
-                        extra_precool_rows.append(ind)
+    """
 
-                # Find who sent and who received transfer
-                elif 'трансфер' in balance_file['expense_marking'][ind].lower():
+    # Settings for cleaning balance reports
+    balance_cols = 'A:C, E, G, J, K, M, N, R, U:W'
 
-                    balance_file['expense_type'][ind] = 'трансфер'
-                    balance_file['expense_marking'][ind] = balance_file['expense_marking'][ind][1:(len(balance_file['expense_marking'][ind]))-2]
-                    transfer_separator = balance_file['expense_marking'][ind].find('->')
+    balance_skip_rows = [0, 1, 2, 3, 4]
 
-                    # Identify who sends/receives the transfer
-                    if balance_codes_translation[balance_code] in balance_file['expense_marking'][ind][:transfer_separator].lower():
+    balance_rename_cols = ['expense_date', 'expense_content_supplier', 'expense_type',
+                           'expense_awb', 'expense_currency_rate', 'expense_total_rub',
+                           'expense_currency','expense_total_usd', 'expense_total_eur',
+                           'expense_marking','expense_full_box', 'expense_weight',
+                           'expense_volume']
 
-                        balance_file['expense_marking'][ind] += ' = отправитель'
+    # Amount columns normalized by normalize_balance_amounts
+    balance_amount_cols = ['expense_total_rub', 'expense_total_usd', 'expense_total_eur']
 
-                    elif balance_codes_translation[balance_code] in balance_file['expense_marking'][ind][transfer_separator:].lower():
+    # Text columns searched by the classification rules
+    balance_text_cols = ['expense_type', 'expense_marking', 'expense_awb', 'expense_content_supplier']
 
-                        balance_file['expense_marking'][ind] += ' = получатель'
+    # List of usd balances
+    usd_balance_codes = [3, 5, 8, 11]
 
-                # Rename documents fee row
-                elif 'док' in balance_file['expense_type'][ind].lower():
+    # List of rub balances
+    rub_balance_codes = [1, 2, 4, 6, 7, 9, 10, 12]
 
-                    balance_file['expense_type'][ind] = 'оформление документов'
-                    balance_file['expense_full_box'][ind] = 0
-                    balance_file['expense_weight'][ind] = 0
-                    balance_file['expense_volume'][ind] = 0
+    # Dictionary translating balance code to the balance name
+    balance_codes_translation = {1:'', 2:'', 3:'',
+                                 4:'', 5:'', 6:'',
+                                 7:'', 8:'', 9:'',
+                                 10:'', 11:'', 12:'',
+                                 13:'', 14:'', 15:'', 16:'',
+                                 17:''}
 
-                    # Extract shipments markings and content supplier
-                    if '_' in balance_file['expense_marking'][ind]:
+    # Detect row with precool
+    docs_dict = {}
 
-                        copy_m = 0
-                        marking = ''
+    # Detect Ams rows with the same marking and date
+    ams_dict = {}
 
-                        for letter in str(balance_file['expense_marking'][ind]):
+    # Detect consolidation rows with the same marking and awb
+    consolidation_dict = {}
 
-                            if letter == '_':
+    # Rows to delete after uniting Ams shipments
+    extra_ams_rows = []
 
-                                copy_m = 1
+    # Rows to delete after uniting non Ams shipments
+    extra_rows = []
 
-                            elif letter != '_' and copy_m == 1:
+    # Rows to delete
+    extra_precool_rows = []
 
-                                marking += letter
+    # Assign file name, path and new path
+    balance_name = f'balance_{balance_code}_{balance_day}_{balance_month_full}_{balance_year}'
+    balance_path = f'C:/autocargo_reports/{balance_name}.xlsx'
 
-                        company_ind = balance_file['expense_marking'][ind].index('_')
-                        company = balance_file['expense_marking'][ind][:company_ind]
-                        balance_file['expense_content_supplier'][ind] = company.strip()
-                        balance_file['expense_marking'][ind] = marking.strip()
+    print(f'Start {balance_name}')
 
-                    doc_marking = balance_file['expense_marking'][ind]
-                    doc_date = balance_file['expense_date'][ind]
+    if os.path.exists(balance_path):
 
-                    docs_total_usd = float(balance_file['expense_total_usd'][ind])
-                    docs_total_eur = float(balance_file['expense_total_eur'][ind])
-                    docs_total_rub = float(balance_file['expense_total_rub'][ind])
+        # Read the xls file into pandas DataFrame
+        balance_file = read_report(balance_path, usecols=balance_cols,
+                                   skiprows=balance_skip_rows)
 
-                    docs_dict[f'{doc_marking}{doc_date}'] = [ind,
-                                                             docs_total_usd,
-                                                             docs_total_eur,
-                                                             docs_total_rub]
+        # Rename columns
+        for name in balance_rename_cols:
 
-                # Identify the type for fee rows
-                elif 'комиссия' in balance_file['expense_marking'][ind].lower():
+            balance_file.columns.values[balance_rename_cols.index(name)] = (
+                balance_rename_cols[balance_rename_cols.index(name)]
+            )
 
-                    balance_file['expense_type'][ind] = 'комиссия'
+        # Delete various rows
+        balance_file = balance_file.drop(balance_file[balance_file['expense_date'] == 'ДАТА'].index)
+        balance_file = balance_file.drop(balance_file[balance_file['expense_type'] == ' >>>'].index)
 
-                # Identify the type for payment rows (positive number)
-                elif 'оплата' in balance_file['expense_awb'][ind].lower():
+        for ind in balance_file.index:
 
-                    balance_file['expense_type'][ind] = balance_file['expense_awb'][ind]
+            if 'Страница' in str(balance_file['expense_date'][ind]):
 
-                # Turn the expense number to a positive number for rub balance
-                if '-' in str(balance_file['expense_total_rub'][ind]):
+                balance_file = balance_file.drop([ind])
 
-                    balance_file['expense_total_rub'][ind] = str(balance_file['expense_total_rub'][ind])[1:]
+        balance_file.dropna(subset = ['expense_date'], inplace = True)
 
-                # Turn the expense number to a positive number for usd balance
-                elif '-' in str(balance_file['expense_total_usd'][ind]):
+        # Add columns
+        balance_file.insert(loc=13, column='expense_balance_code', value = '')
+        balance_file.insert(loc=14, column='expense_balance_currency', value = '')
+        balance_file.insert(loc=15, column='supplier_id', value = '')
 
-                    balance_file['expense_total_usd'][ind] = str(balance_file['expense_total_usd'][ind])[1:]
+        # Move the amounts to their currency columns and turn the expenses positive
+        if balance_code in usd_balance_codes:
 
-                # Turn the expense number to a positive number for eur balance
-                elif '-' in str(balance_file['expense_total_eur'][ind]):
+            balance_file = normalize_balance_amounts(balance_file, 'usd')
 
-                    balance_file['expense_total_eur'][ind] = str(balance_file['expense_total_eur'][ind])[1:]
+        elif balance_code in rub_balance_codes:
 
-                # Unite records with the same marking and date from Ams origin
-                if ('срезка в ассортименте' in balance_file['expense_type'][ind].lower() or
-                    'срезка гоа' in balance_file['expense_type'][ind].lower() or
-                    'зелень декоративная по объему' in balance_file['expense_type'][ind].lower() or
-                    'горшечные растения' in balance_file['expense_type'][ind].lower()):
+            balance_file = normalize_balance_amounts(balance_file, 'rub')
 
-                    ams_box_index = balance_file['expense_type'][ind].find('[')
-                    ams_box_amount = int(balance_file['expense_full_box'][ind])
-                    ams_marking = balance_file['expense_marking'][ind]
-                    ams_date = balance_file['expense_date'][ind]
-                    ams_total_usd = float(balance_file['expense_total_usd'][ind])
-                    ams_total_eur = float(balance_file['expense_total_eur'][ind])
-                    ams_total_rub = float(balance_file['expense_total_rub'][ind])
-                    balance_file['expense_type'][ind] = balance_file['expense_type'][ind][:ams_box_index + 1] + str(ams_box_amount) + balance_file['expense_type'][ind][ams_box_index + 1:]
-                    ams_type_ind = balance_file['expense_type'][ind].find('[')
-                    ams_type = balance_file['expense_type'][ind][ams_type_ind:].lower()
+        # Fill empty values
+        empty_fill = {'expense_currency_rate':0,
+                      'expense_volume':0,
+                      'expense_weight':0,
+                      'expense_full_box':0,
+                      'expense_content_supplier':'none',
+                      'expense_awb':'none'
+                      }
 
-                    if f'{ams_marking}{ams_date}' not in ams_dict:
+        for column, value in empty_fill.items():
 
-                        ams_dict[f'{ams_marking}{ams_date}'] = [ind,
-                                                                ams_box_amount,
-                                                                ams_total_usd,
-                                                                ams_total_eur,
-                                                                ams_total_rub,
-                                                                False,
-                                                                balance_file['expense_type'][ind].lower().strip()]
+            empty_rows = (balance_file[column].isnull() |
+                          balance_file[column].astype(str).str.lower().isin([' ', '', 'nan']))
 
-                    else:
+            balance_file[column] = balance_file[column].mask(empty_rows, value)
 
-                        ams_dict[f'{ams_marking}{ams_date}'][1] += ams_box_amount
-                        ams_dict[f'{ams_marking}{ams_date}'][2] += ams_total_usd
-                        ams_dict[f'{ams_marking}{ams_date}'][3] += ams_total_eur
-                        ams_dict[f'{ams_marking}{ams_date}'][4] += ams_total_rub
-                        ams_dict[f'{ams_marking}{ams_date}'][6] += ams_type
+        for column in balance_text_cols:
 
-                        extra_ams_rows.append(ind)
+            balance_file[column] = balance_file[column].astype(str)
 
-                # Turn all the strings of the row lowercase
-                for column in balance_rename_cols:
+        # Find and separate awb number and company name of shipment
+        content_supplier = balance_file['expense_content_supplier']
 
-                    balance_file[column][ind] = str(balance_file[column][ind]).lower().strip(',.·•').strip()
+        awb_rows = (content_supplier.str[1:4].str.isnumeric() &
+                    content_supplier.str[5:13].str.isnumeric())
 
-                balance_file['expense_balance_code'][ind] = balance_code
-                balance_file['supplier_id'][ind] = 2
+        balance_file.loc[awb_rows, 'expense_awb'] = content_supplier[awb_rows].str[:13].str.strip()
+        balance_file.loc[awb_rows, 'expense_content_supplier'] = content_supplier[awb_rows].str[13:].str.strip()
 
-            # Update united rows
-            for info_ams in ams_dict.values():
+        # Identify the types of the rows by the classification rules
+        rule_context = {'balance_name':balance_codes_translation[balance_code],
+                        'docs_dict':docs_dict,
+                        'drop_rows':extra_precool_rows}
 
-                balance_file['expense_full_box'][info_ams[0]] = info_ams[1]
-                balance_file['expense_total_usd'][info_ams[0]] = info_ams[2]
-                balance_file['expense_total_eur'][info_ams[0]] = info_ams[3]
-                balance_file['expense_total_rub'][info_ams[0]] = info_ams[4]
-                balance_file['expense_type'][info_ams[0]] = info_ams[6]
+        file_rule_hits = classify_balance_rows(balance_file, rule_context)
 
-            balance_file = balance_file.drop(extra_ams_rows)
-            extra_ams_rows.clear()
+        # Normalize and sort the data
+        for ind in balance_file.index:
 
-            # Unite records with the same flight number, marking and date of non Ams origin
-            for ind in balance_file.index:
+            # Unite records with the same marking and date from Ams origin
+            if ('срезка в ассортименте' in balance_file['expense_type'][ind].lower() or
+                'срезка гоа' in balance_file['expense_type'][ind].lower() or
+                'зелень декоративная по объему' in balance_file['expense_type'][ind].lower() or
+                'горшечные растения' in balance_file['expense_type'][ind].lower()):
 
-                if 'консолидат' in balance_file['expense_type'][ind]:
+                ams_box_index = balance_file['expense_type'][ind].find('[')
+                ams_box_amount = int(balance_file['expense_full_box'][ind])
+                ams_marking = balance_file['expense_marking'][ind]
+                ams_date = balance_file['expense_date'][ind]
+                ams_total_usd = float(balance_file['expense_total_usd'][ind])
+                ams_total_eur = float(balance_file['expense_total_eur'][ind])
+                ams_total_rub = float(balance_file['expense_total_rub'][ind])
+                balance_file['expense_type'][ind] = balance_file['expense_type'][ind][:ams_box_index + 1] + str(ams_box_amount) + balance_file['expense_type'][ind][ams_box_index + 1:]
+                ams_type_ind = balance_file['expense_type'][ind].find('[')
+                ams_type = balance_file['expense_type'][ind][ams_type_ind:].lower()
 
-                    fl_marking = balance_file['expense_marking'][ind]
-                    fl_weight = float(balance_file['expense_weight'][ind])
-                    fl_awb = balance_file['expense_awb'][ind]
-                    fl_date = balance_file['expense_date'][ind]
-                    fl_total_usd = float(balance_file['expense_total_usd'][ind])
-                    fl_total_eur = float(balance_file['expense_total_eur'][ind])
-                    fl_total_rub = float(balance_file['expense_total_rub'][ind])
+                if f'{ams_marking}{ams_date}' not in ams_dict:
 
-                    if f'{fl_marking}{fl_awb}{fl_date}' not in consolidation_dict:
+                    ams_dict[f'{ams_marking}{ams_date}'] = [ind,
+                                                            ams_box_amount,
+                                                            ams_total_usd,
+                                                            ams_total_eur,
+                                                            ams_total_rub,
+                                                            False,
+                                                            balance_file['expense_type'][ind].lower().strip()]
 
-                        consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'] = [ind,
-                                                                                fl_weight,
-                                                                                fl_marking,
-                                                                                fl_awb,
-                                                                                fl_date,
-                                                                                fl_total_usd,
-                                                                                fl_total_eur,
-                                                                                fl_total_rub,
-                                                                                'no']
+                else:
 
-                    else:
-                        consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'][1] += fl_weight
-                        consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'][5] += fl_total_usd
-                        consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'][6] += fl_total_eur
-                        consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'][7] += fl_total_rub
-                        extra_rows.append(ind)
+                    ams_dict[f'{ams_marking}{ams_date}'][1] += ams_box_amount
+                    ams_dict[f'{ams_marking}{ams_date}'][2] += ams_total_usd
+                    ams_dict[f'{ams_marking}{ams_date}'][3] += ams_total_eur
+                    ams_dict[f'{ams_marking}{ams_date}'][4] += ams_total_rub
+                    ams_dict[f'{ams_marking}{ams_date}'][6] += ams_type
 
-            # Update united rows
-            for info_cons in consolidation_dict.values():
+                    extra_ams_rows.append(ind)
 
-                balance_file['expense_weight'][info_cons[0]] = info_cons[1]
-                balance_file['expense_total_usd'][info_cons[0]] = info_cons[5]
-                balance_file['expense_total_eur'][info_cons[0]] = info_cons[6]
-                balance_file['expense_total_rub'][info_cons[0]] = info_cons[7]
+            # Turn all the strings of the row lowercase, amounts stay float
+            for column in balance_rename_cols:
 
-            # Remove rows that were added to it's match
-            consolidation_dict.clear()
+                if column in balance_amount_cols:
 
-            # Remove empty pre-cooling rows
-            balance_file = balance_file.drop(extra_precool_rows)
-            extra_precool_rows.clear()            
+                    continue
 
-            # Remove rows that were added to it's match
-            balance_file = balance_file.drop(extra_rows)
-            extra_rows.clear()
+                balance_file[column][ind] = str(balance_file[column][ind]).lower().strip(',.·•').strip()
 
-            # Unite ams shipments and docs cost with the same marking and date
-            for ams_name, info_ams in ams_dict.items():
+            balance_file['expense_balance_code'][ind] = balance_code
+            balance_file['supplier_id'][ind] = 2
 
-                for doc_name, info_doc in docs_dict.items():
+        # Update united rows
+        for info_ams in ams_dict.values():
 
-                    if (ams_name == doc_name and
-                        info_ams[5] is False):
+            balance_file['expense_full_box'][info_ams[0]] = info_ams[1]
+            balance_file['expense_total_usd'][info_ams[0]] = info_ams[2]
+            balance_file['expense_total_eur'][info_ams[0]] = info_ams[3]
+            balance_file['expense_total_rub'][info_ams[0]] = info_ams[4]
+            balance_file['expense_type'][info_ams[0]] = info_ams[6]
 
-                        info_ams[5] = True
-                        info_ams[2] += info_doc[1]
-                        info_ams[3] += info_doc[2]
-                        info_ams[4] += info_doc[3]
+        balance_file = balance_file.drop(extra_ams_rows)
+        extra_ams_rows.clear()
 
-                        balance_file['expense_total_usd'][info_ams[0]] = info_ams[2]
-                        balance_file['expense_total_eur'][info_ams[0]] = info_ams[3]
-                        balance_file['expense_total_rub'][info_ams[0]] = info_ams[4]
+        # Unite records with the same flight number, marking and date of non Ams origin
+        for ind in balance_file.index:
 
-                        balance_file = balance_file.drop(info_doc[0])
+            if 'консолидат' in balance_file['expense_type'][ind]:
 
-            ams_dict.clear()
-            docs_dict.clear()
+                fl_marking = balance_file['expense_marking'][ind]
+                fl_weight = float(balance_file['expense_weight'][ind])
+                fl_awb = balance_file['expense_awb'][ind]
+                fl_date = balance_file['expense_date'][ind]
+                fl_total_usd = float(balance_file['expense_total_usd'][ind])
+                fl_total_eur = float(balance_file['expense_total_eur'][ind])
+                fl_total_rub = float(balance_file['expense_total_rub'][ind])
 
-            print(f'Save and return {balance_name}')
+                if f'{fl_marking}{fl_awb}{fl_date}' not in consolidation_dict:
 
-            if os.path.exists('C:/autocargo_reports/export/'):
+                    consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'] = [ind,
+                                                                            fl_weight,
+                                                                            fl_marking,
+                                                                            fl_awb,
+                                                                            fl_date,
+                                                                            fl_total_usd,
+                                                                            fl_total_eur,
+                                                                            fl_total_rub,
+                                                                            'no']
 
-                directory_name = 'C:/autocargo_reports/export/'
+                else:
+                    consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'][1] += fl_weight
+                    consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'][5] += fl_total_usd
+                    consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'][6] += fl_total_eur
+                    consolidation_dict[f'{fl_marking}{fl_awb}{fl_date}'][7] += fl_total_rub
+                    extra_rows.append(ind)
 
-            else:
+        # Update united rows
+        for info_cons in consolidation_dict.values():
 
-                directory_name = 'C:/'
+            balance_file['expense_weight'][info_cons[0]] = info_cons[1]
+            balance_file['expense_total_usd'][info_cons[0]] = info_cons[5]
+            balance_file['expense_total_eur'][info_cons[0]] = info_cons[6]
+            balance_file['expense_total_rub'][info_cons[0]] = info_cons[7]
 
-                print('Couldnt find a path to save the file, saving to the disc C')
+        # Remove rows that were added to it's match
+        consolidation_dict.clear()
+
+        # Remove empty pre-cooling rows
+        balance_file = balance_file.drop(extra_precool_rows)
+        extra_precool_rows.clear()            
+
+        # Remove rows that were added to it's match
+        balance_file = balance_file.drop(extra_rows)
+        extra_rows.clear()
+
+        # Unite ams shipments and docs cost with the same marking and date
+        for ams_name, info_ams in ams_dict.items():
+
+            for doc_name, info_doc in docs_dict.items():
+
+                if (ams_name == doc_name and
+                    info_ams[5] is False):
 
-            balance_xls_path = f'{directory_name}balance_{balance_code}_{balance_day}_{balance_month_full}_{balance_year}.xlsx'
+                    info_ams[5] = True
+                    info_ams[2] += info_doc[1]
+                    info_ams[3] += info_doc[2]
+                    info_ams[4] += info_doc[3]
 
-            balance_file.to_excel(balance_xls_path)
+                    balance_file['expense_total_usd'][info_ams[0]] = info_ams[2]
+                    balance_file['expense_total_eur'][info_ams[0]] = info_ams[3]
+                    balance_file['expense_total_rub'][info_ams[0]] = info_ams[4]
 
-            if os.path.exists(balance_path):
+                    balance_file = balance_file.drop(info_doc[0])
 
-                os.remove(balance_path)
+        ams_dict.clear()
+        docs_dict.clear()
 
-            # Check if balance_file DataFrame exists
-            if not balance_file.empty:
+        print(f'Save and return {balance_name}')
 
-                balance_df_list.append(balance_file)
+        if os.path.exists('C:/autocargo_reports/export/'):
+
+            directory_name = 'C:/autocargo_reports/export/'
 
         else:
 
-            print(f'Path {balance_path} is not valid!')
+            directory_name = 'C:/'
+
+            print('Couldnt find a path to save the file, saving to the disc C')
+
+        balance_xls_path = f'{directory_name}balance_{balance_code}_{balance_day}_{balance_month_full}_{balance_year}.xlsx'
+
+        balance_file.to_excel(balance_xls_path)
+
+        if os.path.exists(balance_path):
+
+            os.remove(balance_path)
+
+        return balance_file, file_rule_hits
+
+    print(f'Path {balance_path} is not valid!')
+
+    return None, {}
+
+# Clean balance reports
+def prepare_balance(balance_day, balance_month_full, balance_year, parallel=False, workers=None):
+
+    """
+    This function prepares balance and truck reports
+    for the future import to the database
+
+    With parallel set to True the reports are cleaned by a pool of
+    workers processes (by default one per processor), the DataFrames
+    are returned in the order of the balance codes anyway.
+
+    """
+    # List of df to be returned
+    balance_df_list = []
+
+    # Rows of every classification rule in all the balance files
+    balance_rule_hits = {}
+
+    # Total count of the balances available to check in the Autocargo
+    balance_count = 12
+
+    balance_codes = range(1, balance_count + 1)
+
+    # Clean the balance reports, import them to the database and create a sale info
+    if parallel:
+
+        # Reports are independent, every worker cleans whole reports
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+
+            balance_results = list(executor.map(prepare_balance_file, balance_codes,
+                                                repeat(balance_day), repeat(balance_month_full),
+                                                repeat(balance_year)))
+
+    else:
+
+        balance_results = [prepare_balance_file(balance_code, balance_day, balance_month_full, balance_year)
+                           for balance_code in balance_codes]
+
+    for balance_file, file_rule_hits in balance_results:
+
+        for rule_name, rule_hit in file_rule_hits.items():
+
+            balance_rule_hits[rule_name] = balance_rule_hits.get(rule_name, 0) + rule_hit
+
+        # Check if balance_file DataFrame exists
+        if balance_file is not None and not balance_file.empty:
+
+            balance_df_list.append(balance_file)
+
+    for rule_name, rule_hit in balance_rule_hits.items():
+
+        print(f'Balance rows classified as {rule_name}: {rule_hit}')
 
     return balance_df_list
 
@@ -533,9 +668,6 @@ def prepare_truck(truck_day, truck_month_full, truck_year):
                          'shipment_weight_fact', 'shipment_weight_vol', 'shipment_date',
                          'shipment_volume', 'shipment_comment']
 
-    # Fix the ARGB hex values error by making it white
-    RGB.__set__ = __rgb_set_fixed__
-
     # Clean the truck reports and import them to the database
     truck_name_df = f'truck_{truck_day}_{truck_month_full}_{truck_year}'
     truck_path = f'C:/autocargo_reports/{truck_name_df}.xlsx'
@@ -545,8 +677,8 @@ def prepare_truck(truck_day, truck_month_full, truck_year):
     if os.path.exists(truck_path):
 
         # Read the CSV file into a pandas DataFrame
-        truck_file = pd.read_excel(truck_path, usecols=truck_cols,
-                                    skiprows=truck_skip_rows, engine='openpyxl')
+        truck_file = read_report(truck_path, usecols=truck_cols,
+                                 skiprows=truck_skip_rows)
 
         # Rename columns
         for name in truck_rename_cols:
@@ -0,0 +1,535 @@
+"""
+This module contains the reader of the xlsx reports from AutoCargo
+and IP Handlers with pluggable engines, and the benchmark comparing
+the engines on the shapes of the reports.
+
+- 'calamine' engine reads only the cell values with the Rust-based
+python-calamine library, the styles of the reports are never parsed;
+
+- 'openpyxl' engine is the previous reading path, the broken colors
+of the AutoCargo reports are replaced by white while reading;
+
+read_report tries the engines in the order of reader_engines and falls
+back to the next engine when the library is missing or the read fails.
+
+Parsed reports are kept in the cache folder by the hash of the report
+content, a report read again unchanged (a repeated or crashed run)
+is loaded from the cache instead of being parsed. Reports read with
+an explicit engine bypass the cache.
+
+The cache keeps the reports only in Parquet format, which holds data and
+no code, and needs the pyarrow library: without pyarrow the reports are
+parsed every time, a report that Parquet can't keep exactly (values or
+types change on the way back) is not cached.
+
+"""
+
+import os
+import time
+import json
+import hashlib
+import pandas as pd
+
+from openpyxl.styles.colors import WHITE, RGB
+__old_rgb_set__ = RGB.__set__
+
+# Fix the ARGB hex values error by making it white
+def __rgb_set_fixed__(self, instance, value):
+
+    try:
+
+        __old_rgb_set__(self, instance, value)
+
+    except ValueError as e:
+
+        if e.args[0] == 'Colors must be aRGB hex values':
+            __old_rgb_set__(self, instance, WHITE)
+
+def read_calamine(report_path, usecols, skiprows):
+
+    """
+    This function reads the report with the calamine engine of pandas
+    """
+
+    return pd.read_excel(report_path, usecols=usecols,
+                         skiprows=skiprows, engine='calamine')
+
+def read_openpyxl(report_path, usecols, skiprows):
+
+    """
+    This function reads the report with the openpyxl engine of pandas
+    """
+
+    # Fix the ARGB hex values error by making it white
+    RGB.__set__ = __rgb_set_fixed__
+
+    return pd.read_excel(report_path, usecols=usecols,
+                         skiprows=skiprows, engine='openpyxl')
+
+# Reading functions by engine name
+reader_functions = {'calamine':read_calamine,
+                    'openpyxl':read_openpyxl}
+
+# Engines tried by read_report, the first one is preferred
+reader_engines = ['calamine', 'openpyxl']
+
+# Engines failed to read a report in this process
+failed_engines = set()
+
+# Columns and skipped rows of the reports, by report name
+report_shapes = {'balance':('A:C, E, G, J, K, M, N, R, U:W', [0, 1, 2, 3, 4]),
+                 'truck':('A, B, C, D:F, H:K, M, N, P, Q', [0, 1]),
+                 'history':('C:D, F, H, I, K, L, N, O, Q', None),
+                 'saldo':('A:B, E:K', [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])}
+
+# Folder of the parsed reports and its size limit in bytes,
+# the least recently used reports are deleted above the limit
+cache_directory = 'C:/autocargo_reports/cache/'
+cache_size_limit = 512 * 1024 * 1024
+
+# Extensions of the parsed reports in the cache
+cache_extensions = ['.parquet']
+
+# Set to False when pyarrow is missing, the reports are parsed every time
+cache_enabled = True
+
+def cache_ready():
+
+    """
+    This function creates the cache folder if needed
+    and returns True when the folder can be used
+
+    """
+
+    if not cache_enabled:
+
+        return False
+
+    if os.path.exists(cache_directory):
+
+        return True
+
+    try:
+
+        os.makedirs(cache_directory, exist_ok=True)
+
+    except OSError:
+
+        print(f'Couldnt create the cache folder {cache_directory}, reports are parsed every time')
+
+        return False
+
+    return True
+
+def content_hash(report_path):
+
+    """
+    This function returns the hash of the report content
+    """
+
+    report_hash = hashlib.blake2b(digest_size=16)
+
+    with open(report_path, 'rb') as report:
+
+        for chunk in iter(lambda: report.read(1048576), b''):
+
+            report_hash.update(chunk)
+
+    return report_hash.hexdigest()
+
+def report_content_hash(report_path):
+
+    """
+    This function returns the content hash of the report, the hash is kept
+    with the size and modification time of the report and is counted again
+    only when the size or the modification time has changed
+
+    """
+
+    report_stat = os.stat(report_path)
+
+    path_key = hashlib.blake2b(os.path.abspath(report_path).encode(), digest_size=8).hexdigest()
+
+    stamp_path = f'{cache_directory}{path_key}.json'
+
+    if os.path.exists(stamp_path):
+
+        try:
+
+            with open(stamp_path, encoding='utf-8') as stamp_file:
+
+                report_stamp = json.load(stamp_file)
+
+        except (OSError, ValueError):
+
+            report_stamp = {}
+
+        if (report_stamp.get('size') == report_stat.st_size and
+            report_stamp.get('mtime') == report_stat.st_mtime_ns):
+
+            return report_stamp['hash']
+
+    report_hash = content_hash(report_path)
+
+    # Written to a temporary file first, the workers of prepare_balance read the stamps too
+    stamp_temp_path = f'{stamp_path}.{os.getpid()}.tmp'
+
+    with open(stamp_temp_path, 'w', encoding='utf-8') as stamp_file:
+
+        json.dump({'path':os.path.abspath(report_path),
+                   'size':report_stat.st_size,
+                   'mtime':report_stat.st_mtime_ns,
+                   'hash':report_hash}, stamp_file)
+
+    os.replace(stamp_temp_path, stamp_path)
+
+    return report_hash
+
+def cache_base_path(report_path, usecols, skiprows):
+
+    """
+    This function returns the path of the parsed report in the cache
+    without extension, the path depends on the report content,
+    on the columns and rows read from it and on the engines of reader_engines
+
+    """
+
+    shape_key = hashlib.blake2b(repr((usecols, skiprows, reader_engines)).encode(),
+                                digest_size=4).hexdigest()
+
+    return f'{cache_directory}{report_content_hash(report_path)}_{shape_key}'
+
+def load_cached_report(cache_base):
+
+    """
+    This function returns the parsed report from the cache or None,
+    the modification time of the loaded file is updated for the eviction
+
+    """
+
+    for extension in cache_extensions:
+
+        cache_path = f'{cache_base}{extension}'
+
+        if not os.path.exists(cache_path):
+
+            continue
+
+        try:
+
+            report_file = pd.read_parquet(cache_path)
+
+            os.utime(cache_path)
+
+        except Exception as e:
+
+            print(f'Couldnt load the cached report {cache_path}: {e}')
+
+            continue
+
+        return report_file
+
+    return None
+
+def store_cached_report(report_file, cache_base):
+
+    """
+    This function saves the parsed report to the cache in Parquet format
+    and evicts the old reports. A report changed by Parquet is not saved,
+    without pyarrow the cache is turned off for the process.
+
+    """
+
+    global cache_enabled
+
+    cache_path = f'{cache_base}.parquet'
+    cache_temp_path = f'{cache_path}.{os.getpid()}.tmp'
+
+    try:
+
+        report_file.to_parquet(cache_temp_path)
+
+        restored_file = pd.read_parquet(cache_temp_path)
+
+    except ImportError:
+
+        print('Pyarrow is not installed, reports are parsed every time')
+
+        cache_enabled = False
+
+        return
+
+    except Exception as e:
+
+        restored_file = None
+
+        print(f'Couldnt save the report to the cache in Parquet format: {e}')
+
+    if not (restored_file is not None and restored_file.equals(report_file) and
+            restored_file.dtypes.equals(report_file.dtypes)):
+
+        if os.path.exists(cache_temp_path):
+
+            os.remove(cache_temp_path)
+
+        return
+
+    os.replace(cache_temp_path, cache_path)
+
+    evict_cache()
+
+def evict_cache(size_limit=None):
+
+    """
+    This function deletes the least recently used parsed reports until
+    the cache size is within size_limit (cache_size_limit by default),
+    and the stamps of the reports without parsed reports
+
+    """
+
+    if size_limit is None:
+
+        size_limit = cache_size_limit
+
+    cache_files = []
+
+    for file_name in os.listdir(cache_directory):
+
+        # Pickle files of the earlier cache are never loaded
+        if file_name.endswith('.pkl'):
+
+            try:
+
+                os.remove(f'{cache_directory}{file_name}')
+
+            except OSError:
+
+                pass
+
+            continue
+
+        if os.path.splitext(file_name)[1] in cache_extensions:
+
+            try:
+
+                file_stat = os.stat(f'{cache_directory}{file_name}')
+
+            except OSError:
+
+                continue
+
+            cache_files.append((file_stat.st_mtime, file_stat.st_size, file_name))
+
+    cache_files.sort()
+
+    cache_size = sum(file_size for _, file_size, _ in cache_files)
+
+    kept_hashes = set()
+
+    for _, file_size, file_name in cache_files:
+
+        if cache_size > size_limit:
+
+            try:
+
+                os.remove(f'{cache_directory}{file_name}')
+
+            except OSError:
+
+                pass
+
+            cache_size -= file_size
+
+        else:
+
+            kept_hashes.add(file_name.split('_')[0])
+
+    for file_name in os.listdir(cache_directory):
+
+        if not file_name.endswith('.json'):
+
+            continue
+
+        try:
+
+            with open(f'{cache_directory}{file_name}', encoding='utf-8') as stamp_file:
+
+                report_hash = json.load(stamp_file)['hash']
+
+            if report_hash not in kept_hashes:
+
+                os.remove(f'{cache_directory}{file_name}')
+
+        except (OSError, ValueError, KeyError):
+
+            continue
+
+def read_report(report_path, usecols=None, skiprows=None, engine=None, use_cache=True):
+
+    """
+    This function reads the xlsx report into pandas DataFrame from the cache
+    when the report was parsed before and hasn't changed since, otherwise
+    parses it and keeps it in the cache (use_cache set to False skips the cache).
+
+    A report read with the engine given skips the cache, the cached reports
+    are parsed by the engines of reader_engines.
+
+    """
+
+    cache_base = None
+
+    if use_cache and engine is None and cache_ready():
+
+        try:
+
+            cache_base = cache_base_path(report_path, usecols, skiprows)
+
+            report_file = load_cached_report(cache_base)
+
+            if report_file is not None:
+
+                print(f'Report {os.path.basename(report_path)} is loaded from the cache')
+
+                return report_file
+
+        except OSError as e:
+
+            print(f'Couldnt use the cache for {report_path}: {e}')
+
+            cache_base = None
+
+    report_file = parse_report(report_path, usecols, skiprows, engine)
+
+    if cache_base is not None:
+
+        try:
+
+            store_cached_report(report_file, cache_base)
+
+        except OSError as e:
+
+            print(f'Couldnt save {report_path} to the cache: {e}')
+
+    return report_file
+
+def parse_report(report_path, usecols=None, skiprows=None, engine=None):
+
+    """
+    This function parses the xlsx report into pandas DataFrame with the engine
+    or, by default, with the first engine of reader_engines that works.
+
+    An engine whose library is missing is not tried again in the process,
+    any other error of an engine makes the next engine read the report.
+
+    """
+
+    engines = reader_engines if engine is None else [engine]
+
+    engines = [engine_name for engine_name in engines
+               if engine_name not in failed_engines] or ['openpyxl']
+
+    for engine_name in engines[:-1]:
+
+        try:
+
+            return reader_functions[engine_name](report_path, usecols, skiprows)
+
+        except ImportError:
+
+            print(f'Reader engine {engine_name} is not installed, trying the next engine')
+
+            failed_engines.add(engine_name)
+
+        except Exception as e:
+
+            print(f'Reader engine {engine_name} couldnt read {report_path}: {e}')
+
+    return reader_functions[engines[-1]](report_path, usecols, skiprows)
+
+def benchmark_readers(report_paths, repeat_count=3):
+
+    """
+    This function reads every report with every engine repeat_count times
+    and prints the best time of the engines, report_paths is a dictionary
+    of the report paths and the names of their shapes in report_shapes.
+
+    Returns DataFrame with the report, engine, rows and best time in seconds.
+
+    """
+
+    benchmark_rows = []
+
+    for report_path, shape_name in report_paths.items():
+
+        if not os.path.exists(report_path):
+
+            print(f'Path {report_path} is not valid!')
+
+            continue
+
+        usecols, skiprows = report_shapes[shape_name]
+
+        for engine_name, reader_function in reader_functions.items():
+
+            best_time = None
+
+            try:
+
+                for _ in range(repeat_count):
+
+                    start_time = time.perf_counter()
+
+                    report_file = reader_function(report_path, usecols, skiprows)
+
+                    read_time = time.perf_counter() - start_time
+
+                    best_time = read_time if best_time is None else min(best_time, read_time)
+
+            except Exception as e:
+
+                print(f'Reader engine {engine_name} couldnt read {report_path}: {e}')
+
+                continue
+
+            print(f'{os.path.basename(report_path)} {engine_name}: '
+                  f'{len(report_file.index)} rows in {best_time:.3f} s')
+
+            benchmark_rows.append({'report':os.path.basename(report_path),
+                                   'engine':engine_name,
+                                   'rows':len(report_file.index),
+                                   'seconds':round(best_time, 4)})
+
+    return pd.DataFrame(benchmark_rows)
+
+# Benchmark of the engines on the reports waiting for import
+if __name__ == '__main__':
+
+    benchmark_paths = {}
+
+    for reports_directory in ['C:/autocargo_reports/', 'C:/Users/USER/Downloads/']:
+
+        if not os.path.exists(reports_directory):
+
+            print(f'Path {reports_directory} is not valid!')
+
+            continue
+
+        for file_name in sorted(os.listdir(reports_directory)):
+
+            if file_name.startswith('balance_') and file_name.endswith('.xlsx'):
+
+                benchmark_paths[f'{reports_directory}{file_name}'] = 'balance'
+
+            elif file_name.startswith('truck_') and file_name.endswith('.xlsx'):
+
+                benchmark_paths[f'{reports_directory}{file_name}'] = 'truck'
+
+            elif file_name == 'UFOTRUCK_ShipmentsHistory.xlsx':
+
+                benchmark_paths[f'{reports_directory}{file_name}'] = 'history'
+
+            elif file_name == 'UFOTRUCK_Saldocard.xlsx':
+
+                benchmark_paths[f'{reports_directory}{file_name}'] = 'saldo'
+
+    benchmark_readers(benchmark_paths)
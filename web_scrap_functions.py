@@ -19,6 +19,8 @@ from webdriver_manager.firefox import GeckoDriverManager
 import pyautogui
 from lxml import etree
 
+from report_reader import read_report
+
 def parse_currency(day, month_num, year, code):
 
     """
@@ -587,8 +589,7 @@ def precool_extract_data(path_list):
                                'expense_account']
 
         # Read the CSV file into pandas DataFrame
-        history_file = pd.read_excel(path_list[0], usecols=history_cols,
-                                     engine='openpyxl')
+        history_file = read_report(path_list[0], usecols=history_cols)
 
         # Rename columns
         for name in history_rename_cols:
@@ -637,8 +638,8 @@ def precool_extract_data(path_list):
                              'precool_invoice', 'precool_currency', 'expense_total']
 
         # Read the CSV file into pandas DataFrame
-        saldo_file = pd.read_excel(path_list[1], usecols=saldo_cols,
-                                skiprows=saldo_skip_rows, engine='openpyxl')
+        saldo_file = read_report(path_list[1], usecols=saldo_cols,
+                                 skiprows=saldo_skip_rows)
 
         # Rename columns
         for name in saldo_rename_cols: